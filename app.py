@@ -1,35 +1,44 @@
 import os
 import time
 import random
-from datetime import datetime
+from http.cookies import CookieError, SimpleCookie
 import streamlit as st
-import pandas as pd
-import pytz
+import streamlit.components.v1 as components
 
 from backend.db import init_db
-from backend import auth
+from backend import auth, distractors, profiling
 from backend.logic import (
-    today_local_str, start_or_resume_session, build_quiz_batch,
+    today_local_str, start_or_resume_session,
     record_served_words, create_session_items, save_attempt,
-    session_summary, mark_session_completed, get_user_stats, count_words, add_word_rows
+    session_summary, mark_session_completed, get_user_stats, get_user_history, get_leaderboard,
+    count_words, add_word_rows,
+    prefetch_next_batch, take_prefetched_batch, resume_session_items,
+    available_languages, user_language, set_user_language
 )
 from frontend.quiz_page import quiz
 
 APP_TITLE = "Vocabulary Improvement"
-IST = pytz.timezone("Asia/Kolkata")
+SESSION_COOKIE = "wordapp_session"
 
-def ensure_init():
+@st.cache_resource(show_spinner=False)
+def bootstrap():
+    """Migrate the schema and seed an empty word bank, once per process rather than per rerun."""
     init_db()
 
     # Auto-seed words from CSV if empty
+    if count_words() == 0:
+        csv_path = os.path.join(os.path.dirname(__file__), "data", "words.csv")
+        if os.path.exists(csv_path):
+            from backend.importer import import_csv  # only the seeding/admin paths need it
+            import_csv(csv_path)
+    # confusable-word lists for harder distractors; built in the background the first time
+    distractors.schedule_update(build_missing=True)
+    return True
+
+def ensure_init():
     try:
-        if count_words() == 0:
-            csv_path = os.path.join(os.path.dirname(__file__), "data", "words.csv")
-            if os.path.exists(csv_path):
-                df = pd.read_csv(csv_path).fillna("")
-                rows = [[r["text"], r["definition"], r.get("part_of_speech",""), r.get("language","en")] for r in df.to_dict("records")]
-                add_word_rows(rows)
-    except Exception as e:
+        bootstrap()
+    except Exception as e:  # failures are not cached, so the next rerun retries
         st.warning(f"Could not seed words: {e}")
     if "auth_user" not in st.session_state:
         st.session_state.auth_user = None
@@ -43,15 +52,64 @@ def ensure_init():
         st.session_state.start_time = None
     if "review_after" not in st.session_state:
         st.session_state.review_after = False
+    # tokens used to ride in the URL; drop any still there from an old link
+    st.query_params.pop("session", None)
+    # Reload / new tab: the session cookie restores the login without bcrypt, once per browser session
+    if st.session_state.auth_user is None and "session_token" not in st.session_state:
+        token = session_cookie()
+        user = auth.verify_session_token(token, client_id()) if token else None
+        st.session_state.auth_user = user
+        st.session_state.session_token = token if user else ("" if token else None)
+
+def _client_headers():
+    """Headers of the browser's WebSocket handshake (Streamlit 1.36 has no public API for them)."""
+    try:
+        from streamlit.web.server.websocket_headers import _get_websocket_headers
+        return _get_websocket_headers() or {}
+    except Exception:
+        return {}
+
+def client_id():
+    """What a session token is bound to: the browser's User-Agent."""
+    return _client_headers().get("User-Agent", "")
+
+def session_cookie():
+    jar = SimpleCookie()
+    try:
+        jar.load(_client_headers().get("Cookie", ""))
+    except CookieError:
+        return None
+    morsel = jar.get(SESSION_COOKIE)
+    return morsel.value if morsel else None
+
+def sync_session_cookie():
+    """Write the session token to the cookie ("" clears it) from a zero-height component.
+
+    The token never goes into the URL, so it stays out of history, Referer headers and access logs.
+    """
+    token = st.session_state.get("session_token")
+    if token is None:
+        return
+    components.html(f"""<script>
+        const secure = window.parent.location.protocol === "https:" ? "; Secure" : "";
+        window.parent.document.cookie = "{SESSION_COOKIE}={token}; Max-Age={auth.SESSION_TTL if token else 0}"
+            + "; Path=/; SameSite=Strict" + secure;
+    </script>""", height=0)
 
 def local_date():
-    return datetime.now(IST).strftime("%Y-%m-%d")
+    return today_local_str()
 
 def header():
     st.title(APP_TITLE)
     if st.session_state.auth_user:
         st.caption(f"Welcome, **{st.session_state.auth_user['username']}** — {local_date()} (Asia/Kolkata)")
-        st.button("Sign out", on_click=lambda: st.session_state.update({'auth_user': None, 'current_session_id': None, 'current_index': 0, 'current_items': [], 'review_after': False}))
+        st.button("Sign out", on_click=sign_out)
+
+def sign_out():
+    if st.session_state.auth_user:
+        auth.revoke_session_tokens(st.session_state.auth_user["id"])
+    st.session_state.update({'auth_user': None, 'current_session_id': None, 'current_index': 0, 'current_items': [], 'review_after': False,
+                             'session_token': ""})
 
 def sign_up():
     st.subheader("Create account")
@@ -82,6 +140,8 @@ def sign_in():
         user = auth.verify_password(username, pw)
         if user:
             st.session_state.auth_user = user
+            st.session_state.session_token = auth.issue_session_token(user, client_id())
+            sync_session_cookie()
             st.session_state["redirect_to_quiz"] = True
         else:
             st.error("Invalid username or password.")
@@ -90,28 +150,84 @@ def admin_words_panel():
     st.subheader("Admin · Manage Words")
     uploaded = st.file_uploader("Upload CSV with columns: text,definition,part_of_speech,language", type=["csv"])
     if uploaded is not None:
+        bar = st.progress(0.0, text="Importing…")
+        size = max(uploaded.size, 1)
+
+        def show(report):
+            # the upload's read offset is the fraction of the file consumed so far
+            done = min(uploaded.tell() / size, 1.0) if hasattr(uploaded, "tell") else 0.0
+            bar.progress(done, text=f"{report['rows_read']:,} rows · {report['rows_per_sec']:,.0f} rows/s")
+
         try:
-            df = pd.read_csv(uploaded).fillna("")
-            required = {"text", "definition"}
-            if not required.issubset(df.columns):
-                st.error("CSV must contain at least 'text' and 'definition' columns.")
-            else:
-                from backend.logic import add_word_rows, count_words
-                rows = df[["text","definition","part_of_speech","language"]].fillna("").values.tolist() \
-                    if {"part_of_speech","language"}.issubset(df.columns) \
-                    else [[r["text"], r["definition"], r.get("part_of_speech",""), r.get("language","en")] for r in df.to_dict("records")]
-                add_word_rows(rows)
-                st.success(f"Imported {len(rows)} words. Total now: {count_words()}")
+            from backend.importer import import_csv
+            report = import_csv(uploaded, progress=show)
+            bar.progress(1.0, text="Done")
+            st.success(f"Imported {report['rows_read']:,} rows in {report['seconds']}s "
+                       f"({report['inserted']:,} new, {report['updated']:,} updated, {report['skipped']:,} skipped). "
+                       f"Total now: {count_words():,}")
         except Exception as e:
             st.error(f"Import failed: {e}")
 
+def admin_performance_panel():
+    st.subheader("Admin · Performance")
+    on = st.toggle("Profiling enabled", value=profiling.enabled(),
+                   help="Times backend calls and SQL statements. Switching reopens pooled connections.")
+    if on != profiling.enabled():
+        profiling.enable(on)
+    if st.button("Reset counters"):
+        profiling.reset()
+    snap = profiling.snapshot()
+    col1, col2 = st.columns(2)
+    col1.download_button("Download JSON", profiling.to_json(snap), "wordapp-profile.json", "application/json")
+    col2.download_button("Download Prometheus", profiling.to_prometheus(snap), "wordapp-profile.prom", "text/plain")
+    columns = ("count", "mean_ms", "p50_ms", "p95_ms", "p99_ms", "max_ms", "sum_ms")
+    st.write("**Backend functions** (bucketed percentiles)")
+    st.dataframe([{"function": name, **{c: h[c] for c in columns}}
+                  for name, h in sorted(snap["functions"].items(), key=lambda kv: -kv[1]["sum_ms"])],
+                 use_container_width=True)
+    st.write("**SQL statements** (execute time; rows and VM steps include fetching)")
+    st.dataframe([{"statement": sql, **{c: s[c] for c in columns},
+                   "fetch_ms": s["fetch_ms"], "rows": s["rows"], "vm_steps": s["vm_steps"],
+                   "locked": s["locked"], "errors": s["errors"]}
+                  for sql, s in sorted(snap["statements"].items(), key=lambda kv: -kv[1]["sum_ms"])],
+                 use_container_width=True)
+    st.write("**Write lock**")
+    lock, first = snap["lock_wait"], snap["first_write"]
+    st.caption(f"BEGIN IMMEDIATE waiting for the write lock: {lock['count']} "
+               f"(p95 {lock['p95_ms']} ms, max {lock['max_ms']} ms). "
+               f"Writes that took the lock themselves: {first['count']} "
+               f"(p95 {first['p95_ms']} ms, max {first['max_ms']} ms; includes the write itself, "
+               f"so an upper bound on their wait). Statement times above include any lock wait.")
+    st.write("**Connection pools**")
+    wait = snap["pool_wait"]
+    st.caption(f"Waits for a free connection while profiling: {wait['count']} "
+               f"(p95 {wait['p95_ms']} ms, max {wait['max_ms']} ms)")
+    st.dataframe(snap["pools"], use_container_width=True)
+
 def dashboard():
     st.subheader("Dashboard")
-    stats = get_user_stats(st.session_state.auth_user["id"])
+    user_id = st.session_state.auth_user["id"]
+    stats = get_user_stats(user_id)
     col1, col2, col3 = st.columns(3)
     col1.metric("Accuracy", f"{stats['accuracy']}%")
     col2.metric("Attempts", f"{stats['attempts']}")
     col3.metric("Mastered (Box≥4)", f"{stats['mastered']}")
+    # per-day aggregates kept on write: one short read per user, however long the history
+    history = get_user_history(user_id)
+    if any(d["attempts"] for d in history):
+        st.write("**Last 30 days**")
+        col1, col2 = st.columns(2)
+        col1.caption("Accuracy per day (%)")
+        col1.line_chart(history, x="date", y="accuracy")
+        col2.caption("Average response time (ms)")
+        col2.line_chart(history, x="date", y="avg_response_ms")
+        st.caption("Words mastered")
+        st.area_chart(history, x="date", y="mastered_total")
+    top, rank = get_leaderboard(user_id=user_id)
+    if top:
+        st.write("**Leaderboard**" + (f" — you are #{rank}" if rank else ""))
+        st.dataframe([{k: r[k] for k in ("rank", "username", "mastered", "correct", "accuracy")} for r in top],
+                     hide_index=True, use_container_width=True)
     st.write("---")
     st.write("Use the **Quiz** tab in the sidebar to start or resume today's session(s).")
 
@@ -125,8 +241,15 @@ def prepare_new_session():
     # If it's truly new (no items), create 20 fresh items
     if sid != st.session_state.get("current_session_id"):
         st.session_state.current_session_id = sid
-        # Build batch
-        batch = build_quiz_batch(user_id, local_date(), size=20)
+        # Resuming after a reconnect/restart: restore the exact quiz and position
+        items, position = resume_session_items(sid)
+        if items:
+            st.session_state.current_items = items
+            st.session_state.current_index = position
+            st.session_state.start_time = time.time()
+            return
+        # Pick up the batch prefetched during the previous session (built now on a miss)
+        batch = take_prefetched_batch(user_id, local_date(), size=20)
         st.session_state.current_items = batch
         st.session_state.current_index = 0
         st.session_state.start_time = time.time()
@@ -134,15 +257,33 @@ def prepare_new_session():
         record_served_words(user_id, [it["word_id"] for it in batch], local_date())
         # Create DB rows for items
         create_session_items(sid, batch)
+        # Build the following set while this one is being answered
+        prefetch_next_batch(user_id, local_date(), size=20)
 
 from frontend.quiz_page import quiz
 
+def language_picker():
+    """Sidebar choice of quiz language, shown once the bank has more than one."""
+    languages = available_languages()
+    if len(languages) < 2:
+        return
+    user_id = st.session_state.auth_user["id"]
+    current = user_language(user_id)
+    options = sorted(languages)
+    choice = st.sidebar.selectbox("Quiz language", options,
+                                  index=options.index(current) if current in options else 0,
+                                  format_func=lambda lang: f"{lang} ({languages[lang]:,} words)")
+    if choice != current:
+        set_user_language(user_id, choice)
+        # the next Quiz render resumes or starts today's session in the new language
+        st.session_state.update({'current_session_id': None, 'current_index': 0, 'current_items': []})
+
 def main():
     ensure_init()
     if st.session_state.auth_user:
         st.sidebar.title("Navigation")
         if st.session_state.auth_user.get("is_admin"):
-            pages = ["Dashboard", "Quiz", "Admin · Words"]
+            pages = ["Dashboard", "Quiz", "Admin · Words", "Admin · Performance"]
         else:
             pages = ["Dashboard", "Quiz"]
         # Redirect to Quiz if just signed in
@@ -150,10 +291,12 @@ def main():
             page = "Quiz"
         else:
             page = st.sidebar.radio("Go to", pages)
+        language_picker()
     else:
         page = "Sign in / Sign up"
 
     header()
+    sync_session_cookie()
 
     # If signed in, prevent access to sign in/sign up page
     if st.session_state.auth_user and page == "Sign in / Sign up":
@@ -176,6 +319,11 @@ def main():
             st.error("Admins only.")
         else:
             admin_words_panel()
+    elif page == "Admin · Performance":
+        if not st.session_state.auth_user or not st.session_state.auth_user.get("is_admin"):
+            st.error("Admins only.")
+        else:
+            admin_performance_panel()
 
 if __name__ == "__main__":
     main()
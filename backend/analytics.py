@@ -0,0 +1,165 @@
+"""Per-day history and the global leaderboard, read from incrementally kept aggregates.
+
+`user_daily_summary` holds one row per user and local day. It is bumped in
+the same transaction as the write it counts: a new session, newly served
+words, or an answer. `user_stats` (see srs) already carries the lifetime
+totals the leaderboard ranks on. So a chart reads at most `days` primary-key
+rows for one user, and the leaderboard reads the top of one index (of each
+shard, see backend.shards). The read APIs are cached per process for TTL
+seconds. A user's entries are dropped as soon as that user's answers are
+committed.
+"""
+import heapq
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import date, timedelta
+from itertools import islice
+
+TTL = float(os.environ.get("WORDAPP_ANALYTICS_TTL", "60"))
+# cached reads kept per process; history keys carry the day, so old ones must be pushed out
+CACHE_SIZE = int(os.environ.get("WORDAPP_ANALYTICS_CACHE_SIZE", "4096"))
+HISTORY_DAYS = 30
+LEADERBOARD_SIZE = 10
+
+_BUMP_DAY = """
+    INSERT INTO user_daily_summary(user_id, date_local, sessions, attempts, correct, response_ms, responses,
+                                   words_served, mastered)
+    VALUES(?,?,?,?,?,?,?,?,?)
+    ON CONFLICT(user_id, date_local) DO UPDATE SET
+        sessions=sessions+excluded.sessions, attempts=attempts+excluded.attempts,
+        correct=correct+excluded.correct, response_ms=response_ms+excluded.response_ms,
+        responses=responses+excluded.responses, words_served=words_served+excluded.words_served,
+        mastered=mastered+excluded.mastered
+"""
+_HISTORY = """
+    SELECT date_local, sessions, attempts, correct, response_ms, responses, words_served, mastered
+    FROM user_daily_summary WHERE user_id=? AND date_local>? AND date_local<=? ORDER BY date_local
+"""
+_LEADERBOARD = """
+    SELECT s.user_id, u.username, s.mastered, s.correct, s.attempts
+    FROM user_stats s JOIN users u ON u.id = s.user_id
+    ORDER BY s.mastered DESC, s.correct DESC, s.user_id LIMIT ?
+"""
+# users ahead in that order: tied scores go to the lower user id, as on the leaderboard
+_RANK = """
+    SELECT COUNT(*) FROM user_stats
+    WHERE mastered>? OR (mastered=? AND correct>?) OR (mastered=? AND correct=? AND user_id<?)
+"""
+
+
+def bump_day(cur, user_id, date_local, sessions=0, attempts=0, correct=0, response_ms=None,
+             words_served=0, mastered=0):
+    """Add to the user's row for `date_local` inside the caller's transaction."""
+    cur.execute(_BUMP_DAY, (user_id, date_local, sessions, attempts, correct, response_ms or 0,
+                            0 if response_ms is None else attempts, words_served, mastered))
+
+
+class _Cache:
+    """A small TTL cache of read results keyed by (kind, user_id or None, *args).
+
+    Expired entries are dropped when read, and all of them once the cache is
+    full; past that the least recently used entries go.
+    """
+
+    def __init__(self, size=None):
+        self.size = size or CACHE_SIZE
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def get(self, key, load):
+        now = time.monotonic()
+        with self._lock:
+            hit = self._entries.get(key)
+            if hit and hit[0] > now:
+                self._entries.move_to_end(key)
+                return hit[1]
+            if hit:
+                del self._entries[key]
+        value = load()
+        with self._lock:
+            self._entries.pop(key, None)
+            if len(self._entries) >= self.size:
+                for stale in [k for k, (expires, _) in self._entries.items() if expires <= now]:
+                    del self._entries[stale]
+                while len(self._entries) >= self.size:
+                    self._entries.popitem(last=False)
+            self._entries[key] = (now + TTL, value)
+        return value
+
+    def __len__(self):
+        return len(self._entries)
+
+    def invalidate(self, user_id=None):
+        with self._lock:
+            if user_id is None:
+                self._entries.clear()
+            else:
+                for key in [k for k in self._entries if k[1] == user_id]:
+                    del self._entries[key]
+
+
+_cache = _Cache()
+
+
+def invalidate(user_id=None):
+    """Forget cached reads for one user (None: everyone)."""
+    _cache.invalidate(user_id)
+
+
+def history(con, user_id, today, days=HISTORY_DAYS):
+    """One dict per day of the last `days` days (oldest first), zero-filled where nothing happened.
+
+    `mastered_total` is the running count of mastered words, anchored on the
+    lifetime total so days older than the window are included.
+    """
+    def load():
+        start = date.fromisoformat(today) - timedelta(days=days)
+        rows = {r[0]: r for r in con.execute(_HISTORY, (user_id, start.isoformat(), today))}
+        total = (con.execute("SELECT mastered FROM user_stats WHERE user_id=?", (user_id,)).fetchone() or (0,))[0]
+        running = total - sum(r[7] for r in rows.values())
+        out = []
+        for n in range(1, days + 1):
+            day = (start + timedelta(days=n)).isoformat()
+            _, sessions, attempts, correct, response_ms, responses, served, mastered = rows.get(day) or (
+                day, 0, 0, 0, 0, 0, 0, 0)
+            running += mastered
+            out.append({
+                "date": day, "sessions": sessions, "attempts": attempts, "correct": correct,
+                "accuracy": round(correct * 100 / attempts, 1) if attempts else None,
+                "avg_response_ms": round(response_ms / responses) if responses else None,
+                "words_served": served, "mastered": mastered, "mastered_total": running,
+            })
+        return out
+    return _cache.get(("history", user_id, today, days), load)
+
+
+def leaderboard(cons, limit=LEADERBOARD_SIZE):
+    """Top users by words mastered, then correct answers, then user id (reads the head of one index per database).
+
+    `cons` holds a connection to each database with user_stats: one, or every shard.
+    """
+    def load():
+        rows = heapq.merge(*(con.execute(_LEADERBOARD, (limit,)) for con in cons),
+                           key=lambda r: (-r[2], -r[3], r[0]))
+        return [{"rank": rank, "user_id": uid, "username": name, "mastered": mastered, "correct": correct,
+                 "accuracy": round(correct * 100 / attempts, 1) if attempts else 0.0}
+                for rank, (uid, name, mastered, correct, attempts)
+                in enumerate(islice(rows, limit), start=1)]
+    return _cache.get(("leaderboard", None, limit), load)
+
+
+def rank(cons, user_id):
+    """The user's 1-based leaderboard position, or None before their first answer."""
+    def load():
+        for con in cons:
+            row = con.execute("SELECT mastered, correct FROM user_stats WHERE user_id=?", (user_id,)).fetchone()
+            if row:
+                break
+        else:
+            return None
+        mastered, correct = row
+        params = (mastered, mastered, correct, mastered, correct, user_id)
+        return sum(con.execute(_RANK, params).fetchone()[0] for con in cons) + 1
+    return _cache.get(("rank", user_id), load)
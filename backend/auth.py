@@ -1,8 +1,77 @@
+import hashlib
+import hmac
+import multiprocessing
+import os
+import secrets
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
 import bcrypt
-from .db import get_conn
+from . import profiling
+from .db import APP_DIR, get_conn
+
+# bcrypt cost factor for new hashes (existing hashes keep the cost they were made with)
+BCRYPT_ROUNDS = int(os.environ.get("WORDAPP_BCRYPT_ROUNDS", "12"))
+# processes doing bcrypt work; 0 runs it inline on the calling thread
+HASH_WORKERS = int(os.environ.get("WORDAPP_AUTH_WORKERS", str(min(4, os.cpu_count() or 1))))
+# bcrypt jobs allowed in flight before further callers wait their turn
+HASH_QUEUE_LIMIT = int(os.environ.get("WORDAPP_AUTH_QUEUE_LIMIT", "64"))
+# session tokens live in a cookie bound to the browser that signed in; sign-out revokes them early
+SESSION_TTL = int(os.environ.get("WORDAPP_SESSION_TTL", str(2 * 3600)))
+SECRET_PATH = os.path.join(APP_DIR, "data", ".session_secret")
+MIN_SECRET_BYTES = 32
+
+def _hashpw(password, rounds):
+    return bcrypt.hashpw(password, bcrypt.gensalt(rounds))
+
+def _checkpw(password, password_hash):
+    return bcrypt.checkpw(password, password_hash)
+
+_pool = None
+_pool_lock = threading.Lock()
+_slots = threading.BoundedSemaphore(HASH_QUEUE_LIMIT)
+
+def _get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # spawn, not fork: forking a process that runs Streamlit's threads can deadlock the child
+            _pool = ProcessPoolExecutor(max_workers=HASH_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+        return _pool
+
+def _run_bcrypt(fn, *args):
+    """Run a bcrypt call in the worker pool and wait for it.
+
+    The calling thread still blocks; the pool caps bcrypt's CPU use at
+    HASH_WORKERS processes and the number of waiting callers at HASH_QUEUE_LIMIT.
+    """
+    if HASH_WORKERS <= 0:
+        return fn(*args)
+    global _pool
+    with _slots:
+        try:
+            return _get_pool().submit(fn, *args).result()
+        except BrokenProcessPool:  # a worker died; start a fresh pool next time
+            with _pool_lock:
+                _pool = None
+            return fn(*args)
+
+def configure(rounds=None, workers=None):
+    """Change the cost factor and/or pool size (the pool is restarted on next use)."""
+    global BCRYPT_ROUNDS, HASH_WORKERS, _pool
+    if rounds is not None:
+        BCRYPT_ROUNDS = rounds
+    if workers is not None:
+        HASH_WORKERS = workers
+        with _pool_lock:
+            old, _pool = _pool, None
+        if old is not None:
+            old.shutdown(wait=False)
 
 def create_user(username, password, email=None, is_admin=False):
-    password_hash = bcrypt.hashpw(password.encode("utf-8"), bcrypt.gensalt())
+    password_hash = _run_bcrypt(_hashpw, password.encode("utf-8"), BCRYPT_ROUNDS)
     with get_conn() as con:
         cur = con.cursor()
         cur.execute("INSERT INTO users(username, email, password_hash, is_admin) VALUES(?,?,?,?)",
@@ -10,20 +79,121 @@ def create_user(username, password, email=None, is_admin=False):
         con.commit()
         return cur.lastrowid
 
+def _user_from_row(row):
+    if not row:
+        return None
+    return {"id": row[0], "username": row[1], "email": row[2], "password_hash": row[3], "is_admin": bool(row[4]),
+            "token_generation": row[5]}
+
 def find_user(username):
     with get_conn() as con:
         cur = con.cursor()
-        cur.execute("SELECT id, username, email, password_hash, is_admin FROM users WHERE username=?",
+        cur.execute("SELECT id, username, email, password_hash, is_admin, token_generation FROM users WHERE username=?",
                     (username,))
-        row = cur.fetchone()
-        if not row:
-            return None
-        return {"id": row[0], "username": row[1], "email": row[2], "password_hash": row[3], "is_admin": bool(row[4])}
+        return _user_from_row(cur.fetchone())
+
+def get_user(user_id):
+    with get_conn() as con:
+        cur = con.cursor()
+        cur.execute("SELECT id, username, email, password_hash, is_admin, token_generation FROM users WHERE id=?",
+                    (user_id,))
+        return _user_from_row(cur.fetchone())
 
 def verify_password(username, password):
     user = find_user(username)
     if not user:
         return None
-    if bcrypt.checkpw(password.encode("utf-8"), user["password_hash"]):
+    if _run_bcrypt(_checkpw, password.encode("utf-8"), user["password_hash"]):
         return user
     return None
+
+_secret = None
+_secret_lock = threading.Lock()
+
+def _check_secret(secret, source):
+    if len(secret) < MIN_SECRET_BYTES:
+        raise ValueError(f"session secret from {source} is shorter than {MIN_SECRET_BYTES} bytes")
+    return secret
+
+def _load_secret_file():
+    try:
+        with open(SECRET_PATH, "rb") as fh:
+            secret = fh.read()
+    except FileNotFoundError:
+        return None
+    return secret if len(secret) >= MIN_SECRET_BYTES else None
+
+def _create_secret_file():
+    os.makedirs(os.path.dirname(SECRET_PATH), exist_ok=True)
+    # write it fully under a temporary name first, so no reader ever sees a partial secret
+    tmp = f"{SECRET_PATH}.{os.getpid()}.{threading.get_ident()}.tmp"
+    fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "wb") as fh:
+        fh.write(secrets.token_bytes(MIN_SECRET_BYTES))
+        fh.flush()
+        os.fsync(fh.fileno())
+    try:
+        if os.path.exists(SECRET_PATH):  # too short to use (a partial write by an older version)
+            os.replace(tmp, SECRET_PATH)
+        else:
+            try:
+                os.link(tmp, SECRET_PATH)  # never clobbers a secret another process already handed out
+            except FileExistsError:
+                pass
+    finally:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+
+def _session_secret():
+    global _secret
+    with _secret_lock:
+        if _secret is None:
+            env = os.environ.get("WORDAPP_SESSION_SECRET")
+            if env:
+                _secret = _check_secret(env.encode("utf-8"), "WORDAPP_SESSION_SECRET")
+            else:
+                secret = _load_secret_file()
+                if secret is None:
+                    _create_secret_file()
+                    secret = _load_secret_file()
+                _secret = _check_secret(secret or b"", SECRET_PATH)
+        return _secret
+
+def _sign(user_id, expires, password_hash, generation, client):
+    # binding the password hash in means changing the password revokes old tokens,
+    # the generation lets sign-out revoke them too, and the client ties them to one browser
+    msg = (f"{user_id}.{expires}.{generation}.".encode("ascii") + hashlib.sha256(password_hash).digest()
+           + hashlib.sha256(client.encode("utf-8")).digest())
+    return hmac.new(_session_secret(), msg, hashlib.sha256).hexdigest()
+
+def issue_session_token(user, client="", ttl=None):
+    """A signed `id.expiry.signature` token that lets a reconnect from `client` skip bcrypt.
+
+    `client` identifies the browser (e.g. its User-Agent); the token only verifies with the same value.
+    """
+    expires = int(time.time()) + (SESSION_TTL if ttl is None else ttl)
+    signature = _sign(user["id"], expires, user["password_hash"], user["token_generation"], client)
+    return f"{user['id']}.{expires}.{signature}"
+
+def verify_session_token(token, client=""):
+    """The user the token was issued to, or None if it is malformed, expired, revoked, forged or from another client."""
+    try:
+        user_id, expires, signature = token.split(".")
+        user_id, expires = int(user_id), int(expires)
+    except (AttributeError, ValueError):
+        return None
+    if expires < time.time():
+        return None
+    user = get_user(user_id)
+    if not user or not hmac.compare_digest(
+            signature, _sign(user_id, expires, user["password_hash"], user["token_generation"], client)):
+        return None
+    return user
+
+def revoke_session_tokens(user_id):
+    """Invalidate every session token issued to the user so far (on sign-out)."""
+    with get_conn() as con:
+        con.execute("UPDATE users SET token_generation = token_generation + 1 WHERE id=?", (user_id,))
+        con.commit()
+
+profiling.instrument(globals(), "auth")
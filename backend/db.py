@@ -1,86 +1,254 @@
 import os
+import queue
 import sqlite3
-from contextlib import contextmanager
+import threading
+import time
+import zlib
+from contextlib import ExitStack, contextmanager
+from urllib.parse import quote
+
+from . import profiling
+from .migrations import CATALOG_LANGUAGE_TRIGGER, migrate
 
 APP_DIR = os.path.dirname(os.path.dirname(__file__))
 DB_PATH = os.path.join(APP_DIR, "data", "app.db")
 
-def init_db():
+POOL_SIZE = int(os.environ.get("WORDAPP_DB_POOL_SIZE", "8"))
+POOL_TIMEOUT = float(os.environ.get("WORDAPP_DB_POOL_TIMEOUT", "30"))
+# applied to every pooled connection when it is opened
+PRAGMAS = {
+    # only takes effect on a new file (or after one VACUUM), and must come before journal_mode
+    "auto_vacuum": "INCREMENTAL",
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "cache_size": -32768,       # negative = KiB, i.e. a 32 MiB page cache
+    "mmap_size": 268435456,     # 256 MiB
+    "busy_timeout": 5000,       # ms
+    "temp_store": "MEMORY",
+}
+# per-connection LRU of compiled statements (sqlite3's default is 128)
+STATEMENT_CACHE_SIZE = 512
+# shard files for the user-scoped tables of a *new* database (0: everything in DB_PATH);
+# existing databases keep the layout recorded in app_meta until `python -m backend.shards reshard`
+SHARDS = int(os.environ.get("WORDAPP_SHARDS", "0"))
+# session ids carry their shard in the bits above this, so a session id alone finds its file
+SESSION_ID_BITS = 40
+
+def init_db(shards=None):
+    """Migrate the catalog and open its shard layout (`shards`, default SHARDS, only applies to a new database).
+
+    Returns the number of shards.
+    """
     os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
-    with sqlite3.connect(DB_PATH) as con:
-        cur = con.cursor()
-        cur.execute("""
-        CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            username TEXT UNIQUE NOT NULL,
-            email TEXT UNIQUE,
-            password_hash BLOB NOT NULL,
-            is_admin INTEGER DEFAULT 0,
-            joined_at TEXT DEFAULT CURRENT_TIMESTAMP
-        )
-        """)
-        cur.execute("""
-        CREATE TABLE IF NOT EXISTS words (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            text TEXT NOT NULL,
-            definition TEXT NOT NULL,
-            part_of_speech TEXT,
-            language TEXT DEFAULT 'en',
-            created_at TEXT DEFAULT CURRENT_TIMESTAMP
-        )
-        """)
-        cur.execute("""
-        CREATE TABLE IF NOT EXISTS sessions (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER NOT NULL,
-            date_local TEXT NOT NULL,
-            created_at TEXT DEFAULT CURRENT_TIMESTAMP,
-            completed INTEGER DEFAULT 0,
-            FOREIGN KEY(user_id) REFERENCES users(id)
-        )
-        """)
-        cur.execute("""
-        CREATE TABLE IF NOT EXISTS session_items (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            session_id INTEGER NOT NULL,
-            word_id INTEGER NOT NULL,
-            position INTEGER NOT NULL,
-            user_answer TEXT,
-            correct INTEGER DEFAULT 0,
-            created_at TEXT DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY(session_id) REFERENCES sessions(id),
-            FOREIGN KEY(word_id) REFERENCES words(id)
-        )
-        """)
-        cur.execute("""
-        CREATE TABLE IF NOT EXISTS user_day_words (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER NOT NULL,
-            date_local TEXT NOT NULL,
-            word_id INTEGER NOT NULL,
-            UNIQUE(user_id, date_local, word_id)
-        )
-        """)
-        cur.execute("""
-        CREATE TABLE IF NOT EXISTS user_attempts (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER NOT NULL,
-            word_id INTEGER NOT NULL,
-            date_local TEXT NOT NULL,
-            correct INTEGER NOT NULL,
-            response_time_ms INTEGER,
-            box INTEGER DEFAULT 1, -- Leitner box (1-5)
-            last_seen TEXT DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY(user_id) REFERENCES users(id),
-            FOREIGN KEY(word_id) REFERENCES words(id)
-        )
-        """)
-        con.commit()
+    with get_conn() as con:
+        migrate(con)
+    from .shards import open_layout
+    return open_layout(SHARDS if shards is None else shards)
+
+class ConnectionPool:
+    """A bounded pool of tuned SQLite connections for one database file.
+
+    Connections are opened lazily up to `size` and handed to one thread at a
+    time (check_same_thread is off so they can move between Streamlit's
+    script threads). A returned connection is rolled back if it is still
+    inside a transaction, so an interrupted rerun never leaks a write lock.
+    """
+
+    def __init__(self, path, size=None, pragmas=None, timeout=None, catalog=None):
+        self.path = path
+        self.catalog = catalog  # shard pools: the catalog file, attached read-only as `catalog`
+        self.size = size or POOL_SIZE
+        self.pragmas = dict(PRAGMAS if pragmas is None else pragmas)
+        self.timeout = POOL_TIMEOUT if timeout is None else timeout
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._created = 0
+        self._closed = False
+        self.hits = 0
+        self.misses = 0
+        self.waits = 0
+        self.wait_ms = 0.0
+        self.timeouts = 0
+
+    def _connect(self):
+        factory = profiling.ProfiledConnection if profiling.ENABLED else sqlite3.Connection
+        con = sqlite3.connect(self.path, check_same_thread=False, uri=bool(self.catalog),
+                              cached_statements=STATEMENT_CACHE_SIZE, factory=factory)
+        for name, value in self.pragmas.items():
+            con.execute(f"PRAGMA {name}={value}").fetchall()
+        if self.catalog:
+            # words/users resolve to the catalog; read-only, so BEGIN IMMEDIATE locks only this shard
+            con.execute("ATTACH DATABASE ? AS catalog",
+                        (f"file:{quote(os.path.abspath(self.catalog))}?mode=ro",))
+            con.execute(CATALOG_LANGUAGE_TRIGGER)
+        return con
+
+    def acquire(self):
+        try:
+            con = self._idle.get_nowait()
+            self.hits += 1
+            return con
+        except queue.Empty:
+            pass
+        with self._lock:
+            grow = self._created < self.size
+            if grow:
+                self._created += 1
+        if grow:
+            try:
+                con = self._connect()
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                raise
+            self.misses += 1
+            return con
+        t0 = time.perf_counter()
+        try:
+            con = self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            self.timeouts += 1
+            raise sqlite3.OperationalError(f"connection pool exhausted ({self.size} in use)")
+        finally:
+            waited = (time.perf_counter() - t0) * 1000
+            self.waits += 1
+            self.wait_ms += waited
+            if profiling.ENABLED:
+                profiling.pool_wait.observe(waited)
+        return con
+
+    def release(self, con):
+        try:
+            if con.in_transaction:
+                con.rollback()
+        except sqlite3.Error:
+            self._discard(con)
+            return
+        if self._closed:
+            self._discard(con)
+        else:
+            self._idle.put(con)
+
+    def _discard(self, con):
+        with self._lock:
+            self._created -= 1
+        try:
+            con.close()
+        except sqlite3.Error:
+            pass
+
+    def close(self):
+        self._closed = True
+        while True:
+            try:
+                self._discard(self._idle.get_nowait())
+            except queue.Empty:
+                break
+
+    def stats(self):
+        idle = self._idle.qsize()
+        return {
+            "path": self.path, "size": self.size, "open": self._created,
+            "idle": idle, "in_use": self._created - idle,
+            "hits": self.hits, "misses": self.misses, "waits": self.waits,
+            "wait_ms": round(self.wait_ms, 3), "timeouts": self.timeouts,
+        }
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+_pool_options = {}
+
+
+_layouts = {}  # DB_PATH -> shard count recorded in its app_meta
+
+
+def get_pool(path=None, catalog=None):
+    """The process-wide pool for `path` (default: the current DB_PATH)."""
+    path = path or DB_PATH
+    pool = _pools.get(path)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(path)
+            if pool is None:
+                pool = _pools[path] = ConnectionPool(path, catalog=catalog, **_pool_options)
+    return pool
+
+
+def configure_pool(size=None, pragmas=None, timeout=None):
+    """Set pool options and close existing pools; new ones pick the options up."""
+    _pool_options.update({k: v for k, v in (("size", size), ("pragmas", pragmas), ("timeout", timeout))
+                          if v is not None})
+    close_pools()
+
+
+def close_pools():
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+        _layouts.clear()
+    for pool in pools:
+        pool.close()
+
+
+def pool_stats():
+    return [pool.stats() for pool in list(_pools.values())]
+
+
+def shard_count():
+    """Number of shard files holding the user-scoped tables (0: they live in DB_PATH)."""
+    shards = _layouts.get(DB_PATH)
+    if shards is None:
+        with get_conn() as con:
+            row = con.execute("SELECT value FROM app_meta WHERE key='shards'").fetchone()
+        shards = _layouts[DB_PATH] = row[0] if row else 0
+    return shards
+
+
+def set_shard_count(shards):
+    _layouts[DB_PATH] = shards
+
+
+def shard_of(user_id, shards=None):
+    """The shard holding `user_id`'s rows (None when unsharded)."""
+    shards = shard_count() if shards is None else shards
+    if not shards:
+        return None
+    return zlib.crc32(user_id.to_bytes(8, "little", signed=True)) % shards
+
+
+def shard_path(shard, shards=None):
+    """The file of `shard` in a `shards`-file layout; None is the catalog, DB_PATH."""
+    if shard is None:
+        return DB_PATH
+    root, ext = os.path.splitext(DB_PATH)
+    return f"{root}.shard{shard}-of-{shards or shard_count()}{ext}"
+
+
+def user_shards():
+    """Every value of get_conn's `shard` that holds user rows: each shard, or [None] when unsharded."""
+    return list(range(shard_count())) or [None]
+
 
 @contextmanager
-def get_conn():
-    con = sqlite3.connect(DB_PATH)
+def get_conn(user_id=None, session_id=None, shard=None):
+    """A pooled connection to the catalog, or to the shard holding a user's or a session's rows.
+
+    Unsharded, every call gets DB_PATH. Shard connections see the catalog's
+    tables (words, users, ...) read-only under their usual names.
+    """
+    if shard is None and (user_id is not None or session_id is not None) and shard_count():
+        shard = session_id >> SESSION_ID_BITS if session_id is not None else shard_of(user_id)
+    pool = get_pool() if shard is None else get_pool(shard_path(shard), catalog=DB_PATH)
+    con = pool.acquire()
     try:
         yield con
     finally:
-        con.close()
+        pool.release(con)
+
+
+@contextmanager
+def user_conns():
+    """One connection per database holding user rows (every shard, or just DB_PATH)."""
+    with ExitStack() as stack:
+        yield [stack.enter_context(get_conn(shard=shard)) for shard in user_shards()]
@@ -0,0 +1,479 @@
+"""Precomputed "confusable word" lists for harder multiple-choice distractors.
+
+Each word is vectorised with NumPy from its spelling (character 2/3-grams)
+and its definition (TF-IDF over definition terms), hashed into DIM slots.
+The NEIGHBORS most similar words of the same language and part of speech
+are stored in `word_neighbors`, so picking distractors is one indexed
+lookup; words without a list (or NumPy) fall back to random sampling.
+
+Small buckets are compared all-pairs. Large ones are compared within windows
+of several random-hyperplane (LSH) orderings, which keeps the build roughly
+linear in the bank size. Words added later get their lists from `update()`,
+which `add_word_rows` and the importer schedule on a background thread.
+
+The build also stores every word's vector (float16, in `word_vectors`) and
+each bucket's definition-term counts (`definition_terms`), so an update
+vectorises only the new words, and records the score a newcomer must beat to
+enter each word's list, so it rewrites only the lists a new word gets into.
+Older vectors keep the IDF weights they were made with until the next build.
+
+    python -m backend.distractors build
+"""
+import argparse
+import logging
+import math
+import os
+import re
+import threading
+import time
+import zlib
+from array import array
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from .db import get_conn, init_db
+
+log = logging.getLogger(__name__)
+
+ENABLED = os.environ.get("WORDAPP_HARD_DISTRACTORS", "1") == "1"
+NEIGHBORS = 8
+DIM = 256            # hashed slots: first half spelling n-grams, second half definition terms
+TEXT_WEIGHT = 0.6    # share of the cosine similarity that comes from spelling
+EXACT_LIMIT = 20000  # buckets up to this size are compared all-pairs
+WINDOW = 512         # larger buckets: rows are compared within windows of an LSH ordering
+TABLES = 8
+SIGNATURE_BITS = 16
+VECTOR_CHUNK = 16384  # rows vectorised per bincount, bounding its float64 scratch space
+WRITE_CHUNK = 5000    # words whose lists are rewritten per write transaction
+_ID_CHUNK = 500
+_NEIGHBORS = "SELECT word_id, neighbor_id FROM word_neighbors WHERE word_id IN ({ids}) ORDER BY word_id, rank"
+_TOKEN = re.compile(r"[^\W\d_]+")
+_STOPWORDS = frozenset("""
+    the and for with that from into onto this than then them they their its not are was were has have
+    who whom whose which what when where something someone somebody being make made very more most
+""".split())
+
+
+def _numpy():
+    try:
+        import numpy
+    except ImportError:
+        return None
+    return numpy
+
+
+def _grams(text):
+    t = f"#{text.lower()}#"
+    return {t[i:i + n] for n in (2, 3) for i in range(len(t) - n + 1)}
+
+
+def _terms(definition):
+    return [w for w in _TOKEN.findall((definition or "").lower()) if len(w) > 2 and w not in _STOPWORDS]
+
+
+_slots = {}
+
+
+def _slot(feature):
+    slot = _slots.get(feature)
+    if slot is None:
+        # crc32 rather than hash(): slots must not change between processes
+        slot = _slots[feature] = zlib.crc32(feature.encode("utf-8")) % (DIM // 2)
+    return slot
+
+
+def _documents(terms):
+    """(document count, Counter of document frequencies) over per-row term lists."""
+    df = Counter()
+    for ts in terms:
+        df.update(set(ts))
+    return len(terms), df
+
+
+def vectorize(rows, documents=None, terms=None):
+    """Unit-length float32 vectors, one per (text, definition) row.
+
+    Definition terms are weighted by IDF over `documents` (see _documents),
+    by default the definitions of `rows` themselves.
+    """
+    np = _numpy()
+    n = len(rows)
+    half = DIM // 2
+    if terms is None:
+        terms = [_terms(definition) for _, definition in rows]
+    total, df = documents or _documents(terms)
+    idf = {t: math.log((1 + total) / (1 + df[t])) + 1 for t in {t for ts in terms for t in ts}}
+    vecs = np.zeros((n, DIM), dtype=np.float32)
+    for start in range(0, n, VECTOR_CHUNK):
+        flat, weights = array("q"), array("d")
+        for r in range(start, min(n, start + VECTOR_CHUNK)):
+            base = (r - start) * DIM
+            for g in _grams(rows[r][0]):
+                flat.append(base + _slot(g))
+                weights.append(1.0)
+            for t, c in Counter(terms[r]).items():
+                flat.append(base + half + _slot(t))
+                weights.append(c * idf[t])
+        size = min(n, start + VECTOR_CHUNK) - start
+        block = np.bincount(np.frombuffer(flat, dtype=np.int64), np.frombuffer(weights, dtype=np.float64),
+                            minlength=size * DIM)
+        vecs[start:start + size] = block.reshape(size, DIM)
+    for part, weight in ((slice(0, half), TEXT_WEIGHT), (slice(half, DIM), 1 - TEXT_WEIGHT)):
+        norms = np.linalg.norm(vecs[:, part], axis=1, keepdims=True)
+        norms[norms == 0] = 1
+        vecs[:, part] *= math.sqrt(weight) / norms
+    return vecs
+
+
+def _merge(best_ids, best_scores, rows, cand_ids, cand_scores):
+    """Fold candidate (row, score) columns into the running top lists of `rows`."""
+    np = _numpy()
+    k = best_ids.shape[1]
+    ids = np.concatenate([best_ids[rows], cand_ids], axis=1)
+    scores = np.concatenate([best_scores[rows], cand_scores.astype(np.float32)], axis=1)
+    order = np.argsort(ids, axis=1, kind="stable")
+    ids = np.take_along_axis(ids, order, 1)
+    scores = np.take_along_axis(scores, order, 1)
+    # the same pair can come from several LSH tables
+    scores[:, 1:][ids[:, 1:] == ids[:, :-1]] = -np.inf
+    top = np.argsort(-scores, axis=1, kind="stable")[:, :k]
+    best_ids[rows] = np.take_along_axis(ids, top, 1)
+    best_scores[rows] = np.take_along_axis(scores, top, 1)
+
+
+def _compare(vecs, rows, against, best_ids, best_scores):
+    """Offer each of `rows` its closest rows among `against` (both arrays of row positions)."""
+    np = _numpy()
+    sims = vecs[rows] @ vecs[against].T
+    sims[rows[:, None] == against[None, :]] = -np.inf
+    k = min(best_ids.shape[1], len(against))
+    cols = np.argpartition(-sims, k - 1, axis=1)[:, :k]
+    _merge(best_ids, best_scores, rows, against[cols], np.take_along_axis(sims, cols, 1))
+
+
+def nearest(vecs, k=NEIGHBORS, seed=0):
+    """(rows, scores): the k most similar other rows of every row, best first (-1 / -inf pad)."""
+    np = _numpy()
+    n = len(vecs)
+    best_ids = np.full((n, k), -1, dtype=np.int64)
+    best_scores = np.full((n, k), -np.inf, dtype=np.float32)
+    if n < 2:
+        return best_ids, best_scores
+    everything = np.arange(n)
+    if n <= EXACT_LIMIT:
+        for start in range(0, n, WINDOW):
+            _compare(vecs, everything[start:start + WINDOW], everything, best_ids, best_scores)
+        return best_ids, best_scores
+    rng = np.random.default_rng(seed)
+    weights = (1 << np.arange(SIGNATURE_BITS, dtype=np.int64))
+    for table in range(TABLES):
+        planes = rng.standard_normal((DIM, SIGNATURE_BITS)).astype(np.float32)
+        order = np.argsort(((vecs @ planes) > 0) @ weights, kind="stable")
+        # every other table shifts its windows by half, so no pair is always split by a boundary
+        for start in range(-(WINDOW // 2) * (table % 2), n, WINDOW):
+            group = order[max(0, start):start + WINDOW]
+            if len(group) > 1:
+                _compare(vecs, group, group, best_ids, best_scores)
+    return best_ids, best_scores
+
+
+def _high_water(con):
+    row = con.execute("SELECT value FROM app_meta WHERE key='neighbors_high_water'").fetchone()
+    return None if row is None else row[0]
+
+
+def _set_high_water(cur, value):
+    cur.execute("""
+        INSERT INTO app_meta(key, value) VALUES('neighbors_high_water', ?)
+        ON CONFLICT(key) DO UPDATE SET value=excluded.value
+    """, (value,))
+
+
+def _bucket(con, language, pos, max_id, stored=False):
+    """ids and (text, definition) rows of a bucket; with `stored`, also each word's stored vector and threshold."""
+    if not stored:
+        cur = con.execute("""
+            SELECT id, text, definition FROM words
+            WHERE language IS ? AND part_of_speech IS ? AND id<=? ORDER BY id
+        """, (language, pos, max_id))
+        ids, rows = array("q"), []
+        for wid, text, definition in cur:
+            ids.append(wid)
+            rows.append((text, definition))
+        return ids, rows
+    cur = con.execute("""
+        SELECT w.id, w.text, w.definition, v.vector, v.threshold FROM words w
+        LEFT JOIN word_vectors v ON v.word_id = w.id
+        WHERE w.language IS ? AND w.part_of_speech IS ? AND w.id<=? ORDER BY w.id
+    """, (language, pos, max_id))
+    ids, rows, vectors, thresholds = array("q"), [], [], array("d")
+    for wid, text, definition, vector, threshold in cur:
+        ids.append(wid)
+        rows.append((text, definition))
+        vectors.append(vector)
+        thresholds.append(threshold or 0.0)
+    return ids, rows, vectors, thresholds
+
+
+def _load_documents(con, language, pos, terms):
+    """The stored (document count, document frequencies) of a bucket, for `terms` only."""
+    wanted = [""] + sorted(terms)
+    df = Counter()
+    for start in range(0, len(wanted), _ID_CHUNK):
+        chunk = wanted[start:start + _ID_CHUNK]
+        df.update(dict(con.execute(f"""
+            SELECT term, df FROM definition_terms
+            WHERE language=? AND part_of_speech=? AND term IN ({','.join('?' for _ in chunk)})
+        """, (language or "", pos or "", *chunk))))
+    return df.pop("", 0), df
+
+
+def _save_documents(cur, language, pos, total, df, replace=False):
+    """Add a bucket's document count and term frequencies to the stored ones (or replace them)."""
+    key = (language or "", pos or "")
+    if replace:
+        cur.execute("DELETE FROM definition_terms WHERE language=? AND part_of_speech=?", key)
+    cur.executemany("""
+        INSERT INTO definition_terms(language, part_of_speech, term, df) VALUES(?,?,?,?)
+        ON CONFLICT(language, part_of_speech, term) DO UPDATE SET df=df+excluded.df
+    """, [(*key, "", total)] + [(*key, term, count) for term, count in df.items()])
+
+
+def _write_vectors(cur, vectors):
+    cur.executemany("""
+        INSERT INTO word_vectors(word_id, vector) VALUES(?,?)
+        ON CONFLICT(word_id) DO UPDATE SET vector=excluded.vector
+    """, vectors)
+
+
+def _threshold(found, k):
+    # a newcomer must beat the weakest entry of a full list; any positive score fills a short one
+    return found[-1][1] if len(found) >= k else 0.0
+
+
+def _related(a, b):
+    # an inflection of the answer ("abate" / "abated") would be a second right answer
+    a, b = a.lower(), b.lower()
+    return min(len(a), len(b)) >= 4 and (a.startswith(b) or b.startswith(a))
+
+
+def _lists(ids, rows, best_ids, best_scores, positions):
+    """{word_id: [(neighbor_id, score)]} for the given row positions."""
+    out = {}
+    for r in positions:
+        text = rows[r][0]
+        out[ids[r]] = [(ids[c], float(s)) for c, s in zip(best_ids[r].tolist(), best_scores[r].tolist())
+                       if c >= 0 and s > 0 and not _related(text, rows[c][0])]
+    return out
+
+
+def _write_lists(con, lists, k=NEIGHBORS):
+    cur = con.cursor()
+    word_ids = list(lists)
+    for start in range(0, len(word_ids), _ID_CHUNK):
+        chunk = word_ids[start:start + _ID_CHUNK]
+        cur.execute(f"DELETE FROM word_neighbors WHERE word_id IN ({','.join('?' for _ in chunk)})", chunk)
+    cur.executemany("INSERT INTO word_neighbors(word_id, rank, neighbor_id, score) VALUES(?,?,?,?)",
+                    [(wid, rank, nid, score) for wid in word_ids for rank, (nid, score) in enumerate(lists[wid])])
+    cur.executemany("UPDATE word_vectors SET threshold=? WHERE word_id=?",
+                    [(_threshold(lists[wid], k), wid) for wid in word_ids])
+
+
+def build(k=NEIGHBORS, seed=0):
+    """Recompute every word's list from scratch; returns a report (None without NumPy).
+
+    Lists are computed bucket by bucket and written in short transactions, so
+    quiz traffic keeps flowing; readers briefly see a mix of old and new lists.
+    """
+    np = _numpy()
+    if np is None:
+        log.info("numpy is not installed; distractors stay random")
+        return None
+    t0 = time.perf_counter()
+    report = {"words": 0, "buckets": 0, "vectorize_s": 0.0, "nearest_s": 0.0, "write_s": 0.0}
+    with get_conn() as con:
+        max_id = con.execute("SELECT COALESCE(MAX(id), 0) FROM words").fetchone()[0]
+        buckets = con.execute("SELECT DISTINCT language, part_of_speech FROM words").fetchall()
+        for language, pos in buckets:
+            ids, rows = _bucket(con, language, pos, max_id)
+            t1 = time.perf_counter()
+            terms = [_terms(definition) for _, definition in rows]
+            documents = _documents(terms)
+            vecs = vectorize(rows, documents, terms)
+            del terms
+            t2 = time.perf_counter()
+            best_ids, best_scores = nearest(vecs, k, seed)
+            t3 = time.perf_counter()
+            packed = vecs.astype(np.float16)
+            del vecs
+            for start in range(0, len(ids), WRITE_CHUNK):
+                positions = range(start, min(len(ids), start + WRITE_CHUNK))
+                lists = _lists(ids, rows, best_ids, best_scores, positions)
+                con.execute("BEGIN IMMEDIATE")
+                cur = con.cursor()
+                if start == 0:
+                    _save_documents(cur, language, pos, *documents, replace=True)
+                _write_vectors(cur, [(ids[r], packed[r].tobytes()) for r in positions])
+                _write_lists(con, lists, k)
+                con.commit()
+            report["vectorize_s"] += t2 - t1
+            report["nearest_s"] += t3 - t2
+            report["write_s"] += time.perf_counter() - t3
+            report["words"] += len(ids)
+            report["buckets"] += 1
+        con.execute("BEGIN IMMEDIATE")
+        _set_high_water(con.cursor(), max_id)
+        con.commit()
+    report["seconds"] = round(time.perf_counter() - t0, 3)
+    return report
+
+
+def update(k=NEIGHBORS):
+    """Give words added since the last build their lists and put them into the older lists they now belong in.
+
+    Only the new words are vectorised; everyone else's vectors come from
+    `word_vectors`. Returns the number of new words handled; None when the
+    index was never built (see build()) or NumPy is missing.
+    """
+    np = _numpy()
+    if np is None:
+        return None
+    with get_conn() as con:
+        high_water = _high_water(con)
+        if high_water is None:
+            return None
+        max_id = con.execute("SELECT COALESCE(MAX(id), 0) FROM words").fetchone()[0]
+        if max_id <= high_water:
+            return 0
+        buckets = con.execute("SELECT DISTINCT language, part_of_speech FROM words WHERE id>?",
+                              (high_water,)).fetchall()
+        lists, offers, vectors, documents, added = {}, {}, [], [], 0
+        for language, pos in buckets:
+            ids, rows, stored, thresholds = _bucket(con, language, pos, max_id, stored=True)
+            n = len(ids)
+            vecs = np.empty((n, DIM), dtype=np.float16)
+            kept = [r for r in range(n) if stored[r] is not None]
+            if kept:
+                vecs[kept] = np.frombuffer(b"".join(stored[r] for r in kept), dtype=np.float16).reshape(-1, DIM)
+            # the new words, and any from before vectors were stored
+            missing = [r for r in range(n) if stored[r] is None]
+            if missing:
+                terms = [_terms(rows[r][1]) for r in missing]
+                new_total, new_df = _documents(terms)
+                total, df = _load_documents(con, language, pos, new_df)
+                df.update(new_df)
+                vecs[missing] = vectorize([rows[r] for r in missing], (total + new_total, df), terms)
+                vectors += [(ids[r], vecs[r].tobytes()) for r in missing]
+                documents.append((language, pos, new_total, new_df))
+            vecs = vecs.astype(np.float32)
+
+            word_ids = np.frombuffer(ids, dtype=np.int64)
+            fresh = np.flatnonzero(word_ids > high_water)
+            old = np.flatnonzero(word_ids <= high_water)
+            added += len(fresh)
+            best_ids = np.full((n, k), -1, dtype=np.int64)
+            best_scores = np.full((n, k), -np.inf, dtype=np.float32)
+            everything = np.arange(n)
+            for start in range(0, len(fresh), WINDOW):
+                _compare(vecs, fresh[start:start + WINDOW], everything, best_ids, best_scores)
+            lists.update(_lists(ids, rows, best_ids, best_scores, fresh.tolist()))
+            if not len(fresh) or not len(old):
+                continue
+            # the older words' closest newcomers; a list changes only if one beats its threshold
+            for start in range(0, len(old), WINDOW):
+                _compare(vecs, old[start:start + WINDOW], fresh, best_ids, best_scores)
+            limit = np.frombuffer(thresholds, dtype=np.float64)
+            affected = old[best_scores[old, 0] > limit[old]].tolist()
+            found = _lists(ids, rows, best_ids, best_scores, affected)
+            for r in affected:
+                better = [(nid, score) for nid, score in found[ids[r]] if score > thresholds[r]]
+                if better:
+                    offers[ids[r]] = better
+        if offers:
+            old = list(offers)
+            for start in range(0, len(old), _ID_CHUNK):
+                chunk = old[start:start + _ID_CHUNK]
+                cur = con.execute(f"""
+                    SELECT word_id, neighbor_id, score FROM word_neighbors
+                    WHERE word_id IN ({','.join('?' for _ in chunk)}) ORDER BY word_id, rank
+                """, chunk)
+                for wid, nid, score in cur:
+                    offers[wid].append((nid, score))
+            for wid, candidates in offers.items():
+                lists[wid] = sorted(dict(candidates).items(), key=lambda c: -c[1])[:k]
+        con.execute("BEGIN IMMEDIATE")
+        if _high_water(con) != high_water:  # another process got there first
+            con.rollback()
+            return 0
+        cur = con.cursor()
+        _write_vectors(cur, vectors)
+        for language, pos, total, df in documents:
+            _save_documents(cur, language, pos, total, df)
+        _write_lists(con, lists, k)
+        _set_high_water(cur, max_id)
+        con.commit()
+    return added
+
+
+def neighbors(con, word_ids):
+    """{word_id: [neighbour ids, most similar first]} for the words that have a list."""
+    out = defaultdict(list)
+    if not ENABLED:
+        return out
+    word_ids = list(word_ids)
+    cur = con.cursor()
+    for start in range(0, len(word_ids), _ID_CHUNK):
+        chunk = word_ids[start:start + _ID_CHUNK]
+        cur.execute(_NEIGHBORS.format(ids=",".join("?" for _ in chunk)), chunk)
+        for wid, nid in cur.fetchall():
+            out[wid].append(nid)
+    return out
+
+
+_lock = threading.Lock()
+_executor = None
+
+
+def _run(build_missing):
+    try:
+        if update() is None and build_missing:
+            return build()
+    except Exception:
+        log.exception("distractor index update failed")
+
+
+def schedule_update(build_missing=False):
+    """Run update() (or a first build) on a background thread; new words use random distractors meanwhile."""
+    global _executor
+    if not ENABLED:
+        return None
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="distractors")
+        return _executor.submit(_run, build_missing)
+
+
+def wait(timeout=None):
+    """Block until every update scheduled so far has finished."""
+    with _lock:
+        executor = _executor
+    if executor is not None:
+        executor.submit(lambda: None).result(timeout)
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Maintain the confusable-word lists used for distractors.")
+    sub = ap.add_subparsers(dest="command", required=True)
+    sub.add_parser("build", help="recompute every word's list")
+    sub.add_parser("update", help="add lists for words added since the last build")
+    args = ap.parse_args(argv)
+
+    init_db()
+    if args.command == "build":
+        print(build())
+    else:
+        print(f"{update()} new word(s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+"""Streaming CSV import into the word bank.
+
+Rows are read with the csv module and upserted in fixed-size chunks keyed by
+(language, normalized text), so memory stays flat whatever the file size and
+re-importing a list updates definitions instead of duplicating words.
+
+    python -m backend.importer words.csv [--chunk-rows 5000]
+"""
+import argparse
+import csv
+import io
+import time
+from contextlib import contextmanager
+
+from .db import get_conn, init_db
+from . import distractors, wordbank
+
+CHUNK_ROWS = 5000
+DEFAULT_LANGUAGE = "en"
+REQUIRED_COLUMNS = {"text", "definition"}
+
+UPSERT_WORD = """
+    INSERT INTO words(text, definition, part_of_speech, language, text_norm) VALUES(?,?,?,?,?)
+    ON CONFLICT(language, text_norm) DO UPDATE SET
+        definition=excluded.definition, part_of_speech=excluded.part_of_speech
+    WHERE definition IS NOT excluded.definition OR part_of_speech IS NOT excluded.part_of_speech
+"""
+
+
+def normalize_text(text):
+    return " ".join(text.split()).lower()
+
+
+def word_row(text, definition, part_of_speech=None, language=None):
+    """Clean one (text, definition, pos, language) row into upsert parameters, or None to skip it."""
+    text = (text or "").strip()
+    definition = (definition or "").strip()
+    if not text or not definition:
+        return None
+    language = (language or "").strip() or DEFAULT_LANGUAGE
+    return (text, definition, (part_of_speech or "").strip(), language, normalize_text(text))
+
+
+def upsert_rows(cur, params):
+    """Upsert cleaned rows inside the caller's transaction; returns (inserted, updated).
+
+    A key repeated within `params` is written once, as the rows one after the
+    other would leave it (the first spelling, the last definition and part of
+    speech), so it counts as one insert or update rather than an insert and
+    an update.
+    """
+    merged = {}
+    for row in params:
+        first = merged.get((row[3], row[4]))
+        merged[(row[3], row[4])] = row if first is None else (first[0],) + row[1:]
+    params = list(merged.values())
+    cur.execute("SELECT COALESCE(MAX(id), 0) FROM words")
+    high_water = cur.fetchone()[0]
+    before = cur.connection.total_changes
+    cur.executemany(UPSERT_WORD, params)
+    changed = cur.connection.total_changes - before
+    cur.execute("SELECT COUNT(*) FROM words WHERE id>?", (high_water,))
+    inserted = cur.fetchone()[0]
+    return inserted, changed - inserted
+
+
+@contextmanager
+def _text_stream(source):
+    if isinstance(source, str):
+        with open(source, newline="", encoding="utf-8-sig") as fh:
+            yield fh
+    elif isinstance(source, io.TextIOBase):
+        yield source
+    else:  # binary file-likes, e.g. Streamlit's UploadedFile
+        fh = io.TextIOWrapper(source, encoding="utf-8-sig", newline="")
+        try:
+            yield fh
+        finally:
+            fh.detach()  # leave the caller's file open
+
+
+def import_csv(source, chunk_rows=CHUNK_ROWS, progress=None):
+    """Stream a words CSV into the bank; returns a report dict.
+
+    Each chunk is upserted and committed in its own short write transaction,
+    so quiz traffic can interleave with a long import. `progress(report)` is
+    called after every chunk. The word-bank version is bumped once at the end.
+    """
+    t0 = time.perf_counter()
+    report = {"rows_read": 0, "inserted": 0, "updated": 0, "skipped": 0, "chunks": 0,
+              "seconds": 0.0, "rows_per_sec": 0.0}
+    with _text_stream(source) as fh, get_conn() as con:
+        reader = csv.DictReader(fh)
+        if not REQUIRED_COLUMNS.issubset(reader.fieldnames or ()):
+            raise ValueError("CSV must contain at least 'text' and 'definition' columns.")
+        try:
+            chunk = []
+            for rec in reader:
+                report["rows_read"] += 1
+                params = word_row(rec.get("text"), rec.get("definition"),
+                                  rec.get("part_of_speech"), rec.get("language"))
+                if params is None:
+                    report["skipped"] += 1
+                    continue
+                chunk.append(params)
+                if len(chunk) >= chunk_rows:
+                    _write_chunk(con, chunk, report, t0, progress)
+                    chunk = []
+            if chunk:
+                _write_chunk(con, chunk, report, t0, progress)
+        finally:
+            # committed chunks stay even if a later one fails, so always publish them
+            if con.in_transaction:
+                con.rollback()
+            if report["inserted"] or report["updated"]:
+                con.execute("BEGIN IMMEDIATE")
+                wordbank.bump_version(con.cursor(), rewritten=bool(report["updated"]))
+                con.commit()
+                wordbank.publish(con)
+    if report["inserted"]:
+        distractors.schedule_update()
+    _tick(report, t0)
+    return report
+
+
+def _write_chunk(con, chunk, report, t0, progress):
+    con.execute("BEGIN IMMEDIATE")
+    inserted, updated = upsert_rows(con.cursor(), chunk)
+    con.commit()
+    report["inserted"] += inserted
+    report["updated"] += updated
+    report["chunks"] += 1
+    _tick(report, t0)
+    if progress:
+        progress(dict(report))
+
+
+def _tick(report, t0):
+    report["seconds"] = round(time.perf_counter() - t0, 3)
+    report["rows_per_sec"] = round(report["rows_read"] / report["seconds"], 1) if report["seconds"] else 0.0
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Import a words CSV (text,definition,part_of_speech,language).")
+    ap.add_argument("path")
+    ap.add_argument("--chunk-rows", type=int, default=CHUNK_ROWS)
+    args = ap.parse_args(argv)
+
+    init_db()
+    report = import_csv(args.path, args.chunk_rows,
+                        progress=lambda r: print(f"\r{r['rows_read']} rows, {r['rows_per_sec']:.0f} rows/s",
+                                                 end="", flush=True))
+    print()
+    print(report)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,39 @@
+import os
 import random
 import time
 from datetime import datetime
 from collections import defaultdict
-from .db import get_conn
+from contextlib import nullcontext
+from .db import get_conn, shard_of, user_conns
+from . import analytics, distractors, importer, prefetch, profiling, srs, wordbank, writer
 import pytz
 
 IST = pytz.timezone("Asia/Kolkata")
+# keeps `IN (...)` lookups well under SQLite's host-parameter limit for bulk batches
+_ID_CHUNK = 500
+# share of each batch given to due spaced-repetition reviews; new words fill the rest
+REVIEW_RATIO = float(os.environ.get("WORDAPP_REVIEW_RATIO", "0.5"))
+# sampling rounds spent looking for words the user has never answered
+_NEW_WORD_ROUNDS = 3
+
+# hot-path statements; tests/test_migrations.py checks that each one is served by an index
+_OPEN_SESSION = """
+    SELECT id FROM sessions WHERE user_id=? AND date_local=? AND completed=0 AND language=?
+    ORDER BY id DESC LIMIT 1
+"""
+_SERVED_TODAY = "SELECT word_id FROM user_day_words WHERE user_id=? AND date_local=?"
+_ANSWER_ITEM = "UPDATE session_items SET user_answer=?, correct=? WHERE session_id=? AND word_id=?"
+_SESSION_ITEMS = """
+    SELECT si.word_id, w.text, w.definition, w.part_of_speech, si.option_ids, si.user_answer
+    FROM session_items si JOIN words w ON w.id = si.word_id
+    WHERE si.session_id=? ORDER BY si.position ASC
+"""
+_SESSION_SUMMARY = """
+    SELECT si.word_id, w.text, w.definition, si.correct, si.user_answer
+    FROM session_items si JOIN words w ON w.id = si.word_id
+    WHERE si.session_id=? ORDER BY si.position ASC
+"""
+_USER_STATS = "SELECT attempts, correct, mastered FROM user_stats WHERE user_id=?"
 
 def today_local_str():
     return datetime.now(IST).strftime("%Y-%m-%d")
@@ -17,131 +45,312 @@ def count_words():
         return cur.fetchone()[0]
 
 def add_word_rows(rows):
+    """Upsert (text, definition, part_of_speech, language) rows, deduplicated on normalized text."""
+    params = [p for p in (importer.word_row(*row) for row in rows) if p]
     with get_conn() as con:
+        con.execute("BEGIN IMMEDIATE")
         cur = con.cursor()
-        cur.executemany(
-            "INSERT INTO words(text, definition, part_of_speech, language) VALUES(?,?,?,?)",
-            rows
-        )
+        inserted, updated = importer.upsert_rows(cur, params)
+        if inserted or updated:
+            wordbank.bump_version(cur, rewritten=bool(updated))
         con.commit()
+        wordbank.publish(con)  # write the next snapshot for every process to map
+    if inserted:
+        distractors.schedule_update()
+    return inserted, updated
+
+def _pick_distractors(index, correct_id, answer, k=4, pos=None, similar=(), language=None):
+    """Up to k (index row, text) pairs with distinct texts (never equal to `answer`).
+
+    Taken at random from `similar` (the word's confusable neighbours) first,
+    then from the same part of speech, then from anywhere in `language`.
+    Each text is read from the index once.
+    """
+    picked, seen_texts, tried = [], {answer}, []
+    for wid in random.sample(similar, len(similar)):
+        row = index.row_of(wid)
+        if row is None or wid == correct_id:
+            continue
+        text = index.texts[row]
+        if text in seen_texts:
+            continue
+        seen_texts.add(text)
+        picked.append((row, text))
+        tried.append(row)
+        if len(picked) == k:
+            return picked
+    buckets = [index.bucket(language, pos), index.bucket(language)] if pos else [index.bucket(language)]
+    for rows in buckets:  # fallback to any
+        while len(picked) < k:
+            sampled = index.sample_rows(rows, k - len(picked), {correct_id}, skip_rows=tried)
+            if not sampled:
+                break
+            tried += sampled
+            for r in sampled:
+                text = index.texts[r]
+                if text not in seen_texts:
+                    seen_texts.add(text)
+                    picked.append((r, text))
+    return picked
+
+def _make_item(index, wid, text, definition, pos, option_ids=None, similar=(), language=None):
+    if option_ids is None:
+        language = language or index.language_of(wid)
+        choices = [(index.ids[r], t) for r, t in _pick_distractors(index, wid, text, 4, pos, similar, language)]
+        choices.append((wid, text))
+        random.shuffle(choices)
+        option_ids = [oid for oid, _ in choices]
+        options = [t for _, t in choices]
+    else:
+        options = [text if oid == wid else index.text_of(oid) for oid in option_ids]
+    return {
+        "word_id": wid, "question": definition, "answer": text, "options": options, "pos": pos,
+        "option_ids": option_ids,
+    }
 
 def get_random_distractors(correct_id, k=4, pos=None):
     with get_conn() as con:
-        cur = con.cursor()
-        if pos:
-            cur.execute("SELECT id, text FROM words WHERE id<>? AND part_of_speech=? ORDER BY RANDOM() LIMIT ?",
-                        (correct_id, pos, k))
-            rows = cur.fetchall()
-            if len(rows) < k:  # fallback to any
-                need = k - len(rows)
-                cur.execute("SELECT id, text FROM words WHERE id<>? ORDER BY RANDOM() LIMIT ?",
-                            (correct_id, need))
-                rows += cur.fetchall()
-        else:
-            cur.execute("SELECT id, text FROM words WHERE id<>? ORDER BY RANDOM() LIMIT ?",
-                        (correct_id, k))
-            rows = cur.fetchall()
-        return [r[1] for r in rows]
-
-def start_or_resume_session(user_id, date_local=None):
-    date_local = date_local or today_local_str()
+        index = wordbank.get_index(con)
+        similar = distractors.neighbors(con, [correct_id])[correct_id]
+    rows = _pick_distractors(index, correct_id, index.text_of(correct_id), k, pos, similar,
+                             index.language_of(correct_id))
+    return [t for _, t in rows]
+
+def user_language(user_id, con=None):
+    """The language the user quizzes in (the default language until they pick one)."""
+    with nullcontext(con) if con else get_conn() as con:
+        row = con.execute("SELECT language FROM users WHERE id=?", (user_id,)).fetchone()
+    return (row and row[0]) or importer.DEFAULT_LANGUAGE
+
+def set_user_language(user_id, language):
     with get_conn() as con:
+        con.execute("UPDATE users SET language=? WHERE id=?", (language, user_id))
+        con.commit()
+    # a batch prefetched in the old language must not be handed over
+    prefetcher.discard(user_id, today_local_str())
+
+def available_languages():
+    """{language: number of words} in the bank."""
+    return wordbank.get_index().language_sizes()
+
+def start_or_resume_session(user_id, date_local=None, language=None):
+    """Today's open session in `language` (default: the user's language), or a new one."""
+    date_local = date_local or today_local_str()
+    with get_conn(user_id=user_id) as con:
+        language = language or user_language(user_id, con)
         cur = con.cursor()
-        cur.execute("SELECT id FROM sessions WHERE user_id=? AND date_local=? AND completed=0 ORDER BY id DESC LIMIT 1",
-                    (user_id, date_local))
+        cur.execute(_OPEN_SESSION, (user_id, date_local, language))
         row = cur.fetchone()
         if row:
             return row[0]
         # create fresh session
-        cur.execute("INSERT INTO sessions(user_id, date_local) VALUES(?,?)", (user_id, date_local))
+        cur.execute("INSERT INTO sessions(user_id, date_local, language) VALUES(?,?,?)",
+                    (user_id, date_local, language))
+        session_id = cur.lastrowid
+        analytics.bump_day(cur, user_id, date_local, sessions=1)
         con.commit()
-        return cur.lastrowid
+        return session_id
 
 def mark_session_completed(session_id):
-    with get_conn() as con:
+    flush_attempts()
+    with get_conn(session_id=session_id) as con:
         cur = con.cursor()
         cur.execute("UPDATE sessions SET completed=1 WHERE id=?", (session_id,))
         con.commit()
 
-def words_already_served_today(user_id, date_local=None):
+def words_already_served_today(user_id, date_local=None, con=None):
     date_local = date_local or today_local_str()
-    with get_conn() as con:
+    with nullcontext(con) if con else get_conn(user_id=user_id) as con:
         cur = con.cursor()
-        cur.execute("SELECT word_id FROM user_day_words WHERE user_id=? AND date_local=?", (user_id, date_local))
+        cur.execute(_SERVED_TODAY, (user_id, date_local))
         return {row[0] for row in cur.fetchall()}
 
-def _next_candidates(user_id, how_many, date_local):
-    """Pick words never shown today for this user."""
-    used = words_already_served_today(user_id, date_local)
-    with get_conn() as con:
-        cur = con.cursor()
-        if used:
-            placeholders = ",".join("?" for _ in used)
-            cur.execute(f"SELECT id, text, definition, part_of_speech FROM words WHERE id NOT IN ({placeholders}) ORDER BY RANDOM() LIMIT ?",
-                        (*used, how_many))
-        else:
-            cur.execute("SELECT id, text, definition, part_of_speech FROM words ORDER BY RANDOM() LIMIT ?",
-                        (how_many,))
-        return cur.fetchall()
-
-def build_quiz_batch(user_id, date_local=None, size=20):
+def _fetch_words(con, ids):
+    """(id, text, definition, part_of_speech) rows for `ids`, in the given order."""
+    cur = con.cursor()
+    by_id = {}
+    for start in range(0, len(ids), _ID_CHUNK):
+        chunk = ids[start:start + _ID_CHUNK]
+        placeholders = ",".join("?" for _ in chunk)
+        cur.execute(f"SELECT id, text, definition, part_of_speech FROM words WHERE id IN ({placeholders})", chunk)
+        by_id.update((row[0], row) for row in cur.fetchall())
+    return [by_id[wid] for wid in ids if wid in by_id]
+
+def _new_words(con, index, user_id, how_many, used, language=None):
+    """Sample words in `language` the user has never answered, skipping `used`."""
+    picked = []
+    for _ in range(_NEW_WORD_ROUNDS):
+        need = how_many - len(picked)
+        if need <= 0:
+            break
+        sampled = index.sample_ids(2 * need, exclude_ids=used, language=language)
+        if not sampled:
+            break
+        used.update(sampled)
+        known = srs.known_words(con.cursor(), user_id, sampled)
+        picked += [wid for wid in sampled if wid not in known][:need]
+    return picked
+
+def _next_candidates(user_id, how_many, date_local, con=None, exclude=(), language=None):
+    """Pick words in `language` never shown today: due reviews (up to REVIEW_RATIO of the batch), then new words.
+
+    Short of new words, more due reviews fill in, then words seen before that are not due yet.
+    Every step reads only the language's partition (index buckets, due-queue range).
+    """
+    with nullcontext(con) if con else get_conn(user_id=user_id) as con:
+        language = language or user_language(user_id, con)
+        skip = set(exclude) | prefetcher.reserved_ids(user_id, date_local)
+        index = wordbank.get_index(con)
+        # new-word candidates are sampled up front so one statement also says which are known;
+        # twice the share left after a full review quota, and at least a whole batch
+        quota = round(how_many * REVIEW_RATIO)
+        wanted = max(how_many, 2 * (how_many - quota))
+        sampled = index.sample_ids(min(wanted, _ID_CHUNK), exclude_ids=skip, language=language)
+        ids, served, known = srs.batch_state(con.cursor(), user_id, language, date_local, quota, sampled, skip)
+        used = served | skip | set(ids)
+        ids += [wid for wid in sampled if wid not in known and wid not in used][:how_many - len(ids)]
+        if len(ids) < how_many:  # mostly known words sampled: keep looking
+            ids += _new_words(con, index, user_id, how_many - len(ids), used | set(sampled), language)
+        if len(ids) < how_many:  # out of new words: more due reviews past the quota
+            ids += srs.due_words(con.cursor(), user_id, language, date_local, how_many - len(ids), skip | set(ids))
+        if len(ids) < how_many:
+            ids += index.sample_ids(how_many - len(ids), exclude_ids=used | set(ids), language=language)
+        random.shuffle(ids)
+        return _fetch_words(con, ids)
+
+def build_quiz_batch(user_id, date_local=None, size=20, exclude=(), language=None):
+    """Build `size` items in `language` (default: the user's) on one connection.
+
+    Distractors come from the neighbour lists and the in-memory index, within the same language.
+    """
     date_local = date_local or today_local_str()
-    # just choose fresh words not used today (no repeats) — review happens after a session
-    rows = _next_candidates(user_id, size, date_local)
-    items = []
-    for idx, (wid, text, definition, pos) in enumerate(rows, start=1):
-        distractors = get_random_distractors(wid, 4, pos)
-        options = distractors + [text]
-        random.shuffle(options)
-        items.append({
-            "word_id": wid, "question": definition, "answer": text, "options": options, "pos": pos
-        })
-    return items
+    with get_conn(user_id=user_id) as con:
+        language = language or user_language(user_id, con)
+        # just choose fresh words not used today (no repeats) — review happens after a session
+        rows = _next_candidates(user_id, size, date_local, con=con, exclude=exclude, language=language)
+        index = wordbank.get_index(con)
+        similar = distractors.neighbors(con, [row[0] for row in rows])
+    return [_make_item(index, wid, text, definition, pos, similar=similar[wid], language=language)
+            for wid, text, definition, pos in rows]
+
+prefetcher = prefetch.Prefetcher(build_quiz_batch)
+
+def prefetch_next_batch(user_id, date_local=None, size=20):
+    """Start building the user's next batch in the background, reserving its words."""
+    prefetcher.schedule(user_id, date_local or today_local_str(), size)
+
+def take_prefetched_batch(user_id, date_local=None, size=20):
+    """The prefetched batch for this user/day, or a freshly built one if there is none to hand over."""
+    date_local = date_local or today_local_str()
+    items = prefetcher.take(user_id, date_local, size)
+    if items is None:
+        return build_quiz_batch(user_id, date_local, size)
+    # words served elsewhere since the prefetch (another tab, say) are swapped out
+    served = words_already_served_today(user_id, date_local)
+    kept = [it for it in items if it["word_id"] not in served]
+    if len(kept) < len(items):
+        kept += build_quiz_batch(user_id, date_local, len(items) - len(kept),
+                                 exclude={it["word_id"] for it in kept})
+    return kept
 
 def record_served_words(user_id, word_ids, date_local=None):
     date_local = date_local or today_local_str()
-    with get_conn() as con:
+    with get_conn(user_id=user_id) as con:
         cur = con.cursor()
         cur.executemany("INSERT OR IGNORE INTO user_day_words(user_id, date_local, word_id) VALUES(?,?,?)",
                         [(user_id, date_local, wid) for wid in word_ids])
+        if cur.rowcount > 0:
+            analytics.bump_day(cur, user_id, date_local, words_served=cur.rowcount)
         con.commit()
 
 def create_session_items(session_id, items):
-    with get_conn() as con:
+    with get_conn(session_id=session_id) as con:
         cur = con.cursor()
-        for i, it in enumerate(items, start=1):
-            cur.execute("INSERT INTO session_items(session_id, word_id, position) VALUES(?,?,?)",
-                        (session_id, it["word_id"], i))
+        cur.executemany("""
+            INSERT INTO session_items(session_id, word_id, position, option_ids, answer_index)
+            VALUES(?,?,?,?,?)
+        """, [(session_id, it["word_id"], i, ",".join(map(str, it["option_ids"])),
+               it["option_ids"].index(it["word_id"]))
+              for i, it in enumerate(items, start=1)])
         con.commit()
 
+def resume_session_items(session_id):
+    """Rehydrate a session's quiz exactly as served: (items, index of the first unanswered item)."""
+    flush_attempts()
+    with get_conn(session_id=session_id) as con:
+        cur = con.cursor()
+        cur.execute(_SESSION_ITEMS, (session_id,))
+        rows = cur.fetchall()
+        index = wordbank.get_index(con)
+    items = []
+    position = None
+    for i, (wid, text, definition, pos, option_ids, user_answer) in enumerate(rows):
+        # sessions created before options were stored get fresh distractors for the same words
+        ids = [int(x) for x in option_ids.split(",")] if option_ids else None
+        items.append(_make_item(index, wid, text, definition, pos, ids))
+        if user_answer is None and position is None:
+            position = i
+    return items, len(items) if position is None else position
+
+def _record_attempt(cur, user_id, session_id, word_id, user_answer, correct, response_time_ms, date_local):
+    cur.execute(_ANSWER_ITEM, (user_answer, 1 if correct else 0, session_id, word_id))
+    box, newly_mastered = srs.apply_attempt(cur, user_id, word_id, correct)
+    # the state's own timestamp, so srs.rebuild_state reproduces last_seen and due_at exactly
+    cur.execute("""
+        INSERT INTO user_attempts(user_id, word_id, date_local, correct, response_time_ms, box, last_seen)
+        VALUES(?,?,?,?,?,?,(SELECT last_seen FROM user_word_state WHERE user_id=? AND word_id=?))
+    """, (user_id, word_id, date_local, 1 if correct else 0, response_time_ms, box, user_id, word_id))
+    analytics.bump_day(cur, user_id, date_local, attempts=1, correct=1 if correct else 0,
+                       response_ms=response_time_ms, mastered=newly_mastered)
+
 def save_attempt(user_id, session_id, word_id, user_answer, correct, response_time_ms=None):
-    with get_conn() as con:
+    """Write one answer synchronously (see submit_attempt for the non-blocking path)."""
+    with get_conn(user_id=user_id) as con:
         cur = con.cursor()
-        cur.execute("UPDATE session_items SET user_answer=?, correct=? WHERE session_id=? AND word_id=?",
-                    (user_answer, 1 if correct else 0, session_id, word_id))
-        # fetch current Leitner box for this user/word (latest)
-        cur.execute("SELECT box FROM user_attempts WHERE user_id=? AND word_id=? ORDER BY id DESC LIMIT 1",
-                    (user_id, word_id))
-        row = cur.fetchone()
-        box = row[0] if row else 1
-        if correct:
-            box = min(5, box + 1)
-        else:
-            box = 1
-        cur.execute("""
-            INSERT INTO user_attempts(user_id, word_id, date_local, correct, response_time_ms, box)
-            VALUES(?,?,?,?,?,?)
-        """, (user_id, word_id, today_local_str(), 1 if correct else 0, response_time_ms, box))
+        _record_attempt(cur, user_id, session_id, word_id, user_answer, correct, response_time_ms,
+                        today_local_str())
         con.commit()
+    analytics.invalidate(user_id)
+
+def _write_attempt_batch(attempts, durable):
+    # the queue groups batches by shard, so this is one transaction on one file
+    with get_conn(user_id=attempts[0][0]) as con:
+        if durable:
+            synchronous = con.execute("PRAGMA synchronous").fetchone()[0]
+            con.execute("PRAGMA synchronous=FULL")
+        try:
+            con.execute("BEGIN IMMEDIATE")
+            cur = con.cursor()
+            for attempt in attempts:
+                _record_attempt(cur, *attempt)
+            con.commit()
+            for user_id in {attempt[0] for attempt in attempts}:
+                analytics.invalidate(user_id)
+        finally:
+            if durable:
+                con.execute(f"PRAGMA synchronous={synchronous}")
+
+attempt_queue = writer.register(writer.WriteBehindQueue(_write_attempt_batch, name="attempt-writer",
+                                                        group_by=lambda attempt: shard_of(attempt[0])))
+
+def submit_attempt(user_id, session_id, word_id, user_answer, correct, response_time_ms=None, durable=None):
+    """Queue an answer for the background writer; returns without touching SQLite.
+
+    With durable=True (or WORDAPP_DURABLE_ATTEMPTS=1) it returns only once the
+    answer is committed with synchronous=FULL, i.e. fsynced, and raises the
+    write's error if it could not be.
+    """
+    attempt_queue.submit((user_id, session_id, word_id, user_answer, correct, response_time_ms,
+                          today_local_str()), durable=durable)
+
+def flush_attempts(timeout=None):
+    attempt_queue.flush(timeout)
 
 def session_summary(session_id):
-    with get_conn() as con:
+    flush_attempts()
+    with get_conn(session_id=session_id) as con:
         cur = con.cursor()
-        cur.execute("""
-        SELECT si.word_id, w.text, w.definition, si.correct, si.user_answer
-        FROM session_items si JOIN words w ON w.id = si.word_id
-        WHERE si.session_id=? ORDER BY si.position ASC
-        """, (session_id,))
+        cur.execute(_SESSION_SUMMARY, (session_id,))
         rows = cur.fetchall()
         total = len(rows)
         correct = sum(1 for r in rows if r[3]==1)
@@ -149,20 +358,23 @@ def session_summary(session_id):
         return {"total": total, "correct": correct, "wrong": wrong_items}
 
 def get_user_stats(user_id):
-    with get_conn() as con:
+    flush_attempts()
+    with get_conn(user_id=user_id) as con:
         cur = con.cursor()
-        cur.execute("""
-            SELECT COUNT(*), SUM(correct) FROM user_attempts WHERE user_id=?
-        """, (user_id,))
-        a = cur.fetchone()
-        attempts = a[0] or 0
-        correct = a[1] or 0
+        cur.execute(_USER_STATS, (user_id,))
+        attempts, correct, mastered = cur.fetchone() or (0, 0, 0)
         accuracy = round((correct/attempts)*100, 1) if attempts else 0.0
-        # mastered = words with last box>=4
-        cur.execute("""
-            SELECT COUNT(DISTINCT word_id) FROM (
-                SELECT word_id, MAX(box) as maxbox FROM user_attempts WHERE user_id=? GROUP BY word_id
-            ) WHERE maxbox>=4
-        """, (user_id,))
-        mastered = cur.fetchone()[0] or 0
         return {"attempts": attempts, "accuracy": accuracy, "mastered": mastered}
+
+def get_user_history(user_id, days=analytics.HISTORY_DAYS):
+    """Per-day accuracy, response time and mastered words for the last `days` days (cached)."""
+    flush_attempts()
+    with get_conn(user_id=user_id) as con:
+        return analytics.history(con, user_id, today_local_str(), days)
+
+def get_leaderboard(limit=analytics.LEADERBOARD_SIZE, user_id=None):
+    """(top `limit` users by words mastered, `user_id`'s rank or None), both cached."""
+    with user_conns() as cons:
+        return analytics.leaderboard(cons, limit), (analytics.rank(cons, user_id) if user_id else None)
+
+profiling.instrument(globals(), "logic")
@@ -0,0 +1,229 @@
+"""Online retention and compaction for the history tables.
+
+    python -m backend.maintenance run [--retain-days 90] [--archive data/archive.db]
+    python -m backend.maintenance enable-incremental-vacuum
+
+Sessions, served words and answers are already counted in
+`user_daily_summary` (one row per user and day, see analytics) as they are
+written. A run archives or deletes raw rows older than the retention window,
+returns free pages to the OS with incremental VACUUM, and refreshes planner
+statistics. Old rows are found through each table's date_local index, in
+small batches, and each batch is its own short write transaction followed by
+a pause, so quiz traffic keeps flowing while it runs. A sharded database (see backend.shards)
+gets one pass per shard file.
+"""
+import argparse
+import os
+import random
+import time
+from collections import defaultdict
+from datetime import date, timedelta
+
+from . import db, srs
+from .db import get_conn, init_db
+from .logic import today_local_str
+
+# sessions, session_items and user_attempts older than this many days are archived/deleted
+RETAIN_DAYS = int(os.environ.get("WORDAPP_RETAIN_DAYS", "90"))
+# user_day_words only matters for today's no-repeat check
+RETAIN_DAY_WORDS = int(os.environ.get("WORDAPP_RETAIN_DAY_WORDS", "2"))
+BATCH_ROWS = 2000
+PAUSE = 0.02          # seconds between batches, leaving the write lock to quiz traffic
+VACUUM_PAGES = 2000   # pages freed per incremental_vacuum step
+_ID_CHUNK = 500
+
+# probes of the per-page-view reads, timed before and after a run
+_PROBES = (
+    "SELECT word_id FROM user_day_words WHERE user_id=? AND date_local=?",
+    "SELECT id FROM sessions WHERE user_id=? AND date_local=? AND completed=0 ORDER BY id DESC LIMIT 1",
+    "SELECT COUNT(*), SUM(correct) FROM user_attempts WHERE user_id=? AND date_local=?",
+)
+
+
+def _ids_in(ids):
+    return ",".join("?" for _ in ids)
+
+
+def _attach_archive(con, path):
+    """Attach the archive file, creating its tables or adding columns the live tables gained since."""
+    con.execute("ATTACH DATABASE ? AS archive", (path,))
+    for table in ("sessions", "session_items", "user_day_words", "user_attempts"):
+        con.execute(f"CREATE TABLE IF NOT EXISTS archive.{table} AS SELECT * FROM main.{table} WHERE 0")
+        present = {row[1] for row in con.execute(f"PRAGMA archive.table_info({table})")}
+        for _, name, type_, *_ in con.execute(f"PRAGMA main.table_info({table})").fetchall():
+            if name not in present:
+                con.execute(f'ALTER TABLE archive.{table} ADD COLUMN "{name}" {type_}')
+
+
+def _move(con, table, column, ids, archive):
+    moved = 0
+    columns = ",".join(f'"{row[1]}"' for row in con.execute(f"PRAGMA main.table_info({table})")) if archive else None
+    for start in range(0, len(ids), _ID_CHUNK):
+        chunk = ids[start:start + _ID_CHUNK]
+        if archive:
+            con.execute(f"INSERT INTO archive.{table}({columns}) SELECT {columns} FROM main.{table} "
+                        f"WHERE {column} IN ({_ids_in(chunk)})", chunk)
+        moved += con.execute(f"DELETE FROM main.{table} WHERE {column} IN ({_ids_in(chunk)})", chunk).rowcount
+    return moved
+
+
+def prune(con, table, cutoff, batch=BATCH_ROWS, pause=PAUSE, archive=False):
+    """Archive/delete rows of `table` dated before `cutoff`.
+
+    Returns rows removed per table (removing sessions takes their session_items along).
+    """
+    removed = defaultdict(int)
+    while True:
+        # a range of the date_local index: rows written with a past date are found wherever their ids fall
+        old = [rid for (rid,) in con.execute(f"SELECT id FROM {table} WHERE date_local<? LIMIT ?",
+                                             (cutoff, batch)).fetchall()]
+        if not old:
+            break
+        con.execute("BEGIN IMMEDIATE")
+        if table == "sessions":
+            removed["session_items"] += _move(con, "session_items", "session_id", old, archive)
+        removed[table] += _move(con, table, "id", old, archive)
+        con.commit()
+        time.sleep(pause)
+    return dict(removed)
+
+
+def reclaim(con, pages=VACUUM_PAGES, pause=PAUSE):
+    """Return free pages to the OS in small steps; returns pages freed (None if auto_vacuum is not incremental)."""
+    if con.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+        return None
+    freed = 0
+    while True:
+        free = con.execute("PRAGMA freelist_count").fetchone()[0]
+        if not free:
+            break
+        # execute() steps this pragma only once (one page); executescript runs it to completion
+        con.executescript(f"PRAGMA incremental_vacuum({min(pages, free)})")
+        freed += free - con.execute("PRAGMA freelist_count").fetchone()[0]
+        time.sleep(pause)
+    return freed
+
+
+def enable_incremental_vacuum(con):
+    """Switch an existing database to auto_vacuum=INCREMENTAL; needs one full (blocking) VACUUM."""
+    con.execute("PRAGMA auto_vacuum=INCREMENTAL")
+    con.execute("VACUUM")
+
+
+def _space(con, path):
+    page_size = con.execute("PRAGMA page_size").fetchone()[0]
+    wal = path + "-wal"
+    return {
+        "db_bytes": os.path.getsize(path),
+        "wal_bytes": os.path.getsize(wal) if os.path.exists(wal) else 0,
+        "used_bytes": (con.execute("PRAGMA page_count").fetchone()[0]
+                       - con.execute("PRAGMA freelist_count").fetchone()[0]) * page_size,
+    }
+
+
+def _row_counts(con):
+    return {t: con.execute(f"SELECT COUNT(*) FROM {t}").fetchone()[0]
+            for t in ("sessions", "session_items", "user_day_words", "user_attempts", "user_daily_summary")}
+
+
+def _probe_ms(con, today, users=200, seed=0):
+    """Mean ms of the per-page-view reads for a sample of users, after one warm-up pass."""
+    max_user = con.execute("SELECT COALESCE(MAX(id), 0) FROM users").fetchone()[0]
+    if not max_user:
+        return 0.0
+    rnd = random.Random(seed)
+    sample = [rnd.randint(1, max_user) for _ in range(users)]
+    for _ in range(2):  # the first pass only warms the page cache
+        t0 = time.perf_counter()
+        for uid in sample:
+            for sql in _PROBES:
+                con.execute(sql, (uid, today)).fetchall()
+    return round((time.perf_counter() - t0) * 1000 / users, 4)
+
+
+def run(retain_days=RETAIN_DAYS, retain_day_words=RETAIN_DAY_WORDS, archive=None, batch=BATCH_ROWS,
+        pause=PAUSE, vacuum=True, analyze=True, today=None, shard=None):
+    """One maintenance pass over DB_PATH (or one shard); returns a report of rows removed, space and time saved."""
+    today = today or today_local_str()
+    cutoff = (date.fromisoformat(today) - timedelta(days=retain_days)).isoformat()
+    day_words_cutoff = (date.fromisoformat(today) - timedelta(days=retain_day_words)).isoformat()
+    report = {"today": today, "cutoff": cutoff, "day_words_cutoff": day_words_cutoff, "seconds": {}}
+    t_start = time.perf_counter()
+    path = db.shard_path(shard)
+    with get_conn(shard=shard) as con:
+        report["rows_before"] = _row_counts(con)
+        report["space_before"] = _space(con, path)
+        report["probe_ms_before"] = _probe_ms(con, today)
+
+        t0 = time.perf_counter()
+        if archive:
+            _attach_archive(con, archive)
+        try:
+            removed = {}
+            for table, day in (("user_day_words", day_words_cutoff), ("sessions", cutoff),
+                               ("user_attempts", cutoff)):
+                removed.update(prune(con, table, day, batch, pause, bool(archive)))
+        finally:
+            if archive:
+                con.execute("DETACH DATABASE archive")
+        report["archived" if archive else "deleted"] = removed
+        if removed.get("user_attempts"):
+            # srs.rebuild_state can no longer replay the full history; app_meta lives in the catalog
+            with get_conn() as meta:
+                srs.mark_pruned(meta.cursor(), cutoff)
+                meta.commit()
+        report["seconds"]["prune"] = round(time.perf_counter() - t0, 3)
+
+        t0 = time.perf_counter()
+        report["pages_freed"] = reclaim(con, pause=pause) if vacuum else None
+        if analyze:
+            con.execute("PRAGMA analysis_limit=1000")
+            con.execute("ANALYZE main")  # a shard's attached catalog is read-only
+        # fold the WAL back in so its file shrinks too (skipped if readers are still on old pages)
+        report["checkpoint"] = con.execute("PRAGMA main.wal_checkpoint(TRUNCATE)").fetchone()
+        report["seconds"]["compact"] = round(time.perf_counter() - t0, 3)
+
+        report["rows_after"] = _row_counts(con)
+        report["space_after"] = _space(con, path)
+        report["probe_ms_after"] = _probe_ms(con, today)
+    report["bytes_saved"] = report["space_before"]["db_bytes"] - report["space_after"]["db_bytes"]
+    report["seconds"]["total"] = round(time.perf_counter() - t_start, 3)
+    return report
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Prune and compact the history tables.")
+    sub = ap.add_subparsers(dest="command", required=True)
+    run_cmd = sub.add_parser("run", help="one online maintenance pass")
+    run_cmd.add_argument("--retain-days", type=int, default=RETAIN_DAYS)
+    run_cmd.add_argument("--retain-day-words", type=int, default=RETAIN_DAY_WORDS)
+    run_cmd.add_argument("--archive", help="move old rows into this SQLite file instead of deleting them")
+    run_cmd.add_argument("--batch", type=int, default=BATCH_ROWS)
+    run_cmd.add_argument("--pause", type=float, default=PAUSE)
+    run_cmd.add_argument("--no-vacuum", action="store_true")
+    sub.add_parser("enable-incremental-vacuum", help="one-off full VACUUM so later runs can shrink the file")
+    args = ap.parse_args(argv)
+
+    init_db()
+    if args.command == "enable-incremental-vacuum":
+        for shard in dict.fromkeys([None] + db.user_shards()):
+            with get_conn(shard=shard) as con:
+                enable_incremental_vacuum(con)
+        print("auto_vacuum=INCREMENTAL")
+        return
+    for shard in db.user_shards():
+        if shard is not None:
+            print(f"== {db.shard_path(shard)} ==")
+        report = run(args.retain_days, args.retain_day_words, args.archive, args.batch, args.pause,
+                     vacuum=not args.no_vacuum, shard=shard)
+        for key, value in report.items():
+            print(f"{key}: {value}")
+        if report["pages_freed"] is None and not args.no_vacuum:
+            print("note: auto_vacuum is not INCREMENTAL, so freed pages stay in the file; "
+                  "run `python -m backend.maintenance enable-incremental-vacuum` once")
+        print(f"saved {report['bytes_saved'] / 1e6:.1f} MB on disk; page-view probe "
+              f"{report['probe_ms_before']} -> {report['probe_ms_after']} ms per user")
+
+
+if __name__ == "__main__":
+    main()
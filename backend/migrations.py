@@ -0,0 +1,436 @@
+"""Versioned schema migrations.
+
+Each migration is (version, description, steps); a step is a SQL string or a
+callable taking a cursor. `migrate()` applies the pending ones in order, each
+in its own write transaction, and records them in `schema_version`, so an
+existing data/app.db is upgraded in place on the next start.
+
+Steps never call into the application modules: an old upgrade must do what it
+did when it was written, however srs or importer change later. Constants and
+logic they need are copied in here.
+"""
+
+SCHEMA_VERSION_DDL = """
+CREATE TABLE IF NOT EXISTS schema_version (
+    version INTEGER PRIMARY KEY,
+    description TEXT NOT NULL,
+    applied_at TEXT DEFAULT CURRENT_TIMESTAMP
+)
+"""
+
+# Version 1 is the original schema. It only uses IF NOT EXISTS, so databases
+# created before versioning existed adopt it as a no-op.
+BASELINE = [
+    """
+    CREATE TABLE IF NOT EXISTS users (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        username TEXT UNIQUE NOT NULL,
+        email TEXT UNIQUE,
+        password_hash BLOB NOT NULL,
+        is_admin INTEGER DEFAULT 0,
+        joined_at TEXT DEFAULT CURRENT_TIMESTAMP
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS words (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        text TEXT NOT NULL,
+        definition TEXT NOT NULL,
+        part_of_speech TEXT,
+        language TEXT DEFAULT 'en',
+        created_at TEXT DEFAULT CURRENT_TIMESTAMP
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS sessions (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        date_local TEXT NOT NULL,
+        created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+        completed INTEGER DEFAULT 0,
+        FOREIGN KEY(user_id) REFERENCES users(id)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS session_items (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        session_id INTEGER NOT NULL,
+        word_id INTEGER NOT NULL,
+        position INTEGER NOT NULL,
+        user_answer TEXT,
+        correct INTEGER DEFAULT 0,
+        created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY(session_id) REFERENCES sessions(id),
+        FOREIGN KEY(word_id) REFERENCES words(id)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS user_day_words (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        date_local TEXT NOT NULL,
+        word_id INTEGER NOT NULL,
+        UNIQUE(user_id, date_local, word_id)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS user_attempts (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        word_id INTEGER NOT NULL,
+        date_local TEXT NOT NULL,
+        correct INTEGER NOT NULL,
+        response_time_ms INTEGER,
+        box INTEGER DEFAULT 1, -- Leitner box (1-5)
+        last_seen TEXT DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY(user_id) REFERENCES users(id),
+        FOREIGN KEY(word_id) REFERENCES words(id)
+    )
+    """,
+]
+
+HOT_PATH_INDEXES = [
+    # start_or_resume_session: open session for user/day, newest first (rowid order within the key)
+    "CREATE INDEX IF NOT EXISTS idx_sessions_user_day ON sessions(user_id, date_local, completed)",
+    # save_attempt: UPDATE session_items ... WHERE session_id=? AND word_id=?; session_summary by session
+    "CREATE INDEX IF NOT EXISTS idx_session_items_session_word ON session_items(session_id, word_id)",
+    # save_attempt's latest-box lookup and get_user_stats' GROUP BY word_id, both covered
+    "CREATE INDEX IF NOT EXISTS idx_user_attempts_user_word ON user_attempts(user_id, word_id, id, box, correct)",
+]
+
+# Leitner rules as of version 3
+_V3_INTERVAL_DAYS = {1: 1, 2: 2, 3: 4, 4: 8, 5: 16}
+_V3_MASTERED_BOX = 4
+
+
+def _backfill_leitner_state(cur):
+    """Replay the attempt log into the (new, empty) state and counter tables, one (user, word) at a time."""
+    rows = cur.execute("""
+        SELECT user_id, word_id, correct, box, last_seen FROM user_attempts ORDER BY user_id, word_id, id
+    """)
+    write = cur.connection.cursor()
+    insert = """
+        INSERT INTO user_word_state(user_id, word_id, box, streak, max_box, last_seen, due_at)
+        VALUES(?,?,?,?,?,?,datetime(?,?))
+    """
+    states, stats = [], {}
+    key = state = None
+    for uid, wid, correct, box, last_seen in rows:
+        if (uid, wid) != key:
+            if state:
+                states.append(state)
+            key = (uid, wid)
+            state = [uid, wid, 1, 0, 1, None]
+        box = box or 1
+        state[2:6] = [box, state[3] + 1 if correct else 0, max(state[4], box), last_seen]
+        totals = stats.setdefault(uid, [0, 0, 0])
+        totals[0] += 1
+        totals[1] += 1 if correct else 0
+        if len(states) >= 5000:
+            _write_leitner_states(write, insert, states, stats)
+    if state:
+        states.append(state)
+    _write_leitner_states(write, insert, states, stats)
+    write.executemany("INSERT INTO user_stats(user_id, attempts, correct, mastered) VALUES(?,?,?,?)",
+                      [(uid, a, c, m) for uid, (a, c, m) in stats.items()])
+
+
+def _write_leitner_states(write, insert, states, stats):
+    write.executemany(insert, [(uid, wid, box, streak, max_box, seen, seen, f"+{_V3_INTERVAL_DAYS[box]} days")
+                               for uid, wid, box, streak, max_box, seen in states])
+    for uid, _, _, _, max_box, _ in states:
+        if max_box >= _V3_MASTERED_BOX:
+            stats[uid][2] += 1
+    states.clear()
+
+
+LEITNER_STATE = [
+    """
+    CREATE TABLE IF NOT EXISTS user_word_state (
+        user_id INTEGER NOT NULL,
+        word_id INTEGER NOT NULL,
+        box INTEGER NOT NULL DEFAULT 1,
+        streak INTEGER NOT NULL DEFAULT 0,
+        max_box INTEGER NOT NULL DEFAULT 1,
+        last_seen TEXT,
+        due_at TEXT,
+        PRIMARY KEY(user_id, word_id)
+    ) WITHOUT ROWID
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS user_stats (
+        user_id INTEGER PRIMARY KEY,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        correct INTEGER NOT NULL DEFAULT 0,
+        mastered INTEGER NOT NULL DEFAULT 0
+    )
+    """,
+    _backfill_leitner_state,  # backfill from existing history
+]
+
+SESSION_ITEM_OPTIONS = [
+    # comma-separated word ids in display order, and which one is the answer
+    "ALTER TABLE session_items ADD COLUMN option_ids TEXT",
+    "ALTER TABLE session_items ADD COLUMN answer_index INTEGER",
+]
+
+# the default language and text normalization as of version 5 (see importer)
+_V5_DEFAULT_LANGUAGE = "en"
+
+
+def _v5_normalize_text(text):
+    return " ".join(text.split()).lower()
+
+
+def _backfill_word_keys(cur):
+    """Key existing words by (language, normalized text).
+
+    Only the oldest row of each key gets text_norm; later duplicates keep NULL
+    (they may be referenced by history, so they are not deleted) and simply
+    never match an upsert.
+    """
+    seen = set()
+    last_id = 0
+    while True:
+        rows = cur.execute("SELECT id, text, language FROM words WHERE id>? ORDER BY id LIMIT 10000",
+                           (last_id,)).fetchall()
+        if not rows:
+            break
+        updates = []
+        for wid, text, language in rows:
+            language = (language or "").strip() or _V5_DEFAULT_LANGUAGE
+            key = (language, _v5_normalize_text(text))
+            updates.append((language, None if key in seen else key[1], wid))
+            seen.add(key)
+        cur.executemany("UPDATE words SET language=?, text_norm=? WHERE id=?", updates)
+        last_id = rows[-1][0]
+
+
+WORD_KEYS = [
+    "CREATE TABLE IF NOT EXISTS app_meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL)",
+    "ALTER TABLE words ADD COLUMN text_norm TEXT",
+    _backfill_word_keys,
+    "CREATE UNIQUE INDEX IF NOT EXISTS idx_words_language_norm ON words(language, text_norm)",
+]
+
+WORD_NEIGHBORS = [
+    # filled by backend.distractors: the most confusable words of each word, rank 0 = closest
+    """
+    CREATE TABLE IF NOT EXISTS word_neighbors (
+        word_id INTEGER NOT NULL,
+        rank INTEGER NOT NULL,
+        neighbor_id INTEGER NOT NULL,
+        score REAL NOT NULL,
+        PRIMARY KEY(word_id, rank)
+    ) WITHOUT ROWID
+    """,
+]
+
+DUE_QUEUE = [
+    # per-user due queue: build_quiz_batch reads due reviews as one range of this index
+    "CREATE INDEX IF NOT EXISTS idx_user_word_state_due ON user_word_state(user_id, due_at)",
+]
+
+DAILY_SUMMARY = [
+    # one row per user and finished day, rolled up from the raw history by backend.maintenance
+    """
+    CREATE TABLE IF NOT EXISTS user_daily_summary (
+        user_id INTEGER NOT NULL,
+        date_local TEXT NOT NULL,
+        sessions INTEGER NOT NULL DEFAULT 0,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        correct INTEGER NOT NULL DEFAULT 0,
+        response_ms INTEGER NOT NULL DEFAULT 0,
+        responses INTEGER NOT NULL DEFAULT 0,
+        words_served INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY(user_id, date_local)
+    ) WITHOUT ROWID
+    """,
+]
+
+def _backfill_daily_summary(cur):
+    """Count history the maintenance roll-up has not reached yet; from here on writes keep it current."""
+    def high_water(table):
+        row = cur.execute("SELECT value FROM app_meta WHERE key=?", (f"rollup_{table}_id",)).fetchone()
+        return row[0] if row else 0
+
+    cur.execute("""
+        INSERT INTO user_daily_summary(user_id, date_local, sessions)
+        SELECT user_id, date_local, COUNT(*) FROM sessions WHERE id>? GROUP BY 1, 2
+        ON CONFLICT(user_id, date_local) DO UPDATE SET sessions=sessions+excluded.sessions
+    """, (high_water("sessions"),))
+    cur.execute("""
+        INSERT INTO user_daily_summary(user_id, date_local, words_served)
+        SELECT user_id, date_local, COUNT(*) FROM user_day_words WHERE id>? GROUP BY 1, 2
+        ON CONFLICT(user_id, date_local) DO UPDATE SET words_served=words_served+excluded.words_served
+    """, (high_water("user_day_words"),))
+    cur.execute("""
+        INSERT INTO user_daily_summary(user_id, date_local, attempts, correct, response_ms, responses)
+        SELECT user_id, date_local, COUNT(*), SUM(correct), COALESCE(SUM(response_time_ms), 0),
+               COUNT(response_time_ms)
+        FROM user_attempts WHERE id>? GROUP BY 1, 2
+        ON CONFLICT(user_id, date_local) DO UPDATE SET
+            attempts=attempts+excluded.attempts, correct=correct+excluded.correct,
+            response_ms=response_ms+excluded.response_ms, responses=responses+excluded.responses
+    """, (high_water("user_attempts"),))
+    # a word counts as mastered on the day of its first answer that left it in box 4 or higher
+    cur.execute(f"""
+        INSERT INTO user_daily_summary(user_id, date_local, mastered)
+        SELECT a.user_id, a.date_local, COUNT(*) FROM user_attempts a
+        JOIN (SELECT MIN(id) AS id FROM user_attempts WHERE box>={_V3_MASTERED_BOX} GROUP BY user_id, word_id) f
+          ON f.id = a.id
+        GROUP BY 1, 2
+        ON CONFLICT(user_id, date_local) DO UPDATE SET mastered=mastered+excluded.mastered
+    """)
+    cur.execute("DELETE FROM app_meta WHERE key LIKE 'rollup_%'")
+
+
+LIVE_DAILY_SUMMARY = [
+    "ALTER TABLE user_daily_summary ADD COLUMN mastered INTEGER NOT NULL DEFAULT 0",
+    _backfill_daily_summary,
+    # leaderboard: top of this index, and a user's rank as one range count
+    "CREATE INDEX IF NOT EXISTS idx_user_stats_leaderboard ON user_stats(mastered, correct)",
+]
+
+def _partition_by_language(cur):
+    """Tag sessions and Leitner state with a language; rows that predate this are the default language."""
+    # a column default is stored in the schema, so neither ALTER rewrites the table
+    cur.execute(f"ALTER TABLE sessions ADD COLUMN language TEXT NOT NULL DEFAULT '{_V5_DEFAULT_LANGUAGE}'")
+    cur.execute(f"ALTER TABLE user_word_state ADD COLUMN language TEXT NOT NULL DEFAULT '{_V5_DEFAULT_LANGUAGE}'")
+    cur.execute("""
+        UPDATE user_word_state SET language=(SELECT language FROM words WHERE id=word_id)
+        WHERE word_id IN (SELECT id FROM words WHERE language<>?)
+    """, (_V5_DEFAULT_LANGUAGE,))
+    # new state rows take their word's language (only written when it is not the default)
+    cur.execute("""
+        CREATE TRIGGER IF NOT EXISTS user_word_state_language AFTER INSERT ON user_word_state
+        WHEN (SELECT language FROM words WHERE id=NEW.word_id) <> NEW.language
+        BEGIN
+            UPDATE user_word_state SET language=(SELECT language FROM words WHERE id=NEW.word_id)
+            WHERE user_id=NEW.user_id AND word_id=NEW.word_id;
+        END
+    """)
+
+
+# The same trigger for shard files (see backend.shards), which have no words
+# table of their own: triggers stored in a file cannot read another one, so
+# every shard connection creates it as a TEMP trigger on the attached catalog.
+CATALOG_LANGUAGE_TRIGGER = """
+    CREATE TEMP TRIGGER IF NOT EXISTS user_word_state_language AFTER INSERT ON main.user_word_state
+    WHEN (SELECT language FROM catalog.words WHERE id=NEW.word_id) <> NEW.language
+    BEGIN
+        UPDATE user_word_state SET language=(SELECT language FROM catalog.words WHERE id=NEW.word_id)
+        WHERE user_id=NEW.user_id AND word_id=NEW.word_id;
+    END
+"""
+
+
+LANGUAGES = [
+    "ALTER TABLE users ADD COLUMN language TEXT",  # NULL: the default language
+    _partition_by_language,
+    # due reviews are read per (user, language), so one language's queue is one range
+    "DROP INDEX IF EXISTS idx_user_word_state_due",
+    "CREATE INDEX IF NOT EXISTS idx_user_word_state_due ON user_word_state(user_id, language, due_at)",
+]
+
+# bumped on sign-out; session tokens sign it, so older ones stop verifying
+TOKEN_GENERATION = [
+    "ALTER TABLE users ADD COLUMN token_generation INTEGER NOT NULL DEFAULT 0",
+]
+
+# backend.distractors: what an incremental update needs without re-vectorising whole buckets
+WORD_VECTORS = [
+    """
+    CREATE TABLE IF NOT EXISTS word_vectors (
+        word_id INTEGER PRIMARY KEY,
+        vector BLOB NOT NULL,
+        threshold REAL NOT NULL DEFAULT 0
+    )
+    """,
+    # document frequency of each definition term per (language, part of speech) bucket,
+    # '' standing in for NULL; term '' holds the bucket's document count
+    """
+    CREATE TABLE IF NOT EXISTS definition_terms (
+        language TEXT NOT NULL,
+        part_of_speech TEXT NOT NULL,
+        term TEXT NOT NULL,
+        df INTEGER NOT NULL,
+        PRIMARY KEY(language, part_of_speech, term)
+    ) WITHOUT ROWID
+    """,
+]
+
+# backend.maintenance finds rows past retention as one range of each history table's dates
+HISTORY_DATE_INDEXES = [
+    "CREATE INDEX IF NOT EXISTS idx_sessions_date ON sessions(date_local)",
+    "CREATE INDEX IF NOT EXISTS idx_user_day_words_date ON user_day_words(date_local)",
+    "CREATE INDEX IF NOT EXISTS idx_user_attempts_date ON user_attempts(date_local)",
+]
+
+# the leaderboard breaks ties on user id, so the index carries it and is kept in that order
+LEADERBOARD_TIEBREAK = [
+    "DROP INDEX IF EXISTS idx_user_stats_leaderboard",
+    "CREATE INDEX IF NOT EXISTS idx_user_stats_leaderboard ON user_stats(mastered DESC, correct DESC, user_id)",
+]
+
+MIGRATIONS = [
+    (1, "baseline tables", BASELINE),
+    (2, "hot-path indexes", HOT_PATH_INDEXES),
+    (3, "materialized Leitner state and per-user counters", LEITNER_STATE),
+    (4, "store quiz options on session items", SESSION_ITEM_OPTIONS),
+    (5, "normalized word keys for deduplicating imports", WORD_KEYS),
+    (6, "confusable-word lists for distractors", WORD_NEIGHBORS),
+    (7, "due-time index for spaced-repetition reviews", DUE_QUEUE),
+    (8, "per-user daily summaries of rolled-up history", DAILY_SUMMARY),
+    (9, "keep daily summaries current on write, leaderboard index", LIVE_DAILY_SUMMARY),
+    (10, "per-user language, language-partitioned sessions and review queue", LANGUAGES),
+    (11, "per-user session token generation for revocation", TOKEN_GENERATION),
+    (12, "stored word vectors and term counts for incremental distractor updates", WORD_VECTORS),
+    (13, "date indexes for pruning the history tables", HISTORY_DATE_INDEXES),
+    (14, "user id as the leaderboard's final tiebreak", LEADERBOARD_TIEBREAK),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def current_version(con):
+    con.execute(SCHEMA_VERSION_DDL)
+    row = con.execute("SELECT MAX(version) FROM schema_version").fetchone()
+    return row[0] or 0
+
+
+def migrate(con, target=None, applies=None):
+    """Bring the database up to `target` (default: latest). Returns versions applied.
+
+    `applies(step)` picks the steps to run (default: all); a version is recorded
+    as applied even when it skips all of them.
+    """
+    target = LATEST_VERSION if target is None else target
+    applied = []
+    if current_version(con) >= target:
+        return applied
+    for version, description, steps in MIGRATIONS:
+        if version > target:
+            break
+        # BEGIN IMMEDIATE takes the write lock first, so concurrent starters
+        # re-check the version and only one of them applies each step
+        con.execute("BEGIN IMMEDIATE")
+        try:
+            done = con.execute("SELECT 1 FROM schema_version WHERE version=?", (version,)).fetchone()
+            if not done:
+                cur = con.cursor()
+                for step in steps:
+                    if applies is not None and not applies(step):
+                        continue
+                    if callable(step):
+                        step(cur)
+                    else:
+                        cur.execute(step)
+                cur.execute("INSERT INTO schema_version(version, description) VALUES(?,?)",
+                            (version, description))
+                applied.append(version)
+            con.execute("COMMIT")
+        except BaseException:
+            con.execute("ROLLBACK")
+            raise
+    return applied
@@ -0,0 +1,105 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+WORKERS = int(os.environ.get("WORDAPP_PREFETCH_WORKERS", "2"))
+# a prefetched batch nobody picked up within this many seconds is released
+RESERVATION_TTL = float(os.environ.get("WORDAPP_PREFETCH_TTL", "1800"))
+# how long take() will wait for a batch that is still being built
+TAKE_WAIT = 5.0
+
+
+class _Reservation:
+    __slots__ = ("future", "size", "expires")
+
+    def __init__(self, future, size, expires):
+        self.future = future
+        self.size = size
+        self.expires = expires
+
+    def word_ids(self):
+        if not self.future.done() or self.future.exception() is not None:
+            return set()
+        return {it["word_id"] for it in self.future.result()}
+
+
+class Prefetcher:
+    """Builds the next quiz batch per (user, day) in a thread pool.
+
+    While a batch is held here its words are *reserved*: `reserved_ids` lets
+    the regular builder skip them, so handing the batch over later cannot
+    repeat a word within the day. Reservations expire after `ttl` seconds.
+    """
+
+    def __init__(self, build, workers=None, ttl=None):
+        self.build = build
+        self.ttl = RESERVATION_TTL if ttl is None else ttl
+        self._executor = ThreadPoolExecutor(max_workers=workers or WORKERS, thread_name_prefix="prefetch")
+        self._lock = threading.Lock()
+        self._reservations = {}
+        self.scheduled = 0
+        self.hits = 0
+        self.late_hits = 0
+        self.misses = 0
+        self.expired = 0
+
+    def _expire(self, now):
+        for key in [k for k, r in self._reservations.items() if r.expires <= now]:
+            self._reservations.pop(key).future.cancel()
+            self.expired += 1
+
+    def schedule(self, user_id, date_local, size):
+        key = (user_id, date_local)
+        with self._lock:
+            now = time.monotonic()
+            self._expire(now)
+            if key in self._reservations:
+                return
+            future = self._executor.submit(self.build, user_id, date_local, size)
+            self._reservations[key] = _Reservation(future, size, now + self.ttl)
+            self.scheduled += 1
+
+    def reserved_ids(self, user_id, date_local):
+        with self._lock:
+            self._expire(time.monotonic())
+            res = self._reservations.get((user_id, date_local))
+        return res.word_ids() if res else set()
+
+    def take(self, user_id, date_local, size):
+        """Hand over the prefetched batch (releasing its reservation), or None on a miss."""
+        with self._lock:
+            self._expire(time.monotonic())
+            res = self._reservations.pop((user_id, date_local), None)
+        if res is None or res.size != size:
+            self.misses += 1
+            return None
+        late = not res.future.done()
+        try:
+            items = res.future.result(timeout=TAKE_WAIT)
+        except Exception:  # timed out, cancelled or the build failed
+            res.future.cancel()
+            self.misses += 1
+            return None
+        if late:
+            self.late_hits += 1
+        else:
+            self.hits += 1
+        return items
+
+    def discard(self, user_id, date_local):
+        with self._lock:
+            res = self._reservations.pop((user_id, date_local), None)
+        if res:
+            res.future.cancel()
+
+    def stats(self):
+        with self._lock:
+            self._expire(time.monotonic())
+            reserved = len(self._reservations)
+        taken = self.hits + self.late_hits + self.misses
+        return {
+            "scheduled": self.scheduled, "hits": self.hits, "late_hits": self.late_hits,
+            "misses": self.misses, "expired": self.expired, "reserved": reserved,
+            "hit_rate": round((self.hits + self.late_hits) / taken, 3) if taken else 0.0,
+        }
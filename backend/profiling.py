@@ -0,0 +1,362 @@
+import functools
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from bisect import bisect_left
+
+ENABLED = os.environ.get("WORDAPP_PROFILE", "0") == "1"
+# bucket upper bounds in ms; the last bucket is everything slower
+BUCKETS_MS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+# the progress handler fires every this many SQLite VM instructions
+PROGRESS_OPS = 100
+SQL_KEY_LENGTH = 160
+
+
+class Histogram:
+    """Fixed log-spaced buckets: one bisect and a few adds per observation."""
+
+    __slots__ = ("counts", "count", "sum", "max", "_lock")
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS_MS) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, ms):
+        i = bisect_left(BUCKETS_MS, ms)
+        with self._lock:
+            self.counts[i] += 1
+            self.count += 1
+            self.sum += ms
+            if ms > self.max:
+                self.max = ms
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the q-th observation (the max for the open bucket)."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank and n:
+                return min(BUCKETS_MS[i], self.max) if i < len(BUCKETS_MS) else self.max
+        return self.max
+
+    def to_dict(self):
+        return {
+            "count": self.count, "sum_ms": round(self.sum, 3), "max_ms": round(self.max, 3),
+            "mean_ms": round(self.sum / self.count, 3) if self.count else 0.0,
+            "p50_ms": round(self.quantile(0.5), 3), "p95_ms": round(self.quantile(0.95), 3),
+            "p99_ms": round(self.quantile(0.99), 3),
+            "buckets": dict(zip([str(b) for b in BUCKETS_MS] + ["+Inf"], self.counts)),
+        }
+
+
+_BEGIN_LOCKING = re.compile(r"\s*BEGIN\s+(IMMEDIATE|EXCLUSIVE)\b", re.I)
+_WRITE = re.compile(r"\s*(INSERT|UPDATE|DELETE|REPLACE)\b", re.I)
+
+
+class StatementStats:
+    __slots__ = ("latency", "fetch_ms", "rows", "vm_steps", "locked", "errors", "begins", "writes")
+
+    def __init__(self, sql=""):
+        self.begins = bool(_BEGIN_LOCKING.match(sql))  # does nothing but wait for the write lock
+        self.writes = bool(_WRITE.match(sql))
+        self.latency = Histogram()
+        self.fetch_ms = 0.0
+        self.rows = 0
+        self.vm_steps = 0
+        self.locked = 0
+        self.errors = 0
+
+    def to_dict(self):
+        d = self.latency.to_dict()
+        d.update(fetch_ms=round(self.fetch_ms, 3), rows=self.rows, vm_steps=self.vm_steps,
+                 locked=self.locked, errors=self.errors)
+        return d
+
+
+_lock = threading.Lock()
+_functions = {}
+_statements = {}   # normalised SQL -> StatementStats
+_by_text = {}      # SQL exactly as executed -> the same StatementStats
+pool_wait = Histogram()
+# BEGIN IMMEDIATE/EXCLUSIVE: the whole statement is the wait for the database's write lock
+lock_wait = Histogram()
+# the first write of a deferred transaction waits for the lock inside its own execute, so
+# these times are an upper bound on that wait (they include the statement's work)
+first_write = Histogram()
+_since = time.time()
+
+
+def _function_histogram(name):
+    hist = _functions.get(name)
+    if hist is None:
+        with _lock:
+            hist = _functions.setdefault(name, Histogram())
+    return hist
+
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def _statement_stats(sql):
+    stats = _by_text.get(sql)
+    if stats is None:
+        key = _WHITESPACE.sub(" ", sql).strip()[:SQL_KEY_LENGTH]
+        with _lock:
+            stats = _by_text[sql] = _statements.setdefault(key, StatementStats(key))
+    return stats
+
+
+def enabled():
+    return ENABLED
+
+
+def enable(on=True):
+    """Switch profiling on or off; pooled connections are reopened to pick the change up."""
+    global ENABLED
+    if ENABLED == on:
+        return
+    ENABLED = on
+    from . import db
+    db.close_pools()
+
+
+def reset():
+    global _since, pool_wait, lock_wait, first_write
+    with _lock:
+        _functions.clear()
+        _statements.clear()
+        _by_text.clear()
+        pool_wait = Histogram()
+        lock_wait = Histogram()
+        first_write = Histogram()
+        _since = time.time()
+
+
+def timed(name, fn):
+    """Wrap `fn` to record its wall time under `name`; a flag check is all it costs when off."""
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        if not ENABLED:
+            return fn(*args, **kwargs)
+        t0 = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _function_histogram(name).observe((time.perf_counter() - t0) * 1000)
+    return wrapper
+
+
+def instrument(namespace, prefix):
+    """Time every public function defined in a module; call it from the module's last line with globals()."""
+    module = namespace["__name__"]
+    for name, value in list(namespace.items()):
+        if not name.startswith("_") and callable(value) and not isinstance(value, type) \
+                and getattr(value, "__module__", None) == module and hasattr(value, "__code__"):
+            namespace[name] = timed(f"{prefix}.{name}", value)
+
+
+class ProfiledCursor(sqlite3.Cursor):
+    """Times execute/executemany and attributes fetched rows and VM steps to the statement.
+
+    Statements that take the write lock are also timed into `lock_wait`
+    (BEGIN IMMEDIATE) or `first_write` (a write outside one).
+    """
+
+    _stats = None
+
+    def _run(self, method, sql, params):
+        con = self.connection
+        stats = _statement_stats(sql)
+        if not con.in_transaction:
+            con.writing = False
+        locking = lock_wait if stats.begins else first_write if stats.writes and not con.writing else None
+        ticks = con.ticks
+        t0 = time.perf_counter()
+        try:
+            result = method(sql, params)
+        except sqlite3.OperationalError as e:
+            if "locked" in str(e) or "busy" in str(e):
+                stats.locked += 1
+            else:
+                stats.errors += 1
+            raise
+        except sqlite3.Error:
+            stats.errors += 1
+            raise
+        finally:
+            ms = (time.perf_counter() - t0) * 1000
+            stats.latency.observe(ms)
+            stats.vm_steps += (con.ticks - ticks) * PROGRESS_OPS
+            if locking is not None:
+                locking.observe(ms)
+        if locking is not None:
+            con.writing = con.in_transaction
+        if self.rowcount > 0:  # DML; SELECT rows are counted as they are fetched
+            stats.rows += self.rowcount
+        self._stats = stats
+        return result
+
+    def execute(self, sql, params=()):
+        return self._run(super().execute, sql, params)
+
+    def executemany(self, sql, params):
+        return self._run(super().executemany, sql, params)
+
+    def _fetch(self, method, *args):
+        stats = self._stats
+        if stats is None:
+            return method(*args)
+        con = self.connection
+        ticks = con.ticks
+        t0 = time.perf_counter()
+        rows = method(*args)
+        stats.fetch_ms += (time.perf_counter() - t0) * 1000
+        stats.vm_steps += (con.ticks - ticks) * PROGRESS_OPS
+        return rows
+
+    def fetchone(self):
+        row = self._fetch(super().fetchone)
+        if row is not None and self._stats is not None:
+            self._stats.rows += 1
+        return row
+
+    def fetchmany(self, size=None):
+        rows = self._fetch(super().fetchmany, self.arraysize if size is None else size)
+        if self._stats is not None:
+            self._stats.rows += len(rows)
+        return rows
+
+    def fetchall(self):
+        rows = self._fetch(super().fetchall)
+        if self._stats is not None:
+            self._stats.rows += len(rows)
+        return rows
+
+    def __next__(self):
+        row = self._fetch(super().__next__)
+        if self._stats is not None:
+            self._stats.rows += 1
+        return row
+
+
+class ProfiledConnection(sqlite3.Connection):
+    """sqlite3 connection factory used by the pool while profiling is on."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.ticks = 0
+        self.writing = False  # holds the write lock of the current transaction
+        self.set_progress_handler(self._tick, PROGRESS_OPS)
+
+    def _tick(self):
+        self.ticks += 1
+        return 0
+
+    def cursor(self, factory=ProfiledCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, params=()):
+        return self.cursor().execute(sql, params)
+
+    def executemany(self, sql, params):
+        return self.cursor().executemany(sql, params)
+
+    def commit(self):
+        if not self.in_transaction:
+            return super().commit()
+        stats = _statement_stats("COMMIT")
+        t0 = time.perf_counter()
+        try:
+            return super().commit()
+        except sqlite3.OperationalError:
+            stats.locked += 1
+            raise
+        finally:
+            stats.latency.observe((time.perf_counter() - t0) * 1000)
+
+
+def snapshot():
+    with _lock:
+        functions = sorted(_functions.items())
+        statements = sorted(_statements.items())
+    from . import db
+    return {
+        "enabled": ENABLED, "since": _since, "taken": time.time(),
+        "functions": {name: hist.to_dict() for name, hist in functions},
+        "statements": {sql: stats.to_dict() for sql, stats in statements},
+        "pool_wait": pool_wait.to_dict(),
+        "lock_wait": lock_wait.to_dict(),
+        "first_write": first_write.to_dict(),
+        "pools": db.pool_stats(),
+    }
+
+
+def to_json(data=None):
+    return json.dumps(snapshot() if data is None else data, indent=2)
+
+
+def _label(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _prometheus_histogram(lines, metric, labels, hist):
+    seen = 0
+    for bound, n in zip(list(BUCKETS_MS) + [None], hist["buckets"].values()):
+        seen += n
+        le = "+Inf" if bound is None else repr(bound / 1000)
+        lines.append(f'{metric}_bucket{{{labels},le="{le}"}} {seen}' if labels else f'{metric}_bucket{{le="{le}"}} {seen}')
+    braces = f"{{{labels}}}" if labels else ""
+    lines.append(f"{metric}_sum{braces} {hist['sum_ms'] / 1000}")
+    lines.append(f"{metric}_count{braces} {hist['count']}")
+
+
+def to_prometheus(data=None):
+    """Prometheus text exposition format (durations in seconds, as Prometheus expects)."""
+    data = snapshot() if data is None else data
+    lines = [
+        "# HELP wordapp_function_duration_seconds Wall time of backend.logic and backend.auth calls.",
+        "# TYPE wordapp_function_duration_seconds histogram",
+    ]
+    for name, hist in data["functions"].items():
+        _prometheus_histogram(lines, "wordapp_function_duration_seconds", f'function="{_label(name)}"', hist)
+    lines += [
+        "# HELP wordapp_sql_duration_seconds Statement execute time (rows are fetched separately).",
+        "# TYPE wordapp_sql_duration_seconds histogram",
+    ]
+    for sql, stats in data["statements"].items():
+        _prometheus_histogram(lines, "wordapp_sql_duration_seconds", f'statement="{_label(sql)}"', stats)
+    for metric, key, help_text in (
+            ("wordapp_sql_fetch_seconds_total", "fetch_ms", "Time spent fetching result rows."),
+            ("wordapp_sql_rows_total", "rows", "Rows fetched or changed."),
+            ("wordapp_sql_vm_steps_total", "vm_steps", "SQLite VM instructions, to the nearest progress tick."),
+            ("wordapp_sql_locked_total", "locked", "'database is locked' errors."),
+            ("wordapp_sql_errors_total", "errors", "Other SQLite errors.")):
+        lines += [f"# HELP {metric} {help_text}", f"# TYPE {metric} counter"]
+        for sql, stats in data["statements"].items():
+            value = stats[key] / 1000 if key == "fetch_ms" else stats[key]
+            lines.append(f'{metric}{{statement="{_label(sql)}"}} {value}')
+    lines += [
+        "# HELP wordapp_pool_wait_seconds Time spent waiting for a pooled connection.",
+        "# TYPE wordapp_pool_wait_seconds histogram",
+    ]
+    _prometheus_histogram(lines, "wordapp_pool_wait_seconds", "", data["pool_wait"])
+    lines += [
+        "# HELP wordapp_sql_lock_wait_seconds Time BEGIN IMMEDIATE spent waiting for the write lock.",
+        "# TYPE wordapp_sql_lock_wait_seconds histogram",
+    ]
+    _prometheus_histogram(lines, "wordapp_sql_lock_wait_seconds", "", data["lock_wait"])
+    lines += [
+        "# HELP wordapp_sql_first_write_seconds Writes that took the write lock themselves (wait plus work).",
+        "# TYPE wordapp_sql_first_write_seconds histogram",
+    ]
+    _prometheus_histogram(lines, "wordapp_sql_first_write_seconds", "", data["first_write"])
+    return "\n".join(lines) + "\n"
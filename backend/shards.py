@@ -0,0 +1,352 @@
+"""Optional sharded storage: the user-scoped tables spread over N SQLite files by user id.
+
+    python -m backend.shards status
+    python -m backend.shards reshard 4      # 0 folds everything back into data/app.db
+
+Unsharded, every answer from every user queues on the one write lock of
+DB_PATH. In a sharded layout DB_PATH stays the catalog (words, users, word
+lists, app_meta), and each user's sessions, session items, served words and
+attempts live in `<db>.shard<i>-of-<N>.db`, picked by a hash of the user id
+(db.shard_of). Their Leitner state, counters and daily summaries go along,
+since an answer updates them in the attempt's own transaction. Writers whose
+users sit on different shards commit in parallel.
+
+db.get_conn(user_id=...) and get_conn(session_id=...) pick the file. Shard
+connections attach the catalog read-only, so queries joining words or users
+run unchanged and backend.logic's callers see no difference. Session ids
+start at shard << db.SESSION_ID_BITS in each file, so a session id alone
+names its shard. Reads over all users (the leaderboard, maintenance) visit
+every shard.
+
+The layout is recorded in app_meta ('shards'). WORDAPP_SHARDS picks it for a
+new database only; `reshard` moves an existing one to another layout. Run it
+with the app stopped. Shard files are created from the catalog's current
+schema and keep their own schema_version: when a migration comes out, init_db
+applies its steps on the user tables to every shard file in place.
+"""
+import argparse
+import heapq
+import os
+import re
+import sqlite3
+import time
+from urllib.parse import quote
+
+from . import db
+from .migrations import SCHEMA_VERSION_DDL, current_version, migrate
+
+SHARD_TABLES = ("sessions", "session_items", "user_day_words", "user_attempts",
+                "user_word_state", "user_stats", "user_daily_summary")
+# history tables: merged from the sources in date order and given fresh ids, keeping "ids follow time"
+_DATED = ("user_day_words", "user_attempts")
+# keyed by user, copied as they are
+_KEYED = ("user_word_state", "user_stats", "user_daily_summary")
+BATCH_ROWS = 500  # rows per insert batch and per `IN (...)` list
+# the table a SQL migration step writes to, or the table or index it drops
+_STEP_TARGET = re.compile(r"""\s*(?:
+    (?:ALTER\s+TABLE | CREATE\s+TABLE(?:\s+IF\s+NOT\s+EXISTS)? | CREATE\s+(?:UNIQUE\s+)?INDEX\s.*?\sON
+       | INSERT(?:\s+OR\s+\w+)?\s+INTO | UPDATE | DELETE\s+FROM)\s+(?P<table>\w+)
+  | DROP\s+(?:TABLE|INDEX)(?:\s+IF\s+EXISTS)?\s+(?P<dropped>\w+))""", re.I | re.S | re.X)
+
+
+def _open(path):
+    con = sqlite3.connect(path)
+    for name, value in db.PRAGMAS.items():
+        con.execute(f"PRAGMA {name}={value}").fetchall()
+    return con
+
+
+def _remove(path):
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+
+
+def _columns(con, table):
+    return [row[1] for row in con.execute(f"PRAGMA table_info({table})")]
+
+
+def _schema(catalog):
+    """CREATE statements of the user-scoped tables and their indexes, as the catalog has them now."""
+    return [sql for (sql,) in catalog.execute(f"""
+        SELECT sql FROM sqlite_master
+        WHERE type IN ('table', 'index') AND sql IS NOT NULL AND tbl_name IN ({",".join("?" for _ in SHARD_TABLES)})
+        ORDER BY type DESC, rowid
+    """, SHARD_TABLES)]
+
+
+def create_shard(catalog, path, shard):
+    """An empty shard file with the catalog's user tables; its sessions are numbered from shard << SESSION_ID_BITS."""
+    con = _open(path)
+    try:
+        con.execute("BEGIN IMMEDIATE")
+        for sql in _schema(catalog):
+            con.execute(sql)
+        con.execute(SCHEMA_VERSION_DDL)
+        con.executemany("INSERT INTO schema_version(version, description, applied_at) VALUES(?,?,?)",
+                        catalog.execute("SELECT version, description, applied_at FROM schema_version").fetchall())
+        if shard:
+            con.execute("INSERT INTO sqlite_sequence(name, seq) VALUES('sessions', ?)",
+                        (shard << db.SESSION_ID_BITS,))
+        con.commit()
+    finally:
+        con.close()
+
+
+def _shard_step(con, step):
+    """Whether a migration step applies to a shard file.
+
+    SQL runs when it changes a user table (or drops something the shard has);
+    triggers and views stay in the catalog, since a shard's own could not read
+    it. Callables run as they are: the catalog is attached read-only, so they
+    can read words or app_meta but fail, and abort the upgrade, on writing them.
+    """
+    if callable(step):
+        return True
+    match = _STEP_TARGET.match(step)
+    if match is None:
+        return False
+    if match["dropped"]:
+        return con.execute("SELECT 1 FROM main.sqlite_master WHERE name=?", (match["dropped"],)).fetchone() is not None
+    return match["table"] in SHARD_TABLES
+
+
+def upgrade_shard(path, version):
+    """Bring a shard file up to schema `version` in place, each migration under BEGIN IMMEDIATE.
+
+    Returns the versions applied; raises RuntimeError if one fails (it is rolled back).
+    """
+    con = sqlite3.connect(path, uri=True)
+    try:
+        for name, value in db.PRAGMAS.items():
+            con.execute(f"PRAGMA {name}={value}").fetchall()
+        con.execute("ATTACH DATABASE ? AS catalog", (f"file:{quote(os.path.abspath(db.DB_PATH))}?mode=ro",))
+        return migrate(con, version, applies=lambda step: _shard_step(con, step))
+    except sqlite3.Error as e:
+        raise RuntimeError(f"could not upgrade {path} to schema v{version}: {e}") from e
+    finally:
+        con.close()
+
+
+def _has_user_rows(con):
+    return any(con.execute(f"SELECT 1 FROM {table} LIMIT 1").fetchone() for table in SHARD_TABLES)
+
+
+def open_layout(requested=0):
+    """Check and upgrade the recorded layout's shard files; a database without user rows yet takes `requested` shards.
+
+    Called by db.init_db. Returns the number of shards.
+    """
+    with db.get_conn() as con:
+        row = con.execute("SELECT value FROM app_meta WHERE key='shards'").fetchone()
+        if row is None and requested:
+            con.execute("BEGIN IMMEDIATE")  # one process creates the files
+            row = con.execute("SELECT value FROM app_meta WHERE key='shards'").fetchone()
+        shards = row[0] if row else 0
+        if row is None and requested:
+            if _has_user_rows(con):
+                raise RuntimeError(f"{db.DB_PATH} already holds user data; "
+                                   f"shard it with `python -m backend.shards reshard {requested}`")
+            for shard in range(requested):
+                path = db.shard_path(shard, requested)
+                if os.path.exists(path):
+                    raise RuntimeError(f"{path} exists but {db.DB_PATH} records no shards; "
+                                       "restore the matching catalog or remove the file")
+                create_shard(con, path, shard)
+            con.execute("INSERT INTO app_meta(key, value) VALUES('shards', ?)", (requested,))
+            shards = requested
+        con.commit()
+        version = current_version(con)
+    for shard in range(shards):
+        path = db.shard_path(shard, shards)
+        if not os.path.exists(path):
+            raise RuntimeError(f"shard file {path} is missing")
+        upgrade_shard(path, version)
+    db.set_shard_count(shards)
+    return shards
+
+
+def _tagged(source, cursor):
+    for row in cursor:
+        yield source, row
+
+
+def _merged(sources, sql, key):
+    """(source index, row) for the rows of `sql` in every source, merged on column `key`."""
+    return heapq.merge(*(_tagged(i, src.execute(sql)) for i, src in enumerate(sources)),
+                       key=lambda tagged: tagged[1][key])
+
+
+def _insert(con, table, columns, rows):
+    if rows:
+        con.executemany(f"INSERT INTO {table}({','.join(columns)}) VALUES({','.join('?' for _ in columns)})", rows)
+
+
+def _copy_sessions(sources, targets, route, batch):
+    """Sessions and their items, renumbered so each target's ids carry its shard."""
+    columns = _columns(sources[0], "sessions")
+    item_columns = [c for c in _columns(sources[0], "session_items") if c != "id"]
+    user, day, of_session = columns.index("user_id"), columns.index("date_local"), item_columns.index("session_id")
+    next_id = [target << db.SESSION_ID_BITS for target in range(len(targets))]
+    moved = {"sessions": 0, "session_items": 0}
+
+    def flush(pending):
+        new_ids, by_source = {}, {}
+        rows = [[] for _ in targets]
+        for source, row in pending:
+            target = route(row[user])
+            next_id[target] += 1
+            new_ids[source, row[0]] = target, next_id[target]
+            rows[target].append((next_id[target],) + row[1:])
+            by_source.setdefault(source, []).append(row[0])
+        items = [[] for _ in targets]
+        for source, ids in by_source.items():
+            for row in sources[source].execute(
+                    f"SELECT {','.join(item_columns)} FROM session_items "
+                    f"WHERE session_id IN ({','.join('?' for _ in ids)}) ORDER BY id", ids):
+                target, session_id = new_ids[source, row[of_session]]
+                items[target].append(row[:of_session] + (session_id,) + row[of_session + 1:])
+        for target, con in enumerate(targets):
+            _insert(con, "sessions", columns, rows[target])
+            _insert(con, "session_items", item_columns, items[target])
+            con.commit()
+        moved["sessions"] += len(pending)
+        moved["session_items"] += sum(map(len, items))
+        pending.clear()
+
+    pending = []
+    for tagged in _merged(sources, "SELECT * FROM sessions ORDER BY id", day):
+        pending.append(tagged)
+        if len(pending) >= batch:
+            flush(pending)
+    flush(pending)
+    return moved
+
+
+def _copy_table(sources, targets, route, batch, table):
+    columns = _columns(sources[0], table)
+    if table in _DATED:  # the target numbers them again
+        rows = (row[1:] for _, row in _merged(sources, f"SELECT * FROM {table} ORDER BY id",
+                                              columns.index("date_local")))
+        columns = columns[1:]
+    else:
+        rows = (row for src in sources for row in src.execute(f"SELECT * FROM {table}"))
+    user = columns.index("user_id")
+    pending = [[] for _ in targets]
+    moved = 0
+    for row in rows:
+        target = route(row[user])
+        pending[target].append(row)
+        if len(pending[target]) >= batch:
+            _insert(targets[target], table, columns, pending[target])
+            targets[target].commit()
+            moved += len(pending[target])
+            pending[target].clear()
+    for target, con in enumerate(targets):
+        _insert(con, table, columns, pending[target])
+        con.commit()
+        moved += len(pending[target])
+    return moved
+
+
+def reshard(shards, batch=BATCH_ROWS):
+    """Move every user's rows into a `shards`-file layout (0: back into the catalog); returns a report.
+
+    The new files are filled first and the switch is one commit to the
+    catalog; the old copies are removed after it. Run with the app stopped.
+    """
+    t0 = time.perf_counter()
+    old = db.init_db(shards=0)
+    db.close_pools()
+    report = {"from": old, "to": shards, "moved": {}}
+    if not old and not shards:
+        return report
+    catalog = _open(db.DB_PATH)
+    sources = [catalog] if not old else [_open(db.shard_path(shard, old)) for shard in range(old)]
+    if shards:
+        final = [db.shard_path(shard, shards) for shard in range(shards)]
+        for shard, path in enumerate(final):
+            _remove(path + ".new")  # left over from an interrupted run
+            create_shard(catalog, path + ".new", shard)
+        targets = [_open(path + ".new") for path in final]
+    else:
+        for table in SHARD_TABLES:  # left over from an interrupted run
+            catalog.execute(f"DELETE FROM {table}")
+        catalog.commit()
+        final = []
+        targets = [catalog]
+
+    def route(user_id):
+        return db.shard_of(user_id, shards) if shards else 0
+
+    moved = _copy_sessions(sources, targets, route, batch)
+    for table in _DATED + _KEYED:
+        moved[table] = _copy_table(sources, targets, route, batch, table)
+    report["moved"] = moved
+    report["attempts_per_shard"] = [con.execute("SELECT COUNT(*) FROM user_attempts").fetchone()[0]
+                                    for con in targets]
+    for con in set(sources + targets) - {catalog}:
+        con.close()
+
+    retired = [db.shard_path(shard, old) for shard in range(old)]
+    if old == shards:  # same file names: keep the old files aside until the switch is committed
+        for path in retired:
+            _remove(path + ".old")
+            os.replace(path, path + ".old")
+        retired = [path + ".old" for path in retired]
+    for path in final:
+        os.replace(path + ".new", path)
+    catalog.execute("BEGIN IMMEDIATE")
+    catalog.execute("""
+        INSERT INTO app_meta(key, value) VALUES('shards', ?)
+        ON CONFLICT(key) DO UPDATE SET value=excluded.value
+    """, (shards,))
+    if not old:
+        for table in SHARD_TABLES:
+            catalog.execute(f"DELETE FROM {table}")
+    catalog.commit()
+    if not old:  # return the history's pages to the OS (a no-op unless auto_vacuum=INCREMENTAL)
+        catalog.executescript("PRAGMA incremental_vacuum")
+    catalog.close()
+    for path in retired:
+        _remove(path)
+    db.close_pools()
+    report["seconds"] = round(time.perf_counter() - t0, 3)
+    return report
+
+
+def status():
+    """{"shards": N, "files": [{path, bytes, rows per table}]} for the current layout."""
+    db.init_db()
+    files = []
+    for shard in db.user_shards():
+        path = db.shard_path(shard)
+        with db.get_conn(shard=shard) as con:
+            rows = {table: con.execute(f"SELECT COUNT(*) FROM main.{table}").fetchone()[0] for table in SHARD_TABLES}
+        files.append({"path": path, "bytes": os.path.getsize(path), "rows": rows})
+    return {"shards": db.shard_count(), "files": files}
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Inspect or change how user data is split across SQLite files.")
+    sub = ap.add_subparsers(dest="command", required=True)
+    sub.add_parser("status", help="layout, files and row counts")
+    move = sub.add_parser("reshard", help="move all user rows into a new layout (app stopped)")
+    move.add_argument("shards", type=int, help="number of shard files, 0 for a single database")
+    move.add_argument("--batch", type=int, default=BATCH_ROWS)
+    args = ap.parse_args(argv)
+
+    if args.command == "reshard":
+        if args.shards < 0:
+            ap.error("shards must be 0 or more")
+        report = reshard(args.shards, args.batch)
+        for key, value in report.items():
+            print(f"{key}: {value}")
+    report = status()
+    print(f"shards: {report['shards'] or 'none (single file)'}")
+    for f in report["files"]:
+        print(f"  {f['path']}  {f['bytes'] / 1e6:.1f} MB  {f['rows']}")
+
+
+if __name__ == "__main__":
+    main()
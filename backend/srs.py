@@ -0,0 +1,229 @@
+"""Leitner (spaced-repetition) state per user/word.
+
+`user_word_state` holds the current box, streak and due time for each word a
+user has answered, and `user_stats` holds running per-user counters. Both are
+written in the same transaction as the `user_attempts` row, so reads never
+have to walk the attempt log. `rebuild_state` recomputes them from history:
+
+    python -m backend.srs rebuild [--user ID] [--force]
+
+Once backend.maintenance has pruned old attempts the log no longer holds the
+whole history, so a rebuild would reset boxes and counters; it refuses unless
+forced.
+"""
+import argparse
+import sqlite3
+
+MAX_BOX = 5
+MASTERED_BOX = 4
+# days until a word sitting in box N comes due again
+BOX_INTERVAL_DAYS = {1: 1, 2: 2, 3: 4, 4: 8, 5: 16}
+
+_STATE = "SELECT box, streak, max_box FROM user_word_state WHERE user_id=? AND word_id=?"
+_UPSERT_STATE = """
+    INSERT INTO user_word_state(user_id, word_id, box, streak, max_box, last_seen, due_at)
+    VALUES(?,?,?,?,?,{seen},datetime({seen},?))
+    ON CONFLICT(user_id, word_id) DO UPDATE SET
+        box=excluded.box, streak=excluded.streak, max_box=excluded.max_box,
+        last_seen=excluded.last_seen, due_at=excluded.due_at
+"""
+_BUMP_STATS = """
+    INSERT INTO user_stats(user_id, attempts, correct, mastered) VALUES(?,?,?,?)
+    ON CONFLICT(user_id) DO UPDATE SET
+        attempts=attempts+excluded.attempts, correct=correct+excluded.correct,
+        mastered=mastered+excluded.mastered
+"""
+
+
+# app_meta: attempts dated before this day (as YYYYMMDD) have been pruned from user_attempts
+PRUNED_KEY = "attempts_pruned_before"
+
+_DUE_WORDS = """
+    SELECT s.word_id FROM user_word_state s
+    WHERE s.user_id=? AND s.language=? AND s.due_at<=CURRENT_TIMESTAMP
+      AND NOT EXISTS (SELECT 1 FROM user_day_words d
+                      WHERE d.user_id=s.user_id AND d.date_local=? AND d.word_id=s.word_id)
+    ORDER BY s.due_at LIMIT ?
+"""
+# everything a quiz batch needs from the user's state in one statement: tag 0 = due (in
+# due_at order: the subquery is a co-routine whose rows are emitted as sorted), 1 = served
+# on the day, 2 = the sampled candidates already answered (left out when there are none)
+_BATCH_STATE = f"""
+    SELECT 0, word_id FROM ({_DUE_WORDS})
+    UNION ALL
+    SELECT 1, word_id FROM user_day_words WHERE user_id=? AND date_local=?
+"""
+_KNOWN_CANDIDATES = """
+    UNION ALL
+    SELECT 2, word_id FROM user_word_state WHERE user_id=? AND word_id IN ({candidates})
+"""
+
+
+def next_box(box, correct):
+    return min(MAX_BOX, box + 1) if correct else 1
+
+
+def due_modifier(box):
+    return f"+{BOX_INTERVAL_DAYS[box]} days"
+
+
+def apply_attempt(cur, user_id, word_id, correct):
+    """Advance the user's state for one answer inside the caller's transaction.
+
+    Returns (new box, 1 if this answer mastered the word for the first time else 0).
+    """
+    cur.execute(_STATE, (user_id, word_id))
+    row = cur.fetchone()
+    box, streak, max_box = row if row else (1, 0, 1)
+    box = next_box(box, correct)
+    streak = streak + 1 if correct else 0
+    newly_mastered = 1 if box >= MASTERED_BOX > max_box else 0
+    cur.execute(_UPSERT_STATE.format(seen="CURRENT_TIMESTAMP"),
+                (user_id, word_id, box, streak, max(box, max_box), due_modifier(box)))
+    cur.execute(_BUMP_STATS, (user_id, 1, 1 if correct else 0, newly_mastered))
+    return box, newly_mastered
+
+
+def due_words(cur, user_id, language, date_local, limit, skip=()):
+    """Up to `limit` words in `language` due for review, most overdue first, none served on `date_local` or in `skip`.
+
+    One range read on idx_user_word_state_due, however long the user's history
+    and however many other languages it spans.
+    """
+    if limit <= 0:
+        return []
+    cur.execute(_DUE_WORDS, (user_id, language, date_local, limit + len(skip)))
+    return [wid for (wid,) in cur.fetchall() if wid not in skip][:limit]
+
+
+def batch_state(cur, user_id, language, date_local, limit, candidates, skip=()):
+    """(due_words(...), ids served on `date_local`, the subset of `candidates` the user has answered).
+
+    One round trip for what due_words, the served-today read and
+    known_words would fetch separately.
+    """
+    candidates = list(candidates)
+    params = [user_id, language, date_local, max(limit, 0) + len(skip), user_id, date_local]
+    sql = _BATCH_STATE
+    if candidates:
+        sql += _KNOWN_CANDIDATES.format(candidates=",".join("?" for _ in candidates))
+        params += [user_id, *candidates]
+    due, served, known = [], set(), set()
+    for tag, wid in cur.execute(sql, params).fetchall():
+        if tag == 0:
+            if wid not in skip:
+                due.append(wid)
+        elif tag == 1:
+            served.add(wid)
+        else:
+            known.add(wid)
+    return due[:max(limit, 0)], served, known
+
+
+def known_words(cur, user_id, word_ids):
+    """The subset of `word_ids` the user has answered before (primary-key probes)."""
+    word_ids = list(word_ids)
+    if not word_ids:
+        return set()
+    cur.execute(f"SELECT word_id FROM user_word_state WHERE user_id=? AND word_id IN "
+                f"({','.join('?' for _ in word_ids)})", (user_id, *word_ids))
+    return {wid for (wid,) in cur.fetchall()}
+
+
+def pruned_before(cur):
+    """The ISO day before which attempts were pruned from the log, or None if it is complete."""
+    try:
+        row = cur.execute("SELECT value FROM app_meta WHERE key=?", (PRUNED_KEY,)).fetchone()
+    except sqlite3.OperationalError:  # app_meta predates this database's migrations
+        return None
+    if row is None:
+        return None
+    day = str(row[0])
+    return f"{day[:4]}-{day[4:6]}-{day[6:]}"
+
+
+def mark_pruned(cur, cutoff):
+    """Record that attempts dated before `cutoff` (ISO day) are gone from user_attempts."""
+    cur.execute("""
+        INSERT INTO app_meta(key, value) VALUES(?, ?)
+        ON CONFLICT(key) DO UPDATE SET value=MAX(value, excluded.value)
+    """, (PRUNED_KEY, int(cutoff.replace("-", ""))))
+
+
+def rebuild_state(cur, user_id=None, force=False):
+    """Recompute user_word_state and user_stats from user_attempts (all users, or one).
+
+    Raises RuntimeError if the log was pruned, unless `force`: the rebuilt
+    state would then only count the attempts still kept.
+    """
+    pruned = pruned_before(cur)
+    if pruned and not force:
+        raise RuntimeError(f"attempts before {pruned} were pruned, so rebuilding would reset "
+                           f"state and counters built from them; pass force=True (--force) to do it anyway")
+    where, params = ("WHERE user_id=?", (user_id,)) if user_id is not None else ("", ())
+    cur.execute(f"DELETE FROM user_word_state {where}", params)
+    cur.execute(f"DELETE FROM user_stats {where}", params)
+    rows = cur.execute(f"""
+        SELECT user_id, word_id, correct, box, last_seen FROM user_attempts {where}
+        ORDER BY user_id, word_id, id
+    """, params)
+    # stream the log: one pending state per (user, word), flushed when the key changes
+    upsert = _UPSERT_STATE.format(seen="?")
+    write = cur.connection.cursor()
+    states, stats = [], {}
+    key = state = None
+    for uid, wid, correct, box, last_seen in rows:
+        if (uid, wid) != key:
+            if state:
+                states.append(state)
+            key = (uid, wid)
+            state = [uid, wid, 1, 0, 1, None]
+        box = box or 1
+        state[2] = box
+        state[3] = state[3] + 1 if correct else 0
+        state[4] = max(state[4], box)
+        state[5] = last_seen
+        totals = stats.setdefault(uid, [0, 0, 0])
+        totals[0] += 1
+        totals[1] += 1 if correct else 0
+        if len(states) >= 5000:
+            _flush_states(write, upsert, states, stats)
+    if state:
+        states.append(state)
+    _flush_states(write, upsert, states, stats)
+    write.executemany(_BUMP_STATS, [(uid, a, c, m) for uid, (a, c, m) in stats.items()])
+    return len(stats)
+
+
+def _flush_states(write, upsert, states, stats):
+    write.executemany(upsert, [(uid, wid, box, streak, max_box, seen, seen, due_modifier(box))
+                               for uid, wid, box, streak, max_box, seen in states])
+    for uid, _, _, _, max_box, _ in states:
+        if max_box >= MASTERED_BOX:
+            stats[uid][2] += 1
+    states.clear()
+
+
+def main(argv=None):
+    from .db import get_conn, init_db, shard_of, user_shards
+
+    ap = argparse.ArgumentParser(description="Maintain materialized Leitner state.")
+    sub = ap.add_subparsers(dest="command", required=True)
+    rebuild = sub.add_parser("rebuild", help="recompute state and counters from user_attempts")
+    rebuild.add_argument("--user", type=int, help="only this user id")
+    rebuild.add_argument("--force", action="store_true", help="rebuild even though old attempts were pruned")
+    args = ap.parse_args(argv)
+
+    init_db()
+    users = 0
+    # each shard holds its users' attempts and state (just DB_PATH when unsharded)
+    for shard in [shard_of(args.user)] if args.user is not None else user_shards():
+        with get_conn(shard=shard) as con:
+            con.execute("BEGIN IMMEDIATE")
+            users += rebuild_state(con.cursor(), args.user, args.force)
+            con.commit()
+    print(f"rebuilt state for {users} user(s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,425 @@
+"""In-memory word-bank index for O(k) sampling, shared across processes through a snapshot file.
+
+The index is written as a compact binary snapshot next to the database
+(`<db>.wordbank-<version>`): fixed-width arrays of ids, text offsets and
+language codes, a UTF-8 string heap and one row-number array per
+(language, part of speech) bucket. Every process memory-maps the current
+snapshot read-only, so the pages are shared by the OS and a cold start reads
+no rows from SQLite. Ids, buckets and offsets are read in place through
+memoryviews; only the texts actually used get decoded.
+
+A snapshot is written only for a new wordbank_version, by the process that
+bumped it (add_word_rows, the importer) right after its commit: appends copy
+the previous snapshot's sections and add the new rows, rewrites rebuild it
+from the table. Rows that show up without a bump (an import between chunks)
+or before the new snapshot is published are read into a small per-process
+delta on top of the mapped snapshot, so the request path never writes one
+for an append. Set WORDAPP_WORDBANK_SNAPSHOT=0 to keep a private in-memory
+index per process instead, which is also the fallback when the snapshot
+cannot be written.
+"""
+import glob
+import json
+import mmap
+import os
+import random
+import struct
+import threading
+from array import array
+from bisect import bisect_left
+
+from . import db
+from .db import get_conn
+
+SNAPSHOTS = os.environ.get("WORDAPP_WORDBANK_SNAPSHOT", "1") != "0"
+# Sampling gives up on rejection after this many draws per wanted row and
+# falls back to a single pass over the bucket (only happens when most of the
+# bucket is excluded, e.g. a user who has seen nearly every word today).
+_MAX_DRAWS_PER_ROW = 4
+
+_MAGIC = b"WORDBANK"
+_FORMAT = 1
+_HEADER = struct.Struct("<8sII")  # magic, format, directory length
+_ALIGN = 8
+
+
+class _Index:
+    """Lookup and sampling over `ids`, `texts`, `language_codes`, `languages` and `buckets`."""
+
+    def __len__(self):
+        return len(self.ids)
+
+    def row_of(self, word_id):
+        i = bisect_left(self.ids, word_id)
+        if i < len(self.ids) and self.ids[i] == word_id:
+            return i
+        return None
+
+    def text_of(self, word_id):
+        row = self.row_of(word_id)
+        return None if row is None else self.texts[row]
+
+    def language_of(self, word_id):
+        row = self.row_of(word_id)
+        return None if row is None else self.languages[self.language_codes[row]]
+
+    def language_sizes(self):
+        """{language: number of words}."""
+        return {lang: len(self.buckets[(lang, None)]) for lang in self.languages}
+
+    def bucket(self, language=None, pos=None):
+        if language is None and pos is None:
+            return range(len(self.ids))
+        return self.buckets.get((language or None, pos or None), ())
+
+    def sample_rows(self, rows, k, exclude_ids=(), skip_rows=()):
+        """Pick up to k distinct rows from `rows` whose ids are not excluded."""
+        n = len(rows)
+        if k <= 0 or n == 0:
+            return []
+        picked = []
+        seen = set(skip_rows)
+        draws = 0
+        max_draws = _MAX_DRAWS_PER_ROW * k + 16
+        while len(picked) < k and draws < max_draws and len(seen) < n:
+            draws += 1
+            row = rows[random.randrange(n)]
+            if row in seen:
+                continue
+            seen.add(row)
+            if self.ids[row] not in exclude_ids:
+                picked.append(row)
+        if len(picked) < k:
+            rest = [r for r in rows if r not in seen and self.ids[r] not in exclude_ids]
+            picked += random.sample(rest, min(k - len(picked), len(rest)))
+        return picked
+
+    def sample_ids(self, k, exclude_ids=(), language=None, pos=None):
+        rows = self.sample_rows(self.bucket(language, pos), k, exclude_ids)
+        return [self.ids[r] for r in rows]
+
+
+class WordBankIndex(_Index):
+    """Compact in-memory view of the words table for O(k) random sampling.
+
+    Rows are kept in id order in parallel arrays. Buckets map
+    (language, part_of_speech) to row positions; None in either slot means
+    "any", and (None, None) is the whole bank. Quizzes sample within one
+    language's buckets, so their cost depends only on that language's size.
+    """
+
+    def __init__(self):
+        self.version = 0  # wordbank_version (app_meta) the index reflects
+        self.high_water = 0  # highest word id loaded
+        self.ids = array("q")
+        self.texts = []
+        self.language_codes = array("H")  # per row, an index into `languages`
+        self.languages = []
+        self.buckets = {}
+
+    def extend(self, rows):
+        """Append (id, text, part_of_speech, language) rows with ids > high_water."""
+        for wid, text, pos, lang in rows:
+            row = len(self.ids)
+            self.ids.append(wid)
+            self.texts.append(text)
+            pos = pos or None
+            lang = lang or None
+            if (lang, None) not in self.buckets:
+                self.languages.append(lang)
+            self.language_codes.append(self.languages.index(lang))
+            for key in ((lang, pos), (lang, None), (None, pos)):
+                bucket = self.buckets.get(key)
+                if bucket is None:
+                    bucket = self.buckets[key] = array("i")
+                bucket.append(row)
+            self.high_water = wid
+
+
+class _Texts:
+    """Sequence view of a snapshot's string heap; decodes one text per access."""
+
+    def __init__(self, heap, offsets):
+        self.heap = heap
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, row):
+        return str(self.heap[self.offsets[row]:self.offsets[row + 1]], "utf-8")
+
+    def __iter__(self):
+        return (self[row] for row in range(len(self)))
+
+
+class _Concat:
+    """Read-only sequence view of two sequences back to back."""
+
+    def __init__(self, head, tail):
+        self.head = head
+        self.tail = tail
+
+    def __len__(self):
+        return len(self.head) + len(self.tail)
+
+    def __getitem__(self, i):
+        n = len(self.head)
+        if i < 0:
+            i += n + len(self.tail)
+        return self.head[i] if i < n else self.tail[i - n]
+
+    def __iter__(self):
+        yield from self.head
+        yield from self.tail
+
+
+class SnapshotIndex(_Index):
+    """The index read in place from a memory-mapped snapshot file."""
+
+    def __init__(self, path):
+        with open(path, "rb") as fh:
+            self._map = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(self._map)
+        magic, fmt, dir_len = _HEADER.unpack_from(view)
+        if magic != _MAGIC or fmt != _FORMAT:
+            raise ValueError(f"{path} is not a word-bank snapshot (format {_FORMAT})")
+        directory = json.loads(bytes(view[_HEADER.size:_HEADER.size + dir_len]))
+
+        def section(offset, length, code):
+            return view[offset:offset + length].cast(code)
+
+        sections = directory["sections"]
+        self.path = path
+        self.version = directory["version"]
+        self.high_water = directory["high_water"]
+        self.languages = directory["languages"]
+        self.ids = section(*sections["ids"], "q")
+        self.language_codes = section(*sections["codes"], "H")
+        self.texts = _Texts(section(*sections["heap"], "B"), section(*sections["offsets"], "Q"))
+        self.buckets = {(lang, pos): section(offset, length, "i")
+                        for lang, pos, offset, length in directory["buckets"]}
+
+
+class PatchedIndex(_Index):
+    """A mapped snapshot plus the rows appended after it was written, held in this process."""
+
+    def __init__(self, base):
+        self.base = base
+        self.path = base.path
+        self.version = base.version
+        self.delta = WordBankIndex()
+        self.delta.high_water = base.high_water
+        self.extend(())
+
+    def row_of(self, word_id):
+        if word_id <= self.base.high_water:
+            return self.base.row_of(word_id)
+        row = self.delta.row_of(word_id)
+        return None if row is None else len(self.base) + row
+
+    def extend(self, rows):
+        """Append (id, text, part_of_speech, language) rows with ids > high_water."""
+        base, delta = self.base, self.delta
+        delta.extend(rows)
+        self.high_water = delta.high_water
+        n = len(base)
+        self.languages = list(base.languages) + [lang for lang in delta.languages if lang not in base.languages]
+        code_of = [self.languages.index(lang) for lang in delta.languages]
+        self.ids = _Concat(base.ids, delta.ids)
+        self.texts = _Concat(base.texts, delta.texts)
+        self.language_codes = _Concat(base.language_codes, array("H", (code_of[c] for c in delta.language_codes)))
+        self.buckets = dict(base.buckets)
+        for key, rows in delta.buckets.items():
+            self.buckets[key] = _Concat(base.buckets.get(key, ()), array("i", (n + row for row in rows)))
+
+
+def _write_snapshot(path, version, base, extra):
+    """Write `base` (a SnapshotIndex, or None) followed by the rows of `extra` (a WordBankIndex)."""
+    n_base = len(base) if base else 0
+    languages = list(base.languages) if base else []
+    languages += [lang for lang in extra.languages if lang not in languages]
+    code_of = [languages.index(lang) for lang in extra.languages]
+
+    heap = [base.texts.heap] if base else []
+    heap_len = len(base.texts.heap) if base else 0
+    offsets = array("Q", [] if base else [0])
+    if base:
+        offsets.frombytes(base.texts.offsets.cast("B"))
+    for text in extra.texts:
+        encoded = text.encode("utf-8")
+        heap.append(encoded)
+        heap_len += len(encoded)
+        offsets.append(heap_len)
+
+    # (directory entry, buffers written back to back)
+    sections = [
+        ("ids", ([base.ids] if base else []) + [extra.ids]),
+        ("offsets", [offsets]),
+        ("codes", ([base.language_codes] if base else []) + [array("H", (code_of[c] for c in extra.language_codes))]),
+        ("heap", heap),
+    ]
+    keys = list(base.buckets) if base else []
+    keys += [key for key in extra.buckets if key not in keys]
+    for key in keys:
+        parts = [base.buckets[key]] if base and key in base.buckets else []
+        if key in extra.buckets:
+            parts.append(array("i", (n_base + row for row in extra.buckets[key])))
+        sections.append((list(key), parts))
+
+    directory = {"version": version, "high_water": max(extra.high_water, base.high_water if base else 0),
+                 "languages": languages}
+    dir_len = 0
+    while True:  # section offsets depend on the directory's own length
+        offset = _HEADER.size + dir_len
+        layout = []
+        for _, parts in sections:
+            offset += -offset % _ALIGN
+            size = sum(memoryview(p).nbytes for p in parts)
+            layout.append([offset, size])
+            offset += size
+        directory["sections"] = {name: spot for (name, _), spot in zip(sections[:4], layout)}
+        directory["buckets"] = [key + spot for (key, _), spot in zip(sections[4:], layout[4:])]
+        encoded = json.dumps(directory).encode()
+        if len(encoded) <= dir_len:
+            break
+        dir_len = len(encoded) + 64
+
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp, "wb") as fh:
+        fh.write(_HEADER.pack(_MAGIC, _FORMAT, dir_len))
+        fh.write(encoded.ljust(dir_len))
+        for _, parts in sections:
+            fh.write(b"\0" * (-fh.tell() % _ALIGN))
+            for part in parts:
+                fh.write(part)
+    os.replace(tmp, path)  # readers only ever open whole snapshots
+
+
+_lock = threading.Lock()
+_index = None
+
+
+def _load_new_rows(index, con):
+    cur = con.cursor()
+    cur.execute("SELECT id, text, part_of_speech, language FROM words WHERE id>? ORDER BY id",
+                (index.high_water,))
+    index.extend(cur.fetchall())
+
+
+def _bank_state(con):
+    cur = con.cursor()
+    cur.execute("""
+        SELECT (SELECT value FROM app_meta WHERE key='wordbank_version'),
+               (SELECT value FROM app_meta WHERE key='wordbank_rewritten'),
+               (SELECT MAX(id) FROM words)
+    """)
+    version, rewritten, latest = cur.fetchone()
+    return version or 0, rewritten or 0, latest or 0
+
+
+def bump_version(cur, rewritten=False):
+    """Record a change to the bank inside the writer's transaction.
+
+    Pure appends only move wordbank_version, so readers patch the new rows
+    in; `rewritten` (existing rows changed) makes them reload from scratch.
+    """
+    cur.execute("""
+        INSERT INTO app_meta(key, value) VALUES('wordbank_version', 1)
+        ON CONFLICT(key) DO UPDATE SET value=value+1
+    """)
+    if rewritten:
+        cur.execute("""
+            INSERT INTO app_meta(key, value)
+            SELECT 'wordbank_rewritten', value FROM app_meta WHERE key='wordbank_version'
+            ON CONFLICT(key) DO UPDATE SET value=excluded.value
+        """)
+
+
+def snapshot_path(version):
+    return f"{db.DB_PATH}.wordbank-{version}"
+
+
+def _map(con, path, latest):
+    """Map a snapshot, patching in rows appended after it was written."""
+    index = SnapshotIndex(path)
+    if latest > index.high_water:
+        index = PatchedIndex(index)
+        _load_new_rows(index, con)
+    return index
+
+
+def _write_version(con, version, index):
+    """Write the snapshot of `version`, extending the one `index` maps if it is still valid; returns its path."""
+    path = snapshot_path(version)
+    base = index.base if isinstance(index, PatchedIndex) else index
+    extra = WordBankIndex()
+    extra.high_water = base.high_water if base else 0
+    _load_new_rows(extra, con)
+    _write_snapshot(path, version, base, extra)
+    for old in glob.glob(glob.escape(db.DB_PATH) + ".wordbank-*"):
+        if old != path and not old.endswith(".tmp"):
+            try:
+                os.remove(old)  # processes still mapping it keep their pages until they move on
+            except OSError:
+                pass
+    return path
+
+
+def _shared_index(con, version, rewritten, latest, publish):
+    index = _index if isinstance(_index, (SnapshotIndex, PatchedIndex)) else None
+    if index is not None and (rewritten > index.version or latest < index.high_water):
+        index = None  # rows changed underneath it: start over
+    if index is None or index.version != version:
+        try:
+            return _map(con, snapshot_path(version), latest)
+        except FileNotFoundError:
+            if publish or index is None:
+                return _map(con, _write_version(con, version, index), latest)
+    # appended rows only, and no snapshot (yet) to map them from: keep them in the delta
+    if not isinstance(index, PatchedIndex):
+        index = PatchedIndex(index)
+    _load_new_rows(index, con)
+    return index
+
+
+def _refresh(con, publish=False):
+    global _index
+    with _lock:
+        version, rewritten, latest = _bank_state(con)
+        if _index is not None and _index.version == version and _index.high_water == latest:
+            return _index
+        if SNAPSHOTS:
+            try:
+                _index = _shared_index(con, version, rewritten, latest, publish)
+                return _index
+            except (OSError, ValueError):  # read-only directory or a foreign file: keep a private index
+                if not isinstance(_index, WordBankIndex):
+                    _index = None
+        # rows changed (or the bank was reset) underneath us: start over
+        if _index is None or rewritten > _index.version or latest < _index.high_water:
+            _index = WordBankIndex()
+        if latest != _index.high_water:
+            _load_new_rows(_index, con)
+        _index.version = version
+        return _index
+
+
+def get_index(con=None):
+    """Return the shared index, mapping, writing or patching it as the words table changes."""
+    if con is not None:
+        return _refresh(con)
+    with get_conn() as con:
+        return _refresh(con)
+
+
+def publish(con):
+    """Write the snapshot of the version the caller just committed, so other processes can map it."""
+    return _refresh(con, publish=True)
+
+
+def invalidate():
+    """Drop this process's index; the next get_index() maps (or rebuilds) it again."""
+    global _index
+    with _lock:
+        _index = None
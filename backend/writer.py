@@ -0,0 +1,191 @@
+import atexit
+import logging
+import os
+import queue
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+QUEUE_SIZE = int(os.environ.get("WORDAPP_ATTEMPT_QUEUE_SIZE", "1000"))
+BATCH_SIZE = int(os.environ.get("WORDAPP_ATTEMPT_BATCH_SIZE", "128"))
+DURABLE = os.environ.get("WORDAPP_DURABLE_ATTEMPTS", "0") == "1"
+WRITE_RETRIES = 3
+
+
+class WriteBehindQueue:
+    """Bounded queue drained by one background thread that group-commits batches.
+
+    `write_batch(items, durable)` is called with everything that is queued at
+    that moment (up to `batch_size`) and must write it in one transaction.
+    `submit` blocks only when the queue is full; with `durable` it also waits
+    until its item is committed with synchronous=FULL, and raises the write's
+    error if it could not be. `flush` waits until everything submitted before
+    the call has been written, however much others keep submitting.
+
+    With `group_by`, a batch is split into groups of items with the same key,
+    written (and retried) as separate transactions. A group that still fails
+    after WRITE_RETRIES tries is written again one item at a time, so one bad
+    item only loses itself; so does an item whose key cannot be computed.
+    """
+
+    def __init__(self, write_batch, maxsize=None, batch_size=None, durable=None, name="write-behind",
+                 group_by=None):
+        self.write_batch = write_batch
+        self.group_by = group_by
+        self.batch_size = batch_size or BATCH_SIZE
+        self.durable = DURABLE if durable is None else durable
+        self.name = name
+        self._queue = queue.Queue(maxsize or QUEUE_SIZE)
+        self._idle = threading.Condition()
+        self._submit_lock = threading.Lock()  # queue order == sequence order
+        self._submitted_seq = 0  # sequence number of the last item queued
+        self._done_seq = 0  # every item up to this one has been written or has failed
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self.submitted = 0
+        self.written = 0
+        self.batches = 0
+        self.failed = 0
+        self.last_error = None
+
+    def _ensure_started(self):
+        if self._thread is None or not self._thread.is_alive():
+            with self._start_lock:
+                if self._thread is None or not self._thread.is_alive():
+                    self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+                    self._thread.start()
+
+    def submit(self, item, durable=None):
+        durable = self.durable if durable is None else durable
+        self._ensure_started()
+        ticket = _Ticket() if durable else None
+        with self._submit_lock:
+            self._submitted_seq += 1
+            self.submitted += 1
+            self._queue.put((self._submitted_seq, item, durable, ticket))
+        if ticket is not None:
+            ticket.done.wait()
+            if ticket.error is not None:
+                raise ticket.error
+
+    def flush(self, timeout=None):
+        """Block until every item submitted before this call has been written (or failed)."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        target = self._submitted_seq
+        with self._idle:
+            while self._done_seq < target:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    raise TimeoutError(f"{self.name}: {target - self._done_seq} item(s) still pending")
+                self._idle.wait(remaining)
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            # group commit: take whatever piled up while the last batch was being written
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            errors = [None] * len(batch)
+            try:
+                errors = self._write(batch)
+            except Exception as e:  # a bug in the write path must not strand flush() or the tickets
+                log.exception("%s: batch of %d lost", self.name, len(batch))
+                self.failed += len(batch)
+                self.last_error = repr(e)
+                errors = [e] * len(batch)
+            finally:
+                with self._idle:
+                    self._done_seq = batch[-1][0]
+                    self._idle.notify_all()
+                for (_, _, _, ticket), error in zip(batch, errors):
+                    if ticket is not None:
+                        ticket.error = error
+                        ticket.done.set()
+
+    def _try(self, items, durable, tries):
+        """None once `items` are written in one transaction, else the last error."""
+        error = None
+        for attempt in range(1, tries + 1):
+            try:
+                self.write_batch(items, durable)
+                self.written += len(items)
+                self.batches += 1
+                return None
+            except Exception as e:  # keep the writer thread alive whatever happens
+                error = e
+                self.last_error = repr(e)
+                log.warning("%s: batch of %d failed (try %d/%d): %s",
+                            self.name, len(items), attempt, tries, e)
+                if attempt < tries:
+                    time.sleep(0.05 * attempt)
+        return error
+
+    def _write(self, batch):
+        """Write `batch`; returns the error (or None) for each of its items."""
+        if self.group_by is None:
+            return self._write_group(batch)
+        groups = {}
+        errors = [None] * len(batch)
+        for i, entry in enumerate(batch):
+            try:
+                key = self.group_by(entry[1])
+            except Exception as e:  # an item that cannot be routed is lost on its own
+                errors[i] = e
+                self.failed += 1
+                self.last_error = repr(e)
+                log.error("%s: dropped an item whose group could not be found: %s", self.name, e)
+                continue
+            groups.setdefault(key, []).append(i)
+        for positions in groups.values():
+            for i, error in zip(positions, self._write_group([batch[i] for i in positions])):
+                errors[i] = error
+        return errors
+
+    def _write_group(self, batch):
+        error = self._try([item for _, item, _, _ in batch], any(d for _, _, d, _ in batch), WRITE_RETRIES)
+        if error is None:
+            return [None] * len(batch)
+        # isolate the bad item(s): the rest of the batch still gets written
+        errors = [self._try([item], durable, 1) for _, item, durable, _ in batch] if len(batch) > 1 else [error]
+        lost = sum(e is not None for e in errors)
+        self.failed += lost
+        if lost:
+            log.error("%s: dropped %d item(s) after %d tries", self.name, lost, WRITE_RETRIES)
+        return errors
+
+    def stats(self):
+        return {
+            "queued": self._queue.qsize(), "pending": self._submitted_seq - self._done_seq,
+            "submitted": self.submitted,
+            "written": self.written, "batches": self.batches, "failed": self.failed,
+            "last_error": self.last_error,
+        }
+
+
+class _Ticket:
+    """What a durable submitter waits on: set once its item is written, with the error if it was not."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.error = None
+
+
+_queues = []
+
+
+def register(q):
+    _queues.append(q)
+    return q
+
+
+@atexit.register
+def _flush_all():
+    for q in _queues:
+        try:
+            q.flush(timeout=10)
+        except TimeoutError as e:
+            log.error("%s", e)
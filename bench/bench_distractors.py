@@ -0,0 +1,143 @@
+"""Build cost and quality of the confusable-word (distractor) lists.
+
+    python bench/bench_distractors.py --words 100000 [--k 8]
+
+Fills a throwaway DB with data/words.csv plus `--words` generated
+pseudo-words whose definitions reuse the real definitions' vocabulary, then
+reports: full build time and its phases, peak traced memory of a second
+build, recall of the windowed (LSH) search against exact top-k on a sample,
+lookup latency of get_random_distractors with and without the lists, and
+the cost of an incremental update after adding 100 words.
+"""
+import argparse
+import csv
+import os
+import random
+import re
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from backend import db, distractors, importer, logic, wordbank  # noqa: E402
+
+SYLLABLES = ["ab", "ac", "ad", "al", "am", "an", "ar", "as", "at", "be", "ca", "co", "de", "di", "do", "el",
+             "en", "er", "es", "ex", "fa", "ga", "in", "is", "la", "le", "li", "lo", "ma", "me", "mi", "mo",
+             "na", "ne", "no", "ob", "om", "on", "or", "pa", "pe", "pro", "ra", "re", "ri", "sa", "se", "si",
+             "ta", "te", "ti", "to", "tra", "un", "va", "ve", "vi"]
+SUFFIXES = ["", "ate", "ous", "ity", "ize", "ent", "ion", "ive", "ism", "al"]
+POS = ["noun", "verb", "adjective", "adverb"]
+
+
+def generated_rows(n, vocabulary, seed):
+    rnd = random.Random(seed)
+    seen = set()
+    while len(seen) < n:
+        text = "".join(rnd.choice(SYLLABLES) for _ in range(rnd.randint(2, 4))) + rnd.choice(SUFFIXES)
+        if text in seen:
+            continue
+        seen.add(text)
+        yield text, " ".join(rnd.choice(vocabulary) for _ in range(rnd.randint(5, 10))), rnd.choice(POS), "en"
+
+
+def fill(rows):
+    with db.get_conn() as con:
+        con.execute("BEGIN IMMEDIATE")
+        inserted, _ = importer.upsert_rows(con.cursor(), [p for p in (importer.word_row(*r) for r in rows) if p])
+        wordbank.bump_version(con.cursor())
+        con.commit()
+        wordbank.publish(con)
+    return inserted
+
+
+def recall(sample_size, k, seed):
+    """Share of the exact top-k found by the stored lists, over a sample of the largest bucket."""
+    import numpy as np
+    with db.get_conn() as con:
+        language, pos = con.execute("""
+            SELECT language, part_of_speech FROM words GROUP BY 1, 2 ORDER BY COUNT(*) DESC LIMIT 1
+        """).fetchone()
+        max_id = con.execute("SELECT MAX(id) FROM words").fetchone()[0]
+        ids, rows = distractors._bucket(con, language, pos, max_id)
+        vecs = distractors.vectorize(rows)
+        sample = random.Random(seed).sample(range(len(ids)), min(sample_size, len(ids)))
+        stored = distractors.neighbors(con, [ids[r] for r in sample])
+    sims = vecs[sample] @ vecs.T
+    sims[np.arange(len(sample)), sample] = -np.inf
+    found = wanted = 0
+    for i, r in enumerate(sample):
+        exact = {ids[c] for c in np.argsort(-sims[i])[:k].tolist()
+                 if not distractors._related(rows[r][0], rows[c][0])}
+        found += len(exact & set(stored[ids[r]]))
+        wanted += len(exact)
+    return len(ids), found / max(wanted, 1)
+
+
+def lookup_ms(n, seed):
+    rnd = random.Random(seed)
+    with db.get_conn() as con:
+        max_id = con.execute("SELECT MAX(id) FROM words").fetchone()[0]
+    samples = []
+    for _ in range(n):
+        wid = rnd.randint(1, max_id)
+        t0 = time.perf_counter()
+        logic.get_random_distractors(wid, 4)
+        samples.append((time.perf_counter() - t0) * 1000)
+    return statistics.median(samples)
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--words", type=int, default=100000)
+    ap.add_argument("--k", type=int, default=distractors.NEIGHBORS)
+    ap.add_argument("--seed", type=int, default=0)
+    args = ap.parse_args(argv)
+
+    db.DB_PATH = os.path.join(tempfile.mkdtemp(prefix="wordapp-distractors-"), "app.db")
+    db.init_db()
+    with open(os.path.join(ROOT, "data", "words.csv"), newline="") as fh:
+        real = [(r["text"], r["definition"], r["part_of_speech"], r["language"]) for r in csv.DictReader(fh)]
+    vocabulary = sorted({w for r in real for w in re.findall(r"[a-z]+", r[1].lower())})
+    total = fill(real) + fill(list(generated_rows(args.words, vocabulary, args.seed)))
+    print(f"words: {total:,}  k={args.k}  exact up to {distractors.EXACT_LIMIT:,} per bucket, "
+          f"else {distractors.TABLES} LSH tables x {distractors.WINDOW}-row windows")
+
+    report = distractors.build(args.k, args.seed)
+    print(f"build: {report['seconds']:.2f}s (vectorize {report['vectorize_s']:.2f}s, "
+          f"nearest {report['nearest_s']:.2f}s, write {report['write_s']:.2f}s) in {report['buckets']} buckets")
+    tracemalloc.start()
+    distractors.build(args.k, args.seed)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    print(f"build peak traced memory: {peak / 1e6:.1f} MB")
+
+    bucket, share = recall(300, args.k, args.seed)
+    print(f"recall@{args.k} vs exact search (largest bucket, {bucket:,} words): {share:.1%}")
+
+    with db.get_conn() as con:
+        index = wordbank.get_index(con)
+        rows = {text: row for row, text in enumerate(index.texts)}
+        for text in ("abate", "ephemeral", "ubiquitous"):
+            wid = index.ids[rows[text]] if text in rows else None
+            if wid:
+                print(f"  {text}: {', '.join(index.text_of(n) for n in distractors.neighbors(con, [wid])[wid])}")
+
+    with_lists = lookup_ms(2000, args.seed)
+    distractors.ENABLED = False
+    random_only = lookup_ms(2000, args.seed)
+    distractors.ENABLED = True
+    print(f"get_random_distractors p50: {with_lists:.3f} ms with lists, {random_only:.3f} ms random only")
+
+    fill(list(generated_rows(100, vocabulary, args.seed + 1)))
+    t0 = time.perf_counter()
+    added = distractors.update(args.k)
+    print(f"incremental update for {added} new words: {time.perf_counter() - t0:.2f}s")
+    db.close_pools()
+
+
+if __name__ == "__main__":
+    main()
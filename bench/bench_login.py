@@ -0,0 +1,74 @@
+"""Login throughput: N concurrent sign-ins, inline bcrypt vs the worker pool vs session tokens.
+
+    python bench/bench_login.py --users 32 --concurrency 8 16 32 --rounds 12
+
+Each scenario signs every user in once from `concurrency` threads and reports
+p50/p99 latency per sign-in and sign-ins per second. Uses a throwaway DB.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from backend import auth, db  # noqa: E402
+
+PASSWORD = "correct horse battery staple"
+
+
+def percentile(samples, p):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(round(p / 100 * (len(samples) - 1))))]
+
+
+def run(label, fn, users, concurrency):
+    def one(username):
+        t0 = time.perf_counter()
+        ok = fn(username)
+        return (time.perf_counter() - t0) * 1000, ok
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as ex:
+        results = list(ex.map(one, users))
+    wall = time.perf_counter() - t0
+    latencies = [ms for ms, _ in results]
+    failed = sum(1 for _, ok in results if not ok)
+    print(f"{label:<22} c={concurrency:<4} p50={percentile(latencies, 50):8.1f} ms  "
+          f"p99={percentile(latencies, 99):8.1f} ms  {len(users) / wall:8.1f} logins/s"
+          + (f"  FAILED={failed}" if failed else ""))
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--users", type=int, default=32)
+    ap.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    ap.add_argument("--rounds", type=int, default=auth.BCRYPT_ROUNDS)
+    ap.add_argument("--workers", type=int, default=max(1, auth.HASH_WORKERS))
+    args = ap.parse_args(argv)
+
+    db.DB_PATH = os.path.join(tempfile.mkdtemp(prefix="wordapp-login-"), "app.db")
+    db.configure_pool(size=max(args.concurrency) + 2)
+    db.init_db()
+    auth._secret = b"bench-secret"  # keep the real data/.session_secret out of it
+
+    auth.configure(rounds=args.rounds, workers=args.workers)
+    users = [f"user{i}" for i in range(args.users)]
+    for u in users:
+        auth.create_user(u, PASSWORD)
+    tokens = {u: auth.issue_session_token(auth.find_user(u)) for u in users}
+
+    print(f"users={args.users} bcrypt rounds={args.rounds} pool workers={args.workers} cpus={os.cpu_count()}")
+    for c in args.concurrency:
+        auth.configure(workers=0)
+        run("inline bcrypt", lambda u: auth.verify_password(u, PASSWORD), users, c)
+        auth.configure(workers=args.workers)
+        auth.verify_password(users[0], PASSWORD)  # start the pool outside the timings
+        run("process pool", lambda u: auth.verify_password(u, PASSWORD), users, c)
+        run("session token", lambda u: auth.verify_session_token(tokens[u]), users, c)
+
+
+if __name__ == "__main__":
+    main()
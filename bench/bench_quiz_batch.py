@@ -0,0 +1,106 @@
+"""Microbenchmark: batched build_quiz_batch vs the per-item SQL path it replaced.
+
+    python bench/bench_quiz_batch.py --words 200000 --sizes 20 200 --repeat 5
+
+Runs against a throwaway SQLite file, never data/app.db.
+"""
+import argparse
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from backend import db  # noqa: E402
+
+POS = ["noun", "verb", "adjective", "adverb"]
+
+
+def seed_words(n):
+    rows = [(f"word{i}", f"definition of word {i}", POS[i % len(POS)], "en") for i in range(n)]
+    with db.get_conn() as con:
+        con.executemany("INSERT INTO words(text, definition, part_of_speech, language) VALUES(?,?,?,?)", rows)
+        con.commit()
+
+
+# --- the pre-index implementation, kept verbatim for comparison -------------
+
+def legacy_get_random_distractors(correct_id, k=4, pos=None):
+    with sqlite3.connect(db.DB_PATH) as con:
+        cur = con.cursor()
+        if pos:
+            cur.execute("SELECT id, text FROM words WHERE id<>? AND part_of_speech=? ORDER BY RANDOM() LIMIT ?",
+                        (correct_id, pos, k))
+            rows = cur.fetchall()
+            if len(rows) < k:
+                cur.execute("SELECT id, text FROM words WHERE id<>? ORDER BY RANDOM() LIMIT ?",
+                            (correct_id, k - len(rows)))
+                rows += cur.fetchall()
+        else:
+            cur.execute("SELECT id, text FROM words WHERE id<>? ORDER BY RANDOM() LIMIT ?", (correct_id, k))
+            rows = cur.fetchall()
+    con.close()
+    return [r[1] for r in rows]
+
+
+def legacy_build_quiz_batch(user_id, date_local, size=20):
+    con = sqlite3.connect(db.DB_PATH)
+    cur = con.cursor()
+    cur.execute("SELECT word_id FROM user_day_words WHERE user_id=? AND date_local=?", (user_id, date_local))
+    used = {row[0] for row in cur.fetchall()}
+    if used:
+        placeholders = ",".join("?" for _ in used)
+        cur.execute(f"SELECT id, text, definition, part_of_speech FROM words WHERE id NOT IN ({placeholders}) "
+                    "ORDER BY RANDOM() LIMIT ?", (*used, size))
+    else:
+        cur.execute("SELECT id, text, definition, part_of_speech FROM words ORDER BY RANDOM() LIMIT ?", (size,))
+    rows = cur.fetchall()
+    con.close()
+    items = []
+    for wid, text, definition, pos in rows:
+        options = legacy_get_random_distractors(wid, 4, pos) + [text]
+        random.shuffle(options)
+        items.append({"word_id": wid, "question": definition, "answer": text, "options": options, "pos": pos})
+    return items
+
+# -----------------------------------------------------------------------------
+
+
+def timed(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - t0) * 1000)
+    return statistics.median(samples), min(samples)
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--words", type=int, default=50000)
+    ap.add_argument("--sizes", type=int, nargs="+", default=[20, 200])
+    ap.add_argument("--repeat", type=int, default=5)
+    args = ap.parse_args(argv)
+
+    db.DB_PATH = os.path.join(tempfile.mkdtemp(prefix="wordapp-bench-"), "app.db")
+    db.init_db()
+    seed_words(args.words)
+
+    from backend.logic import build_quiz_batch
+    build_quiz_batch(1, "2000-01-01", size=1)  # load the word-bank index outside the timings
+
+    print(f"words={args.words} repeat={args.repeat} (median / best, ms)")
+    print(f"{'size':>6} {'legacy':>20} {'batched':>20} {'speedup':>8}")
+    for size in args.sizes:
+        legacy = timed(lambda: legacy_build_quiz_batch(1, "2000-01-01", size), args.repeat)
+        batched = timed(lambda: build_quiz_batch(1, "2000-01-01", size), args.repeat)
+        print(f"{size:>6} {legacy[0]:>10.2f} / {legacy[1]:>7.2f} {batched[0]:>10.2f} / {batched[1]:>7.2f} "
+              f"{legacy[0] / batched[0]:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
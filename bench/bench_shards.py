@@ -0,0 +1,142 @@
+"""Concurrent answer writers on one database file vs. sharded storage.
+
+    python bench/bench_shards.py --profile small --shards 0 2 4 8 --writers 8 [--durable] [--hold-ms 1]
+
+Takes a copy of the synthetic database, then for each layout in --shards
+(0 = the single file) reshards it and runs --writers processes. Each one
+answers quiz items for its own slice of the bench users, as fast as it can,
+through logic.save_attempt (one write transaction per answer). Per layout it
+reports attempts/s, write latency percentiles, "database is locked" errors
+and how long the reshard took.
+
+A single file caps writes at one transaction at a time, so what sharding buys
+depends on how long each commit holds the lock: the CPU time of the
+transaction (spread over cores) plus the fsync (--durable,
+synchronous=FULL). On a machine with few cores and fast fsync there is little
+to gain. --hold-ms keeps each transaction open that much longer before its
+COMMIT, to stand in for a slow disk's fsync.
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import shutil
+import sqlite3
+import sys
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+
+from backend import db, logic, shards  # noqa: E402
+from loadgen import percentile  # noqa: E402
+from suite import prepare_db  # noqa: E402
+
+ITEMS = 20
+
+
+def _save(uid, session_id, word_id, correct, response_ms, hold):
+    if not hold:
+        logic.save_attempt(uid, session_id, word_id, "x", correct, response_ms)
+        return
+    with db.get_conn(user_id=uid) as con:  # save_attempt, with the lock held `hold` seconds longer
+        cur = con.cursor()
+        logic._record_attempt(cur, uid, session_id, word_id, "x", correct, response_ms, logic.today_local_str())
+        time.sleep(hold)
+        con.commit()
+
+
+def _writer(path, durable, hold, user_ids, ready, start, duration, results):
+    db.DB_PATH = path
+    if durable:
+        db.configure_pool(pragmas=dict(db.PRAGMAS, synchronous="FULL"))
+    rnd = random.Random(user_ids[0])
+    # an open session with items per user, found through the router like the app does
+    work = []
+    for uid in user_ids:
+        session_id = logic.start_or_resume_session(uid)
+        items, _ = logic.resume_session_items(session_id)
+        if not items:
+            items = logic.build_quiz_batch(uid, size=ITEMS)
+            logic.create_session_items(session_id, items)
+        work.append((uid, session_id, [it["word_id"] for it in items]))
+    ready.put(os.getpid())
+    start.wait()
+    latencies, locked = [], 0
+    deadline = time.perf_counter() + duration
+    while time.perf_counter() < deadline:
+        uid, session_id, words = rnd.choice(work)
+        correct = rnd.random() < 0.7
+        t0 = time.perf_counter()
+        try:
+            _save(uid, session_id, rnd.choice(words), correct, rnd.randint(800, 15000), hold)
+        except sqlite3.OperationalError as e:
+            if "locked" not in str(e) and "busy" not in str(e):
+                raise
+            locked += 1
+        latencies.append((time.perf_counter() - t0) * 1000)
+    db.close_pools()
+    results.put((latencies, locked))
+
+
+def measure(path, writers, users, duration, durable, hold):
+    ctx = multiprocessing.get_context("spawn")
+    ready, start, results = ctx.Queue(), ctx.Event(), ctx.Queue()
+    procs = [ctx.Process(target=_writer,
+                         args=(path, durable, hold, users[i::writers], ready, start, duration, results))
+             for i in range(writers)]
+    for p in procs:
+        p.start()
+    for _ in procs:  # start the clock once every writer has its sessions
+        ready.get()
+    start.set()
+    latencies, locked = [], 0
+    for _ in procs:
+        samples, errors = results.get()
+        latencies += samples
+        locked += errors
+    for p in procs:
+        p.join()
+    return latencies, locked
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--profile", default="small")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--shards", type=int, nargs="+", default=[0, 2, 4, 8])
+    ap.add_argument("--writers", type=int, default=8, help="writer processes")
+    ap.add_argument("--users", type=int, default=64, help="bench users answering")
+    ap.add_argument("--duration", type=float, default=5.0, help="seconds per layout")
+    ap.add_argument("--durable", action="store_true", help="synchronous=FULL: fsync on every commit")
+    ap.add_argument("--hold-ms", type=float, default=0.0, help="extra time each write holds its lock")
+    args = ap.parse_args(argv)
+
+    path = prepare_db(args.profile, args.seed)
+    with db.get_conn() as con:
+        users = [uid for (uid,) in con.execute("SELECT id FROM users WHERE username LIKE 'bench%' ORDER BY id LIMIT ?",
+                                               (args.users,))]
+    print(f"database: {path}  writers: {args.writers}  users: {len(users)}  "
+          f"durable: {args.durable}  hold: {args.hold_ms} ms  cpus: {os.cpu_count()}")
+    rates = {}
+    try:
+        for layout in args.shards:
+            report = shards.reshard(layout)
+            latencies, locked = measure(path, args.writers, users, args.duration, args.durable, args.hold_ms / 1000)
+            rates[layout] = len(latencies) / args.duration
+            print(f"{layout or 'single file':>11} {'shards' if layout else '':6}  {rates[layout]:8.1f} attempts/s  "
+                  f"p50 {percentile(latencies, 50):6.2f} ms  p95 {percentile(latencies, 95):7.2f} ms  "
+                  f"p99 {percentile(latencies, 99):7.2f} ms  locked {locked}  "
+                  f"(reshard {report.get('seconds', 0):.1f}s)")
+    finally:
+        db.close_pools()
+        shutil.rmtree(os.path.dirname(path), ignore_errors=True)
+    if 0 in rates:
+        for layout, rate in rates.items():
+            if layout:
+                print(f"{layout} shards: {rate / rates[0]:.2f}x the single file's write throughput")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""Cold start and per-process memory of the word-bank index: private copy vs shared snapshot.
+
+    python bench/bench_wordbank.py --words 200000 [--processes 4]
+
+Fills a throwaway DB with `--words` generated words, then reports for the
+in-memory index (WORDAPP_WORDBANK_SNAPSHOT=0) and the memory-mapped snapshot:
+time for a fresh process to get a usable index, the private vs shared memory
+(Linux smaps_rollup) of `--processes` worker processes that each sampled
+batches from it, and the cost of writing the snapshot from scratch and after
+adding 100 words.
+"""
+import argparse
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from backend import db, wordbank  # noqa: E402
+from bench_distractors import SYLLABLES, SUFFIXES, POS, fill  # noqa: E402
+
+
+def generated_rows(n, offset=0):
+    for i in range(offset, offset + n):
+        text = "".join(SYLLABLES[(i >> s) % len(SYLLABLES)] for s in (0, 5, 10)) + SUFFIXES[i % len(SUFFIXES)]
+        yield f"{text}{i}", f"definition of word number {i}", POS[i % len(POS)], "en"
+
+
+def _memory_kb():
+    """(private, shared) kB of this process, from /proc/self/smaps_rollup."""
+    fields = {}
+    with open("/proc/self/smaps_rollup") as fh:
+        for line in fh:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == "kB":
+                fields[parts[0].rstrip(":")] = int(parts[1])
+    return (fields.get("Private_Clean", 0) + fields.get("Private_Dirty", 0),
+            fields.get("Shared_Clean", 0) + fields.get("Shared_Dirty", 0))
+
+
+def _worker(db_path, snapshots, ready, done):
+    db.DB_PATH = db_path
+    wordbank.SNAPSHOTS = snapshots
+    before = _memory_kb()
+    t0 = time.perf_counter()
+    index = wordbank.get_index()
+    load_s = time.perf_counter() - t0
+    for _ in range(2000):  # touch the index the way quiz building does
+        for row in index.sample_rows(index.bucket("en", "noun"), 20):
+            index.texts[row]
+    after = _memory_kb()
+    ready.put((load_s, after[0] - before[0], after[1] - before[1]))
+    done.wait()  # stay alive so the pages stay mapped while the others measure
+
+
+def measure(db_path, snapshots, processes):
+    ctx = multiprocessing.get_context("spawn")
+    ready, done = ctx.Queue(), ctx.Event()
+    workers = [ctx.Process(target=_worker, args=(db_path, snapshots, ready, done)) for _ in range(processes)]
+    for w in workers:
+        w.start()
+    results = [ready.get() for _ in workers]
+    done.set()
+    for w in workers:
+        w.join()
+    return results
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--words", type=int, default=200000)
+    ap.add_argument("--processes", type=int, default=4)
+    args = ap.parse_args(argv)
+
+    db.DB_PATH = os.path.join(tempfile.mkdtemp(prefix="wordapp-wordbank-"), "app.db")
+    db.init_db()
+    fill(list(generated_rows(args.words)))
+    db.close_pools()
+    print(f"words: {args.words:,}  processes: {args.processes}")
+
+    for label, snapshots in (("in-memory", False), ("snapshot", True)):
+        if snapshots:  # written once by the process that changed the bank, as in the app
+            wordbank.SNAPSHOTS = True
+            t0 = time.perf_counter()
+            wordbank.get_index()
+            print(f"snapshot written in {(time.perf_counter() - t0) * 1000:.1f} ms")
+        results = measure(db.DB_PATH, snapshots, args.processes)
+        loads = sorted(r[0] for r in results)
+        private = sum(r[1] for r in results) / len(results)
+        shared = sum(r[2] for r in results) / len(results)
+        print(f"{label:10} index ready in {loads[0] * 1000:8.1f} ms (first) {loads[-1] * 1000:8.1f} ms (slowest); "
+              f"per process +{private / 1024:6.1f} MB private, +{shared / 1024:6.1f} MB shared")
+
+    fill(list(generated_rows(100, args.words)))
+    t0 = time.perf_counter()
+    wordbank.get_index()
+    print(f"snapshot rewrite after adding 100 words: {(time.perf_counter() - t0) * 1000:.1f} ms "
+          f"({os.path.getsize(wordbank.get_index().path) / 1e6:.1f} MB file)")
+    db.close_pools()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,243 @@
+"""Multi-user load generator: simulated learners running full quiz sessions.
+
+    python bench/loadgen.py --profile small --users 1 2 4 8 16 --duration 10
+    python bench/loadgen.py --db /tmp/wordapp-full.db --mode process --users 4 8 16 32
+
+Each simulated user signs in once (verify_password) and then loops through the
+real backend flow until the step's time is up: start_or_resume_session ->
+build_quiz_batch -> record_served_words -> create_session_items -> 20 x
+save_attempt -> session_summary -> mark_session_completed. Users run as
+threads sharing one connection pool (like one Streamlit server) or as
+processes with a pool each (like several server replicas on one file).
+
+Every user count in --users is one step of a ramp. Per step it reports
+sessions/s and attempts/s, per-stage latency percentiles, connection-pool
+waits and "database is locked" errors; at the end it names the step where
+throughput stopped growing. SQLite's own busy-wait (busy_timeout) is not
+visible from Python, so it shows up as latency in the write stages; run with
+--busy-timeout 0 to turn every contended write into a counted lock error.
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import shutil
+import sqlite3
+import sys
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+
+from backend import auth, db, logic  # noqa: E402
+import synth  # noqa: E402
+from suite import prepare_db  # noqa: E402
+
+STAGES = ("verify_password", "start_or_resume_session", "build_quiz_batch", "record_served_words",
+          "create_session_items", "save_attempt", "session_summary", "mark_session_completed")
+SATURATION_GAIN = 0.10  # a step that adds less than 10% throughput is past saturation
+ACCURACY = 0.7
+
+
+class UserStats:
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.sessions = 0
+        self.attempts = 0
+        self.locked = defaultdict(int)
+        self.errors = defaultdict(int)
+
+    def merge(self, other):
+        for stage, samples in other.latencies.items():
+            self.latencies[stage].extend(samples)
+        self.sessions += other.sessions
+        self.attempts += other.attempts
+        for stage, n in other.locked.items():
+            self.locked[stage] += n
+        for stage, n in other.errors.items():
+            self.errors[stage] += n
+
+
+def _timed(stats, stage, fn, *args):
+    t0 = time.perf_counter()
+    try:
+        return fn(*args)
+    except sqlite3.OperationalError as e:
+        if "locked" in str(e) or "busy" in str(e):
+            stats.locked[stage] += 1
+        else:
+            stats.errors[stage] += 1
+        raise
+    except Exception:
+        stats.errors[stage] += 1
+        raise
+    finally:
+        stats.latencies[stage].append((time.perf_counter() - t0) * 1000)
+
+
+def run_session(stats, user_id, rnd):
+    session_id = _timed(stats, "start_or_resume_session", logic.start_or_resume_session, user_id)
+    items = _timed(stats, "build_quiz_batch", logic.build_quiz_batch, user_id)
+    _timed(stats, "record_served_words", logic.record_served_words, user_id, [it["word_id"] for it in items])
+    _timed(stats, "create_session_items", logic.create_session_items, session_id, items)
+    for it in items:
+        correct = rnd.random() < ACCURACY
+        answer = it["answer"] if correct else rnd.choice(it["options"])
+        _timed(stats, "save_attempt", logic.save_attempt, user_id, session_id, it["word_id"], answer,
+               correct, rnd.randint(800, 15000))
+        stats.attempts += 1
+    _timed(stats, "session_summary", logic.session_summary, session_id)
+    _timed(stats, "mark_session_completed", logic.mark_session_completed, session_id)
+    stats.sessions += 1
+
+
+def simulate_user(username, deadline, seed):
+    """Sign in, then run sessions back to back until `deadline` (a time.time() value)."""
+    stats = UserStats()
+    rnd = random.Random(seed)
+    try:
+        user = _timed(stats, "verify_password", auth.verify_password, username, synth.PASSWORD)
+    except Exception:
+        return stats
+    if not user:
+        stats.errors["verify_password"] += 1
+        return stats
+    while time.time() < deadline:
+        try:
+            run_session(stats, user["id"], rnd)
+        except Exception:
+            pass  # counted by _timed; the user abandons that session and starts another
+    return stats
+
+
+def _configure(path, pool_size, busy_timeout):
+    db.DB_PATH = path
+    pragmas = dict(db.PRAGMAS)
+    if busy_timeout is not None:
+        pragmas["busy_timeout"] = busy_timeout
+    db.configure_pool(size=pool_size, pragmas=pragmas)
+    auth.configure(workers=0)  # bcrypt inline in the simulated user's own thread or process
+
+
+def _process_user(path, pool_size, busy_timeout, username, deadline, seed):
+    _configure(path, pool_size, busy_timeout)
+    stats = simulate_user(username, deadline, seed)
+    return stats, db.pool_stats()
+
+
+def _pool_totals(pool_stats):
+    waits = sum(p["waits"] for p in pool_stats)
+    wait_ms = sum(p["wait_ms"] for p in pool_stats)
+    timeouts = sum(p["timeouts"] for p in pool_stats)
+    return waits, wait_ms, timeouts
+
+
+def percentile(samples, p):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(round(p / 100 * (len(samples) - 1))))]
+
+
+def run_step(path, users, duration, mode, pool_size, busy_timeout, first_user, seed):
+    deadline = time.time() + duration
+    usernames = [f"bench{first_user + i}" for i in range(users)]
+    total = UserStats()
+    t0 = time.perf_counter()
+    if mode == "thread":
+        _configure(path, pool_size, busy_timeout)
+        with ThreadPoolExecutor(max_workers=users) as ex:
+            for stats in ex.map(simulate_user, usernames, [deadline] * users,
+                                [seed + i for i in range(users)]):
+                total.merge(stats)
+        pool = _pool_totals(db.pool_stats())
+    else:
+        ctx = multiprocessing.get_context("spawn")
+        with ctx.Pool(processes=users) as procs:
+            results = procs.starmap(_process_user, [(path, pool_size, busy_timeout, name, deadline, seed + i)
+                                                    for i, name in enumerate(usernames)])
+        pool_stats = []
+        for stats, stats_pool in results:
+            total.merge(stats)
+            pool_stats.extend(stats_pool)
+        pool = _pool_totals(pool_stats)
+    # includes the last sessions finishing after the deadline (and process start-up)
+    wall = time.perf_counter() - t0
+    return total, pool, wall
+
+
+def report_step(users, total, pool, wall):
+    sessions_s = total.sessions / wall
+    print(f"\n== {users} users: {total.sessions} sessions in {wall:.1f}s = {sessions_s:.2f} sessions/s, "
+          f"{total.attempts / wall:.1f} attempts/s ==")
+    print(f"  {'stage':<24}{'calls':>7}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}{'locked':>8}{'errors':>8}")
+    for stage in STAGES:
+        samples = total.latencies.get(stage)
+        if not samples:
+            continue
+        print(f"  {stage:<24}{len(samples):>7}{percentile(samples, 50):>10.2f}{percentile(samples, 95):>10.2f}"
+              f"{percentile(samples, 99):>10.2f}{max(samples):>10.2f}{total.locked[stage]:>8}{total.errors[stage]:>8}")
+    waits, wait_ms, timeouts = pool
+    print(f"  pool lock waits: {waits} ({wait_ms:.1f} ms total), pool timeouts: {timeouts}, "
+          f"'database is locked': {sum(total.locked.values())}")
+    return sessions_s
+
+
+def saturation_point(steps):
+    """The (users, sessions/s) step after which adding users stopped raising throughput."""
+    best = steps[0]
+    for prev, cur in zip(steps, steps[1:]):
+        if cur[1] < prev[1] * (1 + SATURATION_GAIN):
+            return best
+        best = cur
+    return None
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--profile", choices=sorted(synth.PROFILES), default="small")
+    ap.add_argument("--db", help="load this database (written to in place) instead of a generated copy")
+    ap.add_argument("--users", type=int, nargs="+", default=[1, 2, 4, 8, 16])
+    ap.add_argument("--duration", type=float, default=10.0, help="seconds per step")
+    ap.add_argument("--mode", choices=("thread", "process"), default="thread")
+    ap.add_argument("--pool-size", type=int, default=db.POOL_SIZE, help="connections per process")
+    ap.add_argument("--busy-timeout", type=int, help="override PRAGMA busy_timeout (ms)")
+    ap.add_argument("--seed", type=int, default=0)
+    args = ap.parse_args(argv)
+
+    path = prepare_db(args.profile, args.seed, args.db)
+    db.close_pools()
+    with sqlite3.connect(path) as con:
+        available = con.execute("SELECT COUNT(*) FROM users WHERE username LIKE 'bench%'").fetchone()[0]
+    if sum(args.users) > available:
+        raise SystemExit(f"the ramp needs {sum(args.users)} bench users, the database has {available}")
+    print(f"database: {path}  mode: {args.mode}  pool size: {args.pool_size}  cpus: {os.cpu_count()}")
+
+    steps = []
+    first_user = 0
+    try:
+        for users in args.users:
+            # fresh users each step, so every step starts on an empty day
+            total, pool, wall = run_step(path, users, args.duration, args.mode, args.pool_size,
+                                         args.busy_timeout, first_user, args.seed + first_user)
+            first_user += users
+            steps.append((users, report_step(users, total, pool, wall)))
+    finally:
+        db.close_pools()
+        if not args.db:
+            shutil.rmtree(os.path.dirname(path), ignore_errors=True)
+
+    print("\n== throughput ==")
+    for users, rate in steps:
+        print(f"  {users:>4} users  {rate:8.2f} sessions/s")
+    point = saturation_point(steps)
+    if point:
+        print(f"saturates at ~{point[0]} users ({point[1]:.2f} sessions/s): "
+              f"the next step added less than {SATURATION_GAIN:.0%}")
+    else:
+        print("no saturation within this ramp; try more users")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""Startup report: cold import cost of app.py and per-rerun init overhead.
+
+    python bench/startup_profile.py [--reruns 200] [--top 12]
+
+Cold start is measured in fresh interpreters with `-X importtime`. Per-rerun
+cost compares the previous ensure_init() body (fresh connections running the
+CREATE statements and the word count on every rerun) with the cached
+bootstrap(). The database is a throwaway copy seeded from data/words.csv.
+"""
+import argparse
+import logging
+import os
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def import_profile(stmt):
+    """(total ms, [(cumulative ms, self ms, module)]) for `stmt` in a fresh interpreter."""
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", stmt], cwd=ROOT,
+                          capture_output=True, text=True, check=True)
+    modules = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cum_us, name = line[len("import time:"):].split("|")
+        modules.append((int(cum_us) / 1000, int(self_us) / 1000, name.strip()))
+    # the statement's own module is reported last, with everything it pulled in as its cumulative time
+    return modules[-1][0], modules
+
+
+def timed(fn, n):
+    samples = []
+    for _ in range(n):
+        t0 = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - t0) * 1000)
+    return statistics.median(samples), max(samples)
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--reruns", type=int, default=200)
+    ap.add_argument("--top", type=int, default=12)
+    args = ap.parse_args(argv)
+
+    print("== cold start (fresh interpreter, -X importtime) ==")
+    total, modules = import_profile("import app")
+    print(f"import app: {total:.1f} ms")
+    for label, stmt in (("streamlit", "import streamlit"), ("pandas (no longer imported by app)", "import pandas"),
+                        ("pytz", "import pytz")):
+        print(f"  {label}: {import_profile(stmt)[0]:.1f} ms")
+    print(f"top {args.top} modules by self time:")
+    for cum, self_ms, name in sorted(modules, key=lambda m: m[1], reverse=True)[:args.top]:
+        print(f"  {self_ms:8.2f} ms self {cum:9.2f} ms cum  {name}")
+
+    print(f"\n== per-rerun init ({args.reruns} reruns, median / max ms) ==")
+    logging.disable(logging.WARNING)  # streamlit complains about running without `streamlit run`
+    from backend import db
+    db.DB_PATH = os.path.join(tempfile.mkdtemp(prefix="wordapp-startup-"), "app.db")
+    import app
+    from backend.migrations import BASELINE
+
+    first = timed(app.bootstrap, 1)
+    print(f"first bootstrap() (migrate + seed): {first[0]:.2f}")
+
+    def legacy_ensure_init():
+        # what every rerun paid before: a fresh connection running the six CREATE
+        # statements, then another fresh connection for the word count
+        con = sqlite3.connect(db.DB_PATH)
+        for ddl in BASELINE:
+            con.execute(ddl)
+        con.commit()
+        con.close()
+        con = sqlite3.connect(db.DB_PATH)
+        con.execute("SELECT COUNT(*) FROM words").fetchone()
+        con.close()
+
+    legacy = timed(legacy_ensure_init, args.reruns)
+    cached = timed(app.bootstrap, args.reruns)
+    print(f"before: init_db() + count_words() per rerun: {legacy[0]:.3f} / {legacy[1]:.3f}")
+    print(f"after:  cached bootstrap() per rerun:        {cached[0]:.3f} / {cached[1]:.3f}")
+    print(f"uncached init_db() (schema version check):   {timed(db.init_db, args.reruns)[0]:.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,242 @@
+"""Timed benchmarks for backend.logic on a synthetic database, with JSON baselines.
+
+    python bench/suite.py --profile small                    # generate (cached) + run
+    python bench/suite.py --profile small --save-baseline    # write bench/baselines/small.json
+    python bench/suite.py --profile small --check            # exit 1 if slower/bigger than the baseline
+    python bench/suite.py --db /tmp/wordapp-full.db          # an existing DB (written to in place)
+
+Generated databases are cached in the temp dir and each run works on a fresh
+copy, so the writing benchmarks (save_attempt, add_word_rows) never skew the
+next run. Latency is timed without tracing, in a few rounds whose best median
+is the reported p50; peak memory is measured in a separate, shorter
+tracemalloc pass.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+from backend import db, logic, wordbank  # noqa: E402
+import synth  # noqa: E402
+
+BASELINE_DIR = os.path.join(BENCH_DIR, "baselines")
+LATENCY_THRESHOLD = 0.30   # fail when p50 grows by more than 30%...
+LATENCY_FLOOR_MS = 0.05    # ...and by more than this, so microsecond noise never fails a run
+MEMORY_THRESHOLD = 0.50
+MEMORY_FLOOR_KB = 256
+MEMORY_ITERATIONS = 10
+ROUNDS = 3  # p50 is the best round's median, which keeps a noisy neighbour out of the baseline check
+
+BENCHMARKS = []
+
+
+def benchmark(iterations):
+    def register(fn):
+        BENCHMARKS.append((fn.__name__, fn, iterations))
+        return fn
+    return register
+
+
+class Context:
+    """Random but reproducible arguments drawn from the database under test."""
+
+    def __init__(self, seed):
+        self.rnd = random.Random(seed)
+        with db.get_conn() as con:
+            self.max_user = con.execute("SELECT MAX(id) FROM users").fetchone()[0] or 1
+            self.max_word = con.execute("SELECT MAX(id) FROM words").fetchone()[0] or 1
+            self.today = con.execute("SELECT MAX(date_local) FROM sessions").fetchone()[0] \
+                or logic.today_local_str()
+            self.sessions = con.execute("SELECT id, user_id FROM sessions WHERE date_local=?",
+                                        (self.today,)).fetchall() or [(1, 1)]
+        self.new_words = 0
+
+    def user(self):
+        return self.rnd.randint(1, self.max_user)
+
+    def word(self):
+        return self.rnd.randint(1, self.max_word)
+
+    def session(self):
+        return self.rnd.choice(self.sessions)
+
+
+@benchmark(iterations=200)
+def build_quiz_batch(ctx):
+    logic.build_quiz_batch(ctx.user(), ctx.today, 20)
+
+
+@benchmark(iterations=200)
+def next_candidates(ctx):
+    logic._next_candidates(ctx.user(), 20, ctx.today)
+
+
+@benchmark(iterations=1000)
+def get_random_distractors(ctx):
+    logic.get_random_distractors(ctx.word(), 4, synth.POS[ctx.rnd.randrange(len(synth.POS))])
+
+
+@benchmark(iterations=300)
+def save_attempt(ctx):
+    session_id, user_id = ctx.session()
+    logic.save_attempt(user_id, session_id, ctx.word(), "x", ctx.rnd.random() < 0.7, 1500)
+
+
+@benchmark(iterations=300)
+def session_summary(ctx):
+    logic.session_summary(ctx.session()[0])
+
+
+@benchmark(iterations=1000)
+def get_user_stats(ctx):
+    logic.get_user_stats(ctx.user())
+
+
+@benchmark(iterations=20)
+def add_word_rows(ctx):
+    start = ctx.new_words
+    ctx.new_words += 100
+    logic.add_word_rows([[f"benchnew{i}", "a word added by the benchmark", "noun", "en"]
+                         for i in range(start, start + 100)])
+
+
+def _percentile(samples, p):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(round(p / 100 * (len(samples) - 1))))]
+
+
+def run_benchmarks(seed=0, only=None, scale=1.0, log=print):
+    ctx = Context(seed)
+    random.seed(seed)  # logic samples with the global RNG
+    wordbank.get_index()  # load the shared index outside the timings
+    results = {}
+    for name, fn, iterations in BENCHMARKS:
+        if only and name not in only:
+            continue
+        iterations = max(1, int(iterations * scale))
+        for _ in range(min(5, iterations)):
+            fn(ctx)
+        samples, medians = [], []
+        for _ in range(ROUNDS):
+            round_samples = []
+            for _ in range(iterations):
+                t0 = time.perf_counter()
+                fn(ctx)
+                round_samples.append((time.perf_counter() - t0) * 1000)
+            medians.append(statistics.median(round_samples))
+            samples.extend(round_samples)
+        tracemalloc.start()
+        base = tracemalloc.get_traced_memory()[0]
+        for _ in range(min(MEMORY_ITERATIONS, iterations)):
+            fn(ctx)
+        peak = tracemalloc.get_traced_memory()[1] - base
+        tracemalloc.stop()
+        results[name] = {
+            "iterations": iterations * ROUNDS,
+            "p50_ms": round(min(medians), 4),
+            "p95_ms": round(_percentile(samples, 95), 4),
+            "mean_ms": round(statistics.fmean(samples), 4),
+            "peak_kb": round(peak / 1024, 1),
+        }
+        r = results[name]
+        log(f"{name:<24} p50 {r['p50_ms']:9.3f} ms  p95 {r['p95_ms']:9.3f} ms  peak {r['peak_kb']:9.1f} KB")
+    return results
+
+
+def compare(results, baseline, latency_threshold=LATENCY_THRESHOLD, memory_threshold=MEMORY_THRESHOLD):
+    """Human-readable regressions of `results` against a baseline's results (empty if none)."""
+    regressions = []
+    for name, base in baseline.items():
+        cur = results.get(name)
+        if cur is None:
+            continue
+        if cur["p50_ms"] > base["p50_ms"] * (1 + latency_threshold) \
+                and cur["p50_ms"] - base["p50_ms"] > LATENCY_FLOOR_MS:
+            regressions.append(f"{name}: p50 {base['p50_ms']:.3f} -> {cur['p50_ms']:.3f} ms")
+        if cur["peak_kb"] > base["peak_kb"] * (1 + memory_threshold) \
+                and cur["peak_kb"] - base["peak_kb"] > MEMORY_FLOOR_KB:
+            regressions.append(f"{name}: peak {base['peak_kb']:.0f} -> {cur['peak_kb']:.0f} KB")
+    return regressions
+
+
+def prepare_db(profile, seed, db_path=None):
+    """Point the backend at the database to benchmark and return its path."""
+    if db_path:
+        path = db_path
+    else:
+        cached = os.path.join(tempfile.gettempdir(), f"wordapp-bench-{profile}-{seed}.db")
+        if not os.path.exists(cached):
+            synth.generate(cached + ".tmp", seed=seed, **synth.profile_args(profile))
+            os.replace(cached + ".tmp", cached)
+        path = os.path.join(tempfile.mkdtemp(prefix="wordapp-bench-"), "app.db")
+        shutil.copyfile(cached, path)
+    db.DB_PATH = path
+    db.init_db()
+    return path
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--profile", choices=sorted(synth.PROFILES), default="small")
+    ap.add_argument("--db", help="benchmark this database instead of a generated one")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--only", nargs="+", help="benchmark names to run")
+    ap.add_argument("--scale", type=float, default=1.0, help="multiply iteration counts")
+    ap.add_argument("--baseline", help="baseline JSON (default: bench/baselines/<profile>.json)")
+    ap.add_argument("--save-baseline", action="store_true")
+    ap.add_argument("--check", action="store_true", help="exit 1 on regression against the baseline")
+    ap.add_argument("--latency-threshold", type=float, default=LATENCY_THRESHOLD)
+    ap.add_argument("--memory-threshold", type=float, default=MEMORY_THRESHOLD)
+    ap.add_argument("--json", help="also write this run's results here")
+    args = ap.parse_args(argv)
+
+    path = prepare_db(args.profile, args.seed, args.db)
+    print(f"database: {path}")
+    results = run_benchmarks(args.seed, args.only, args.scale)
+    report = {
+        "meta": {
+            "profile": None if args.db else args.profile, "seed": args.seed,
+            "python": platform.python_version(), "sqlite": sqlite3.sqlite_version,
+            "machine": platform.machine(), "cpus": os.cpu_count(),
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "results": results,
+    }
+    db.close_pools()
+    if not args.db:
+        shutil.rmtree(os.path.dirname(path), ignore_errors=True)
+    if args.json:
+        with open(args.json, "w") as fh:
+            json.dump(report, fh, indent=2)
+
+    baseline_path = args.baseline or os.path.join(BASELINE_DIR, f"{args.profile}.json")
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(baseline_path), exist_ok=True)
+        with open(baseline_path, "w") as fh:
+            json.dump(report, fh, indent=2)
+            fh.write("\n")
+        print(f"baseline written: {baseline_path}")
+    elif args.check:
+        with open(baseline_path) as fh:
+            baseline = json.load(fh)["results"]
+        regressions = compare(results, baseline, args.latency_threshold, args.memory_threshold)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        if regressions:
+            sys.exit(1)
+        print(f"no regressions against {baseline_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+"""Generate a large synthetic word-app database for benchmarking.
+
+    python bench/synth.py --profile full --out /tmp/wordapp-full.db
+    python bench/synth.py --words 500000 --users 50000 --attempts 20000000 --days 365 --out big.db
+
+Apart from the calendar (the last day is today), everything is derived from
+--seed, so the same arguments give the same data.
+Every synthetic user's password is `bench-password`.
+"""
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import time
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from backend import srs  # noqa: E402
+from backend.migrations import migrate  # noqa: E402
+
+PASSWORD = "bench-password"
+# bcrypt("bench-password", rounds=4): precomputed so generating 50k users costs nothing
+PASSWORD_HASH = b"$2b$04$OZslBW22rDDryWBtnkNixec2cf5DT0UPnFLl8kt.TXoNMGnVNQMBC"
+POS = ["noun", "verb", "adjective", "adverb"]
+LANGUAGES = ["en"]
+BOX_WEIGHTS = (2, 2, 2, 3, 3, 4, 5)
+BATCH = 100000
+
+PROFILES = {
+    # quick enough for CI and for the committed baselines
+    "small": dict(words=20000, users=200, attempts=200000, days=30, active_per_day=50),
+    "medium": dict(words=100000, users=5000, attempts=2000000, days=90, active_per_day=300),
+    # the production-scale shape the suite is meant to be run against
+    "full": dict(words=500000, users=50000, attempts=20000000, days=365, active_per_day=500),
+}
+
+
+def _batched(rows, con, sql):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= BATCH:
+            con.executemany(sql, batch)
+            batch.clear()
+    if batch:
+        con.executemany(sql, batch)
+
+
+def day_strings(days, end=None):
+    end = end or date.today()
+    return [(end - timedelta(days=days - 1 - i)).isoformat() for i in range(days)]
+
+
+def generate(path, words, users, attempts, days, active_per_day, seed=0, languages=LANGUAGES, log=print):
+    """Build the database at `path` (must not exist). Returns the list of day strings used."""
+    if os.path.exists(path):
+        raise SystemExit(f"{path} already exists")
+    rnd = random.Random(seed)
+    con = sqlite3.connect(path)
+    migrate(con)
+    con.execute("PRAGMA journal_mode=OFF")
+    con.execute("PRAGMA synchronous=OFF")
+    con.execute("PRAGMA cache_size=-262144")
+    t0 = time.perf_counter()
+    dates = day_strings(days)
+
+    con.execute("BEGIN")
+    _batched(((f"w{i:07d}", f"synthetic definition number {i} of the bench word bank",
+               POS[i % len(POS)], languages[i % len(languages)], f"w{i:07d}")
+              for i in range(words)), con,
+             "INSERT INTO words(text, definition, part_of_speech, language, text_norm) VALUES(?,?,?,?,?)")
+    con.execute("INSERT INTO app_meta(key, value) VALUES('wordbank_version', 1)")
+    _batched(((f"bench{i}", PASSWORD_HASH) for i in range(users)), con,
+             "INSERT INTO users(username, password_hash) VALUES(?,?)")
+    con.execute("COMMIT")
+    log(f"words + users: {time.perf_counter() - t0:.1f}s")
+
+    # each day, `active_per_day` users did one 20-word session
+    con.execute("BEGIN")
+    session_id = 0
+    day_words, sessions, items = [], [], []
+    for day in dates:
+        for uid in rnd.sample(range(1, users + 1), min(active_per_day, users)):
+            session_id += 1
+            served = rnd.sample(range(1, words + 1), 20)
+            sessions.append((session_id, uid, day))
+            day_words.extend((uid, day, wid) for wid in served)
+            items.extend((session_id, wid, pos, rnd.random() < 0.7) for pos, wid in enumerate(served, start=1))
+        if len(items) >= BATCH:
+            _flush_sessions(con, sessions, day_words, items)
+    _flush_sessions(con, sessions, day_words, items)
+    con.execute("COMMIT")
+    log(f"sessions + user_day_words: {time.perf_counter() - t0:.1f}s")
+
+    # the attempt log, in time order; each user keeps revisiting a personal working set
+    con.execute("BEGIN")
+    per_day = max(1, attempts // days)
+
+    def attempt_rows():
+        made = 0
+        for day in dates:
+            for _ in range(min(per_day, attempts - made)):
+                uid = rnd.randint(1, users)
+                wid = (uid * 7919 + rnd.randint(0, 399)) % words + 1
+                correct = rnd.random() < 0.7
+                # boxes are drawn, not replayed: tracking 20M (user, word) pairs would need GBs
+                box = rnd.choice(BOX_WEIGHTS) if correct else 1
+                yield uid, wid, day, int(correct), rnd.randint(800, 15000), box, f"{day} 12:00:00"
+            made += per_day
+
+    _batched(attempt_rows(), con, """
+        INSERT INTO user_attempts(user_id, word_id, date_local, correct, response_time_ms, box, last_seen)
+        VALUES(?,?,?,?,?,?,?)""")
+    con.execute("COMMIT")
+    log(f"user_attempts: {time.perf_counter() - t0:.1f}s")
+
+    con.execute("BEGIN")
+    srs.rebuild_state(con.cursor())
+    con.execute("COMMIT")
+    con.execute("ANALYZE")
+    con.execute("PRAGMA journal_mode=WAL")
+    con.close()
+    log(f"done in {time.perf_counter() - t0:.1f}s: {path} ({os.path.getsize(path) / 1e6:.0f} MB)")
+    return dates
+
+
+def _flush_sessions(con, sessions, day_words, items):
+    con.executemany("INSERT INTO sessions(id, user_id, date_local, completed) VALUES(?,?,?,1)", sessions)
+    con.executemany("INSERT INTO user_day_words(user_id, date_local, word_id) VALUES(?,?,?)", day_words)
+    con.executemany("INSERT INTO session_items(session_id, word_id, position, correct, user_answer) "
+                    "VALUES(?,?,?,?,'x')", items)
+    sessions.clear()
+    day_words.clear()
+    items.clear()
+
+
+def profile_args(name, **overrides):
+    args = dict(PROFILES[name])
+    args.update({k: v for k, v in overrides.items() if v is not None})
+    return args
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--out", required=True)
+    ap.add_argument("--profile", choices=sorted(PROFILES), default="small")
+    for name in ("words", "users", "attempts", "days", "active-per-day"):
+        ap.add_argument(f"--{name}", type=int, help="override the profile")
+    ap.add_argument("--seed", type=int, default=0)
+    args = ap.parse_args(argv)
+    sizes = profile_args(args.profile, words=args.words, users=args.users, attempts=args.attempts,
+                         days=args.days, active_per_day=args.active_per_day)
+    generate(args.out, seed=args.seed, **sizes)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,23 @@
 import time
 import streamlit as st
 from backend.logic import (
-    session_summary, mark_session_completed, save_attempt
+    session_summary, mark_session_completed, submit_attempt
 )
 
 
+def _show_feedback():
+    # feedback for the previous answer is rendered on the next screen instead
+    # of holding the script thread on a sleep before advancing
+    feedback = st.session_state.pop("last_feedback", None)
+    if feedback is None:
+        return
+    correct, answer = feedback
+    if correct:
+        st.success("Correct!")
+    else:
+        st.error(f"Incorrect. Correct answer: **{answer}**")
+
+
 def quiz():
     st.subheader("Word Meanings")
     if st.session_state.current_session_id is None or not st.session_state.current_items:
@@ -16,6 +29,7 @@ def quiz():
 
     items = st.session_state.current_items
     idx = st.session_state.current_index
+    _show_feedback()
     if idx >= len(items):
         # summary
         sid = st.session_state.current_session_id
@@ -45,29 +59,18 @@ def quiz():
         st.session_state[choice_key] = None
 
     option_cols = st.columns(len(item["options"]))
-    answered_key = f"answered_{idx}"
     for i, option in enumerate(item["options"]):
-        if option_cols[i].button(option, key=f"{choice_key}_btn_{i}", disabled=st.session_state.get(answered_key, False)):
+        if option_cols[i].button(option, key=f"{choice_key}_btn_{i}"):
             st.session_state[choice_key] = option
-            # Immediately process answer
+            # Immediately process answer; the background writer commits it
             elapsed = int((time.time() - st.session_state.start_time) * 1000) if st.session_state.start_time else None
             correct = (option == item["answer"])
-            save_attempt(st.session_state.auth_user["id"],
-                         st.session_state.current_session_id,
-                         item["word_id"], option, correct, response_time_ms=elapsed)
-            if correct:
-                st.success("Correct!")
-            else:
-                st.error(f"Incorrect. Correct answer: **{item['answer']}**")
-            st.session_state[answered_key] = True
+            submit_attempt(st.session_state.auth_user["id"],
+                           st.session_state.current_session_id,
+                           item["word_id"], option, correct, response_time_ms=elapsed)
+            st.session_state.last_feedback = (correct, item["answer"])
             st.session_state.start_time = time.time()
+            st.session_state.current_index += 1
+            st.session_state.pop(choice_key, None)
             st.experimental_rerun()
             return
-
-    # If already answered, show feedback and move to next after a delay
-    if st.session_state.get(answered_key, False):
-        time.sleep(1.0)
-        st.session_state.current_index += 1
-        st.session_state.pop(choice_key, None)
-        st.session_state.pop(answered_key, None)
-        st.experimental_rerun()
\ No newline at end of file
@@ -0,0 +1,22 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from backend import analytics, db, distractors, wordbank  # noqa: E402
+
+
+@pytest.fixture
+def db_path(tmp_path, monkeypatch):
+    """Point the backend at a fresh, migrated database file under tmp_path."""
+    path = str(tmp_path / "app.db")
+    monkeypatch.setattr(db, "DB_PATH", path)
+    wordbank.invalidate()
+    db.init_db()
+    yield path
+    distractors.wait()
+    db.close_pools()
+    wordbank.invalidate()
+    analytics.invalidate()
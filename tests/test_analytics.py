@@ -0,0 +1,72 @@
+from backend import analytics, auth, db, logic
+
+
+def _play(user_id, answers, response_ms=1000):
+    """Serve len(answers) words to the user today and answer them with the given correctness."""
+    session_id = logic.start_or_resume_session(user_id)
+    items = logic.build_quiz_batch(user_id, size=len(answers))
+    logic.record_served_words(user_id, [it["word_id"] for it in items])
+    logic.create_session_items(session_id, items)
+    for item, correct in zip(items, answers):
+        logic.save_attempt(user_id, session_id, item["word_id"], item["answer"], correct, response_ms)
+    return items
+
+
+def test_history_is_kept_on_write_and_cache_follows_it(db_path):
+    logic.add_word_rows([[f"word{i}", f"meaning {i}", "noun", "en"] for i in range(10)])
+    user = auth.create_user("ana", "pw")
+    _play(user, [True, True, False, True])
+    day = logic.get_user_history(user, days=7)[-1]
+    assert day["date"] == logic.today_local_str()
+    assert (day["sessions"], day["words_served"], day["attempts"], day["correct"]) == (1, 4, 4, 3)
+    assert day["accuracy"] == 75.0 and day["avg_response_ms"] == 1000
+    assert len(logic.get_user_history(user, days=7)) == 7
+    # a cached read is dropped as soon as the user's next answer is committed
+    _play(user, [False, False], response_ms=4000)
+    day = logic.get_user_history(user, days=7)[-1]
+    assert (day["attempts"], day["correct"], day["avg_response_ms"]) == (6, 3, 2000)
+    with db.get_conn() as con:
+        assert con.execute("SELECT attempts FROM user_daily_summary").fetchall() == [(6,)]
+
+
+def test_leaderboard_and_rank(db_path):
+    logic.add_word_rows([[f"word{i}", f"meaning {i}", "noun", "en"] for i in range(10)])
+    ana, bo = auth.create_user("ana", "pw"), auth.create_user("bo", "pw")
+    _play(ana, [True, False])
+    _play(bo, [True, True, True])
+    top, rank = logic.get_leaderboard(user_id=ana)
+    assert [(r["rank"], r["username"], r["correct"]) for r in top] == [(1, "bo", 3), (2, "ana", 1)]
+    assert rank == 2
+    with db.get_conn() as con:
+        plan = " ".join(r[-1] for r in con.execute("EXPLAIN QUERY PLAN " + analytics._LEADERBOARD, (10,)))
+    assert "idx_user_stats_leaderboard" in plan and "TEMP B-TREE" not in plan
+
+
+def test_tied_users_rank_by_user_id(db_path):
+    logic.add_word_rows([[f"word{i}", f"meaning {i}", "noun", "en"] for i in range(10)])
+    users = [auth.create_user(name, "pw") for name in ("cy", "ana", "bo")]
+    for uid in users:
+        _play(uid, [True, False])
+    top, _ = logic.get_leaderboard()
+    assert [r["user_id"] for r in top] == users
+    assert [logic.get_leaderboard(user_id=uid)[1] for uid in users] == [1, 2, 3]
+
+
+def test_cache_drops_expired_entries_and_keeps_its_size(monkeypatch):
+    cache = analytics._Cache(size=3)
+    monkeypatch.setattr(analytics, "TTL", 0)  # every entry is expired as soon as it is written
+    for day in range(3):
+        cache.get(("history", 1, day), lambda: day)
+    assert len(cache) == 3
+    assert cache.get(("history", 1, 0), lambda: "reloaded") == "reloaded"
+    cache.get(("history", 1, 3), lambda: 3)  # the cache is full: every expired entry goes
+    assert len(cache) == 1
+
+    monkeypatch.setattr(analytics, "TTL", 60)
+    for day in range(3):
+        cache.get(("history", 2, day), lambda: day)
+    cache.get(("history", 2, 0), lambda: "unused")  # a hit: now the most recently used
+    cache.get(("history", 2, 3), lambda: 3)
+    assert len(cache) == 3
+    assert cache.get(("history", 2, 1), lambda: "evicted") == "evicted"
+    assert cache.get(("history", 2, 0), lambda: "unused") == 0
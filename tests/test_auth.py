@@ -0,0 +1,99 @@
+import os
+import threading
+
+import pytest
+
+from backend import auth
+
+
+@pytest.fixture
+def secret_file(tmp_path, monkeypatch):
+    path = str(tmp_path / "data" / ".session_secret")
+    monkeypatch.setattr(auth, "SECRET_PATH", path)
+    monkeypatch.setattr(auth, "_secret", None)
+    monkeypatch.delenv("WORDAPP_SESSION_SECRET", raising=False)
+    return path
+
+
+@pytest.fixture
+def user(db_path, secret_file, monkeypatch):
+    monkeypatch.setattr(auth, "BCRYPT_ROUNDS", 4)
+    return auth.get_user(auth.create_user("ana", "pw"))
+
+
+def test_token_round_trip(user):
+    assert auth.verify_session_token(auth.issue_session_token(user))["id"] == user["id"]
+
+
+@pytest.mark.parametrize("tamper", [
+    lambda uid, exp, sig: f"{uid + 1}.{exp}.{sig}",  # someone else's id
+    lambda uid, exp, sig: f"{uid}.{int(exp) + 3600}.{sig}",  # extended expiry
+    lambda uid, exp, sig: f"{uid}.{exp}.{'0' * len(sig)}",
+    lambda uid, exp, sig: f"{uid}.{exp}",
+    lambda uid, exp, sig: None,
+])
+def test_forged_tokens_are_rejected(user, tamper):
+    auth.create_user("bo", "pw")
+    uid, exp, sig = auth.issue_session_token(user).split(".")
+    assert auth.verify_session_token(tamper(int(uid), exp, sig)) is None
+
+
+def test_token_is_bound_to_the_client(user):
+    token = auth.issue_session_token(user, client="Firefox/128.0")
+    assert auth.verify_session_token(token, client="Firefox/128.0")["id"] == user["id"]
+    assert auth.verify_session_token(token, client="curl/8.5") is None
+    assert auth.verify_session_token(token) is None
+
+
+def test_expired_token_is_rejected(user):
+    assert auth.verify_session_token(auth.issue_session_token(user, ttl=-1)) is None
+
+
+def test_sign_out_revokes_issued_tokens(user):
+    old = auth.issue_session_token(user)
+    auth.revoke_session_tokens(user["id"])
+    assert auth.verify_session_token(old) is None
+    fresh = auth.issue_session_token(auth.get_user(user["id"]))
+    assert auth.verify_session_token(fresh)["id"] == user["id"]
+
+
+def test_secret_is_created_once_and_shared(secret_file):
+    seen = []
+
+    def load():
+        auth._secret = None
+        seen.append(auth._session_secret())
+
+    threads = [threading.Thread(target=load) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    with open(secret_file, "rb") as fh:
+        assert set(seen) == {fh.read()}
+    assert len(seen[0]) >= auth.MIN_SECRET_BYTES
+    assert os.stat(secret_file).st_mode & 0o777 == 0o600
+    assert os.listdir(os.path.dirname(secret_file)) == [".session_secret"]
+
+
+def test_short_secrets_are_rejected_or_replaced(secret_file, monkeypatch):
+    monkeypatch.setenv("WORDAPP_SESSION_SECRET", "too-short")
+    with pytest.raises(ValueError):
+        auth._session_secret()
+    monkeypatch.delenv("WORDAPP_SESSION_SECRET")
+    os.makedirs(os.path.dirname(secret_file))
+    with open(secret_file, "wb") as fh:
+        fh.write(b"abc")  # left by an interrupted write
+    assert len(auth._session_secret()) >= auth.MIN_SECRET_BYTES
+
+
+def test_bcrypt_runs_in_a_spawned_pool(db_path, monkeypatch):
+    monkeypatch.setattr(auth, "BCRYPT_ROUNDS", 4)
+    auth.configure(workers=1)
+    try:
+        auth.create_user("ana", "pw")
+        assert auth.verify_password("ana", "pw")["username"] == "ana"
+        assert auth.verify_password("ana", "nope") is None
+        assert auth._pool._mp_context.get_start_method() == "spawn"
+    finally:
+        auth.configure(workers=auth.HASH_WORKERS)  # shuts the pool down
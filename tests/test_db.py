@@ -0,0 +1,82 @@
+import sqlite3
+import threading
+
+import pytest
+
+from backend import db
+
+
+def _pool(tmp_path, **options):
+    return db.ConnectionPool(str(tmp_path / "pool.db"), **options)
+
+
+def test_release_rolls_back_an_open_transaction(tmp_path):
+    pool = _pool(tmp_path, size=1)
+    con = pool.acquire()
+    con.execute("CREATE TABLE t(x)")
+    con.execute("BEGIN IMMEDIATE")
+    con.execute("INSERT INTO t VALUES(1)")
+    pool.release(con)  # an interrupted rerun: never committed
+    again = pool.acquire()
+    assert again is con and not again.in_transaction
+    assert again.execute("SELECT COUNT(*) FROM t").fetchone()[0] == 0
+    other = sqlite3.connect(pool.path, timeout=0)
+    other.execute("BEGIN IMMEDIATE")  # the write lock was released with the rollback
+    other.rollback()
+    other.close()
+    pool.release(again)
+    pool.close()
+
+
+def test_exhausted_pool_times_out(tmp_path):
+    pool = _pool(tmp_path, size=1, timeout=0.05)
+    con = pool.acquire()
+    with pytest.raises(sqlite3.OperationalError, match="exhausted"):
+        pool.acquire()
+    stats = pool.stats()
+    assert (stats["timeouts"], stats["waits"], stats["in_use"]) == (1, 1, 1)
+    pool.release(con)
+    assert pool.acquire() is con
+    pool.release(con)
+    pool.close()
+
+
+def test_waiter_gets_the_released_connection(tmp_path):
+    pool = _pool(tmp_path, size=1, timeout=5)
+    con = pool.acquire()
+    got = []
+    waiter = threading.Thread(target=lambda: got.append(pool.acquire()))
+    waiter.start()
+    threading.Timer(0.05, pool.release, (con,)).start()
+    waiter.join(5)
+    assert got == [con] and pool.stats()["waits"] == 1
+    pool.release(con)
+    pool.close()
+
+
+def test_broken_connection_is_discarded_and_replaced(tmp_path):
+    pool = _pool(tmp_path, size=1)
+    con = pool.acquire()
+    con.close()  # in_transaction now raises: it must not go back to the idle list
+    pool.release(con)
+    assert pool.stats()["open"] == 0
+    fresh = pool.acquire()
+    assert fresh is not con and fresh.execute("SELECT 1").fetchone() == (1,)
+    assert (pool.stats()["misses"], pool.stats()["open"]) == (2, 1)
+    pool.release(fresh)
+    pool.close()
+
+
+def test_pool_stats_account_for_every_connection(db_path, monkeypatch):
+    monkeypatch.setattr(db, "_pool_options", {})
+    db.configure_pool(size=3)
+    with db.get_conn() as a, db.get_conn() as b:
+        assert a is not b
+        stats, = db.pool_stats()
+        assert stats["path"] == db_path
+        assert (stats["size"], stats["open"], stats["idle"], stats["in_use"]) == (3, 2, 0, 2)
+    with db.get_conn():
+        pass
+    stats, = db.pool_stats()
+    assert (stats["open"], stats["idle"], stats["in_use"]) == (2, 2, 0)
+    assert (stats["misses"], stats["hits"], stats["waits"], stats["timeouts"]) == (2, 1, 0, 0)
@@ -0,0 +1,63 @@
+from backend import db, distractors, logic, wordbank
+
+WORDS = [
+    ["abate", "to become less intense or widespread", "verb", "en"],
+    ["alleviate", "to make suffering less severe", "verb", "en"],
+    ["abdicate", "to give up a position of power", "verb", "en"],
+    ["abated", "made less intense", "verb", "en"],
+    ["ubiquitous", "present everywhere at once", "adjective", "en"],
+    ["omnipresent", "present everywhere", "adjective", "en"],
+    ["zealous", "full of energetic enthusiasm", "adjective", "en"],
+]
+
+
+def _ids(texts):
+    index = wordbank.get_index()
+    rows = {text: row for row, text in enumerate(index.texts)}
+    return [index.ids[rows[t]] for t in texts]
+
+
+def test_build_stores_same_pos_neighbours_without_inflections(db_path):
+    logic.add_word_rows(WORDS)
+    report = distractors.build()
+    assert report["words"] == len(WORDS)
+    abate, abated, ubiquitous = _ids(["abate", "abated", "ubiquitous"])
+    with db.get_conn() as con:
+        lists = distractors.neighbors(con, [abate, ubiquitous])
+    assert abated not in lists[abate]
+    index = wordbank.get_index()
+    assert {index.text_of(w) for w in lists[abate]} == {"alleviate", "abdicate"}
+    assert index.text_of(lists[ubiquitous][0]) == "omnipresent"
+    assert set(logic.get_random_distractors(abate, k=2)) == {"alleviate", "abdicate"}
+
+
+def test_added_words_get_lists_and_join_existing_ones(db_path):
+    logic.add_word_rows(WORDS)
+    distractors.build()
+    logic.add_word_rows([["mitigate", "to make less severe or intense", "verb", "en"]])
+    distractors.wait()
+    abate, mitigate = _ids(["abate", "mitigate"])
+    with db.get_conn() as con:
+        lists = distractors.neighbors(con, [abate, mitigate])
+    assert abate in lists[mitigate]
+    assert mitigate in lists[abate]
+
+
+def test_update_vectorizes_only_new_words_and_rewrites_only_lists_they_enter(db_path, monkeypatch):
+    logic.add_word_rows(WORDS)
+    distractors.wait()
+    distractors.build()
+    vectorized, rewritten = [], []
+    vectorize, write_lists = distractors.vectorize, distractors._write_lists
+    monkeypatch.setattr(distractors, "vectorize",
+                        lambda rows, *args: vectorized.append(len(rows)) or vectorize(rows, *args))
+    monkeypatch.setattr(distractors, "_write_lists",
+                        lambda con, lists, *args: rewritten.append(set(lists)) or write_lists(con, lists, *args))
+    logic.add_word_rows([["mitigate", "to make less severe or intense", "verb", "en"]])
+    distractors.wait()
+    assert vectorized == [1]
+    mitigate, = _ids(["mitigate"])
+    with db.get_conn() as con:
+        lists = distractors.neighbors(con, _ids([w[0] for w in WORDS]))
+    takers = {wid for wid, found in lists.items() if mitigate in found}
+    assert takers and rewritten == [{mitigate} | takers]
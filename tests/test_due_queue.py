@@ -0,0 +1,51 @@
+from backend import db, logic, srs
+
+DAY = "2024-05-01"
+
+
+def _setup(words=60, due=15, not_due=10):
+    logic.add_word_rows([[f"word{i}", f"meaning {i}", "noun", "en"] for i in range(words)])
+    with db.get_conn() as con:
+        con.executemany("""
+            INSERT INTO user_word_state(user_id, word_id, box, streak, max_box, last_seen, due_at)
+            VALUES(1, ?, 2, 1, 2, datetime('now', '-3 days'), datetime('now', ?))
+        """, [(wid, f"-{wid} hours") for wid in range(1, due + 1)]
+             + [(wid, "+5 days") for wid in range(due + 1, due + not_due + 1)])
+        con.commit()
+
+
+def test_batch_mixes_due_reviews_with_new_words(db_path, monkeypatch):
+    _setup()
+    monkeypatch.setattr(logic, "REVIEW_RATIO", 0.25)
+    logic.record_served_words(1, [15, 14], DAY)  # the two most overdue were already served today
+    ids = {it["word_id"] for it in logic.build_quiz_batch(1, DAY, size=20)}
+    assert len(ids) == 20
+    assert ids & set(range(1, 26)) == set(range(9, 14))  # 5 reviews, most overdue first
+    assert not ids & {14, 15}
+
+
+def test_due_reviews_fill_in_when_new_words_run_out(db_path):
+    _setup(words=30, due=15, not_due=10)
+    ids = {it["word_id"] for it in logic.build_quiz_batch(1, DAY, size=20)}
+    # 5 new words exist, so all 15 due reviews are used even past the 50% ratio
+    assert ids == set(range(1, 16)) | set(range(26, 31))
+
+
+def test_due_words_skips_and_limits(db_path):
+    _setup()
+    with db.get_conn() as con:
+        assert srs.due_words(con.cursor(), 1, "en", DAY, 3) == [15, 14, 13]
+        assert srs.due_words(con.cursor(), 1, "en", DAY, 3, skip={14}) == [15, 13, 12]
+        assert srs.due_words(con.cursor(), 2, "en", DAY, 3) == []
+
+
+def test_batch_state_matches_the_separate_reads(db_path):
+    _setup()
+    logic.record_served_words(1, [15, 40], DAY)
+    with db.get_conn() as con:
+        cur = con.cursor()
+        due, served, known = srs.batch_state(cur, 1, "en", DAY, 5, [3, 20, 30, 50], skip={13})
+        assert due == srs.due_words(cur, 1, "en", DAY, 5, skip={13}) == [14, 12, 11, 10, 9]
+        assert served == logic.words_already_served_today(1, DAY, con=con) == {15, 40}
+        assert known == srs.known_words(cur, 1, [3, 20, 30, 50]) == {3, 20}
+        assert srs.batch_state(cur, 2, "en", DAY, 5, []) == ([], set(), set())
@@ -0,0 +1,100 @@
+import io
+
+import pytest
+
+from backend import db, importer, wordbank
+
+HEADER = "text,definition,part_of_speech,language\n"
+
+
+def _csv(*lines):
+    return io.StringIO(HEADER + "".join(line + "\n" for line in lines))
+
+
+def _meta(key):
+    with db.get_conn() as con:
+        row = con.execute("SELECT value FROM app_meta WHERE key=?", (key,)).fetchone()
+    return row and row[0]
+
+
+def _words():
+    with db.get_conn() as con:
+        return con.execute("SELECT text, definition, part_of_speech, language FROM words ORDER BY id").fetchall()
+
+
+def test_case_and_whitespace_variants_are_one_word(db_path):
+    report = importer.import_csv(_csv("Abate,to lessen,verb,en", "  abate ,to lessen,verb,en",
+                                      "ABATE,to lessen,verb,en", "abate,to lessen,verb,fr"))
+    assert (report["inserted"], report["updated"]) == (2, 0)
+    assert _words() == [("Abate", "to lessen", "verb", "en"), ("abate", "to lessen", "verb", "fr")]
+
+
+def test_repeats_within_a_chunk_are_one_insert_with_the_last_definition(db_path):
+    importer.import_csv(_csv("abate,to lessen,verb,en"))
+    version = _meta("wordbank_version")
+    report = importer.import_csv(_csv("Zeal,eagerness,noun,en", "zeal,great energy,noun,en", "ZEAL,fervour,noun,en"))
+    assert (report["inserted"], report["updated"]) == (1, 0)
+    assert _words()[-1] == ("Zeal", "fervour", "noun", "en")
+    assert _meta("wordbank_version") == version + 1 and not _meta("wordbank_rewritten")
+
+
+def test_reimport_counts_updates_not_inserts(db_path):
+    rows = [f"word{i},meaning {i},noun,en" for i in range(5)]
+    assert importer.import_csv(_csv(*rows))["inserted"] == 5
+    again = importer.import_csv(_csv(*rows))
+    assert (again["inserted"], again["updated"]) == (0, 0)
+    changed = importer.import_csv(_csv("WORD1,a new meaning,noun,en", "word2,meaning 2,verb,en", "word9,meaning 9,,"))
+    assert (changed["inserted"], changed["updated"]) == (1, 2)
+    assert _words()[1:3] == [("word1", "a new meaning", "noun", "en"), ("word2", "meaning 2", "verb", "en")]
+    assert _words()[-1] == ("word9", "meaning 9", "", importer.DEFAULT_LANGUAGE)
+
+
+def test_blank_and_malformed_rows_are_skipped(db_path):
+    report = importer.import_csv(_csv("good,fine,adjective,en", ",no text,noun,en", "no definition,,noun,en",
+                                      "   ,   ,,", "", "short"))
+    assert (report["rows_read"], report["inserted"], report["skipped"]) == (5, 1, 4)
+    with pytest.raises(ValueError, match="columns"):
+        importer.import_csv(io.StringIO("word,meaning\nabate,to lessen\n"))
+
+
+def test_each_chunk_commits_so_a_failure_keeps_earlier_chunks(db_path, monkeypatch):
+    upsert_rows, calls = importer.upsert_rows, []
+
+    def fail_on_third_chunk(cur, params):
+        calls.append(len(params))
+        if len(calls) == 3:
+            raise RuntimeError("disk went away")
+        return upsert_rows(cur, params)
+
+    monkeypatch.setattr(importer, "upsert_rows", fail_on_third_chunk)
+    version = _meta("wordbank_version") or 0
+    with pytest.raises(RuntimeError):
+        importer.import_csv(_csv(*(f"word{i},meaning {i},noun,en" for i in range(10))), chunk_rows=3)
+    assert calls == [3, 3, 3] and len(_words()) == 6
+    # the committed chunks are still published: one version bump, and every process sees them
+    assert _meta("wordbank_version") == version + 1
+    assert len(wordbank.get_index()) == 6
+
+
+def test_one_version_bump_per_import_and_rewrites_flagged(db_path):
+    lines = [f"word{i},meaning {i},noun,en" for i in range(7)]
+    report = importer.import_csv(_csv(*lines), chunk_rows=2)
+    assert report["chunks"] == 4
+    version = _meta("wordbank_version")
+    assert len(wordbank.get_index()) == 7 and _meta("wordbank_rewritten") is None
+
+    assert importer.import_csv(_csv(*lines))["updated"] == 0
+    assert _meta("wordbank_version") == version  # nothing changed, nothing to publish
+
+    importer.import_csv(_csv("word3,changed,noun,en"))
+    assert _meta("wordbank_version") == _meta("wordbank_rewritten") == version + 1
+
+
+def test_reads_paths_and_binary_uploads(db_path, tmp_path):
+    path = tmp_path / "words.csv"
+    path.write_text(HEADER + "path,from a file,noun,en\n", encoding="utf-8")
+    upload = io.BytesIO(("\ufeff" + HEADER + "upload,from bytes,noun,en\n").encode("utf-8"))
+    assert importer.import_csv(str(path))["inserted"] == 1
+    assert importer.import_csv(upload)["inserted"] == 1
+    assert not upload.closed
+    assert [w[0] for w in _words()] == ["path", "upload"]
@@ -0,0 +1,39 @@
+from backend import auth, db, logic, srs, wordbank
+
+WORDS = ([[f"word{i}", f"meaning {i}", "noun", "en"] for i in range(30)]
+         + [[f"mot{i}", f"sens {i}", "nom", "fr"] for i in range(30)])
+
+
+def test_batches_and_sessions_stay_in_the_users_language(db_path):
+    logic.add_word_rows(WORDS)
+    user = auth.create_user("ana", "pw")
+    assert logic.available_languages() == {"en": 30, "fr": 30}
+    en_session = logic.start_or_resume_session(user)
+    logic.set_user_language(user, "fr")
+    assert logic.user_language(user) == "fr"
+    fr_session = logic.start_or_resume_session(user)
+    assert fr_session != en_session
+    assert logic.start_or_resume_session(user, language="en") == en_session
+
+    items = logic.build_quiz_batch(user, size=20)
+    index = wordbank.get_index()
+    assert {index.language_of(oid) for it in items for oid in it["option_ids"]} == {"fr"}
+    assert all(it["answer"].startswith("mot") for it in logic.build_quiz_batch(user, size=5, language="fr"))
+    assert all(it["answer"].startswith("word") for it in logic.build_quiz_batch(user, size=5, language="en"))
+
+
+def test_review_queue_is_partitioned_by_language(db_path):
+    logic.add_word_rows(WORDS)
+    user = auth.create_user("ana", "pw")
+    logic.set_user_language(user, "fr")
+    session_id = logic.start_or_resume_session(user)
+    items = logic.build_quiz_batch(user, size=3)
+    logic.create_session_items(session_id, items)
+    for it in items:
+        logic.save_attempt(user, session_id, it["word_id"], "x", False)
+    with db.get_conn() as con:
+        con.execute("UPDATE user_word_state SET due_at=datetime('now', '-1 hour')")
+        con.commit()
+        tomorrow = "2099-01-01"
+        assert sorted(srs.due_words(con.cursor(), user, "fr", tomorrow, 10)) == sorted(it["word_id"] for it in items)
+        assert srs.due_words(con.cursor(), user, "en", tomorrow, 10) == []
@@ -0,0 +1,99 @@
+import pytest
+
+from backend import db, logic, maintenance, srs
+
+TODAY = "2026-03-31"
+
+
+def _history():
+    """Two sessions of 3 answered words each for user 1, on an old day and on TODAY (raw rows only)."""
+    logic.add_word_rows([[f"word{i}", f"meaning {i}", "noun", "en"] for i in range(6)])
+    with db.get_conn() as con:
+        for day, words in (("2026-01-01", (1, 2, 3)), (TODAY, (4, 5, 6))):
+            session_id = con.execute("INSERT INTO sessions(user_id, date_local) VALUES(1, ?)", (day,)).lastrowid
+            for position, wid in enumerate(words):
+                con.execute("INSERT INTO session_items(session_id, word_id, position) VALUES(?, ?, ?)",
+                            (session_id, wid, position))
+                con.execute("INSERT INTO user_day_words(user_id, date_local, word_id) VALUES(1, ?, ?)", (day, wid))
+                con.execute("""
+                    INSERT INTO user_attempts(user_id, word_id, date_local, correct, response_time_ms)
+                    VALUES(1, ?, ?, ?, 1000)
+                """, (wid, day, wid % 2))
+        con.commit()
+
+
+def _count(con, table):
+    return con.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+
+
+def test_prunes_rows_past_retention_in_batches(db_path):
+    _history()
+    report = maintenance.run(retain_days=30, retain_day_words=1, batch=2, pause=0, today=TODAY)
+    assert report["deleted"] == {"user_day_words": 3, "sessions": 1, "session_items": 3, "user_attempts": 3}
+    with db.get_conn() as con:
+        for table in ("sessions", "user_day_words", "session_items", "user_attempts"):
+            assert _count(con, table) == (1 if table == "sessions" else 3)
+    again = maintenance.run(retain_days=30, pause=0, today=TODAY)
+    assert not again["deleted"]
+
+
+def test_archive_keeps_pruned_rows(db_path, tmp_path):
+    _history()
+    archive = str(tmp_path / "archive.db")
+    report = maintenance.run(retain_days=30, archive=archive, pause=0, today=TODAY)
+    assert report["archived"]["user_attempts"] == 3
+    with db.get_conn() as con:
+        con.execute("ATTACH DATABASE ? AS a", (archive,))
+        assert _count(con, "a.user_attempts") == 3 and _count(con, "a.session_items") == 3
+        con.execute("DETACH DATABASE a")
+
+
+def test_rows_written_with_a_past_date_are_pruned_wherever_their_ids_fall(db_path):
+    _history()
+    with db.get_conn() as con:  # e.g. an offline client syncing late: a new id with an old date
+        con.execute("INSERT INTO user_attempts(user_id, word_id, date_local, correct) VALUES(1, 1, '2025-12-01', 1)")
+        con.commit()
+        plan = " ".join(r[-1] for r in con.execute(
+            "EXPLAIN QUERY PLAN SELECT id FROM user_attempts WHERE date_local<? LIMIT ?", (TODAY, 10)))
+    assert "idx_user_attempts_date" in plan
+    report = maintenance.run(retain_days=30, batch=2, pause=0, today=TODAY)
+    assert report["deleted"]["user_attempts"] == 4
+
+
+def test_archive_gains_columns_added_to_the_live_tables(db_path, tmp_path):
+    _history()
+    archive = str(tmp_path / "archive.db")
+    maintenance.run(retain_days=120, archive=archive, pause=0, today=TODAY)  # nothing old enough yet
+    with db.get_conn() as con:  # a later migration adds a column
+        con.execute("ALTER TABLE user_attempts ADD COLUMN device TEXT")
+        con.execute("UPDATE user_attempts SET device='phone'")
+        con.commit()
+    report = maintenance.run(retain_days=30, archive=archive, pause=0, today=TODAY)
+    assert report["archived"]["user_attempts"] == 3
+    with db.get_conn() as con:
+        con.execute("ATTACH DATABASE ? AS a", (archive,))
+        assert con.execute("SELECT DISTINCT device FROM a.user_attempts").fetchall() == [("phone",)]
+        con.execute("DETACH DATABASE a")
+
+
+def test_rebuild_after_prune_keeps_state_and_stats(db_path):
+    _history()
+    with db.get_conn() as con:
+        srs.rebuild_state(con.cursor())  # complete log: rebuilding is allowed
+        con.commit()
+        before = (con.execute("SELECT * FROM user_word_state ORDER BY word_id").fetchall(),
+                  con.execute("SELECT * FROM user_stats").fetchall())
+        assert srs.pruned_before(con.cursor()) is None
+
+    maintenance.run(retain_days=30, pause=0, today=TODAY)
+    with db.get_conn() as con:
+        assert srs.pruned_before(con.cursor()) == "2026-03-01"
+        with pytest.raises(RuntimeError, match="pruned"):
+            srs.rebuild_state(con.cursor())
+        con.rollback()
+        after = (con.execute("SELECT * FROM user_word_state ORDER BY word_id").fetchall(),
+                 con.execute("SELECT * FROM user_stats").fetchall())
+        assert after == before and before[1][0][1] == 6
+        srs.rebuild_state(con.cursor(), force=True)
+        assert con.execute("SELECT attempts FROM user_stats").fetchone()[0] == 3
+        con.rollback()
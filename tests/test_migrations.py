@@ -0,0 +1,96 @@
+import sqlite3
+
+from backend import analytics, db, distractors, logic, srs
+from backend.migrations import BASELINE, LATEST_VERSION, current_version
+
+# (name, sql, params) for every query on the per-answer / per-page-view path, as the backend runs it
+# (the leaderboard walks its index in order on purpose; test_analytics checks that plan)
+DAY = "2024-01-01"
+HOT_QUERIES = [
+    ("open session lookup", logic._OPEN_SESSION, (1, DAY, "en")),
+    ("session item answer", logic._ANSWER_ITEM, ("x", 1, 1, 1)),
+    ("Leitner state", srs._STATE, (1, 1)),
+    ("served today", logic._SERVED_TODAY, (1, DAY)),
+    ("user counters", logic._USER_STATS, (1,)),
+    ("session summary", logic._SESSION_SUMMARY, (1,)),
+    ("session resume", logic._SESSION_ITEMS, (1,)),
+    ("due reviews", srs._DUE_WORDS, (1, "en", DAY, 20)),
+    ("batch state", srs._BATCH_STATE + srs._KNOWN_CANDIDATES.format(candidates="?,?"),
+     (1, "en", DAY, 20, 1, DAY, 1, 1, 2)),
+    ("distractor lists", distractors._NEIGHBORS.format(ids="?,?"), (1, 2)),
+    ("history", analytics._HISTORY, (1, "2023-12-01", DAY)),
+    ("rank", analytics._RANK, (3, 3, 10, 3, 10, 1)),
+]
+
+
+def _table_scans(con, sql, params):
+    plan = con.execute("EXPLAIN QUERY PLAN " + sql, params).fetchall()
+    scans = []
+    for row in plan:
+        detail = row[-1]
+        if not detail.startswith("SCAN "):
+            continue
+        target = detail.split()[1]
+        # scanning a materialized subquery or a constant row is fine
+        if target.startswith("(") or target == "CONSTANT":
+            continue
+        scans.append(detail)
+    return scans
+
+
+def test_hot_queries_use_indexes(db_path):
+    with db.get_conn() as con:
+        for name, sql, params in HOT_QUERIES:
+            assert _table_scans(con, sql, params) == [], name
+
+
+def test_migrate_upgrades_unversioned_database(tmp_path, monkeypatch):
+    path = str(tmp_path / "legacy.db")
+    with sqlite3.connect(path) as con:
+        for ddl in BASELINE:
+            con.execute(ddl)
+        con.execute("INSERT INTO words(text, definition) VALUES('abate', 'to lessen')")
+        con.executemany("INSERT INTO user_attempts(user_id, word_id, date_local, correct, box) VALUES(7,1,?,?,?)",
+                        [("2024-01-01", 1, 2), ("2024-01-02", 1, 3), ("2024-01-03", 1, 4)])
+    monkeypatch.setattr(db, "DB_PATH", path)
+    try:
+        db.init_db()
+        db.init_db()  # idempotent
+        with db.get_conn() as con:
+            assert current_version(con) == LATEST_VERSION
+            indexes = {r[0] for r in con.execute("SELECT name FROM sqlite_master WHERE type='index'")}
+            assert "idx_user_attempts_user_word" in indexes
+            assert con.execute("SELECT COUNT(*) FROM words").fetchone()[0] == 1
+            # history is backfilled into the materialized state
+            assert con.execute("SELECT attempts, correct, mastered FROM user_stats WHERE user_id=7").fetchone() == (3, 3, 1)
+            assert con.execute("SELECT box, streak FROM user_word_state WHERE user_id=7").fetchone() == (4, 3)
+            assert con.execute("SELECT date_local, attempts, mastered FROM user_daily_summary WHERE user_id=7 "
+                               "ORDER BY date_local").fetchall() == [
+                ("2024-01-01", 1, 0), ("2024-01-02", 1, 0), ("2024-01-03", 1, 1)]
+    finally:
+        db.close_pools()
+
+
+def test_upgrade_steps_do_not_run_application_code(tmp_path, monkeypatch):
+    from backend import importer
+
+    def changed(*args, **kwargs):
+        raise AssertionError("an old migration called into the application")
+
+    monkeypatch.setattr(srs, "rebuild_state", changed)
+    monkeypatch.setattr(importer, "normalize_text", changed)
+    monkeypatch.setattr(importer, "DEFAULT_LANGUAGE", "xx")
+    path = str(tmp_path / "legacy.db")
+    with sqlite3.connect(path) as con:
+        for ddl in BASELINE:
+            con.execute(ddl)
+        con.execute("INSERT INTO words(text, definition, language) VALUES('  Big  Cat ', 'a lion', NULL)")
+        con.execute("INSERT INTO user_attempts(user_id, word_id, date_local, correct, box) VALUES(7,1,'2024-01-01',1,2)")
+    monkeypatch.setattr(db, "DB_PATH", path)
+    try:
+        db.init_db()
+        with db.get_conn() as con:
+            assert con.execute("SELECT language, text_norm FROM words").fetchall() == [("en", "big cat")]
+            assert con.execute("SELECT box, streak, language FROM user_word_state").fetchall() == [(2, 1, "en")]
+    finally:
+        db.close_pools()
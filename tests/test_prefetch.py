@@ -0,0 +1,85 @@
+import threading
+import time
+
+from backend import logic, prefetch
+
+DAY = "2024-05-01"
+
+
+def _items(*word_ids):
+    return [{"word_id": wid} for wid in word_ids]
+
+
+def _wait_for(predicate, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def test_reserved_words_are_skipped_by_a_concurrent_build(db_path, monkeypatch):
+    logic.add_word_rows([[f"word{i}", f"meaning {i}", "noun", "en"] for i in range(40)])
+    monkeypatch.setattr(logic, "prefetcher", prefetch.Prefetcher(logic.build_quiz_batch, workers=1))
+    logic.prefetch_next_batch(1, DAY, size=10)
+    _wait_for(lambda: len(logic.prefetcher.reserved_ids(1, DAY)) == 10)
+    reserved = logic.prefetcher.reserved_ids(1, DAY)
+
+    built = {it["word_id"] for it in logic.build_quiz_batch(1, DAY, size=20)}  # another tab
+    assert len(built) == 20 and not built & reserved
+    logic.record_served_words(1, list(built), DAY)
+    taken = {it["word_id"] for it in logic.take_prefetched_batch(1, DAY, size=10)}
+    assert taken == reserved and logic.prefetcher.reserved_ids(1, DAY) == set()
+
+
+def test_unclaimed_reservations_expire(db_path):
+    prefetcher = prefetch.Prefetcher(lambda user_id, day, size: _items(1, 2, 3), workers=1, ttl=0.05)
+    prefetcher.schedule(1, DAY, 3)
+    _wait_for(lambda: prefetcher.reserved_ids(1, DAY) == {1, 2, 3})
+    time.sleep(0.1)
+    assert prefetcher.reserved_ids(1, DAY) == set()
+    assert prefetcher.take(1, DAY, 3) is None
+    stats = prefetcher.stats()
+    assert (stats["expired"], stats["reserved"], stats["misses"]) == (1, 0, 1)
+
+
+def test_stats_count_hits_late_hits_and_misses(db_path):
+    release = threading.Event()
+
+    def build(user_id, day, size):
+        if user_id == 2:
+            release.wait(5)
+        return _items(*range(size))
+
+    prefetcher = prefetch.Prefetcher(build, workers=2)
+    assert prefetcher.take(1, DAY, 2) is None  # nothing scheduled
+    prefetcher.schedule(1, DAY, 2)
+    prefetcher.schedule(1, DAY, 2)  # already reserved: not built twice
+    _wait_for(lambda: prefetcher.reserved_ids(1, DAY))
+    assert prefetcher.take(1, DAY, 2) == _items(0, 1)
+
+    prefetcher.schedule(2, DAY, 3)  # still building when taken
+    threading.Timer(0.05, release.set).start()
+    assert prefetcher.take(2, DAY, 3) == _items(0, 1, 2)
+
+    prefetcher.schedule(3, DAY, 2)
+    assert prefetcher.take(3, DAY, 5) is None  # another size is a miss and releases the reservation
+    assert prefetcher.stats() == {"scheduled": 3, "hits": 1, "late_hits": 1, "misses": 2,
+                                  "expired": 0, "reserved": 0, "hit_rate": 0.5}
+
+
+def test_discard_releases_the_reservation(db_path):
+    prefetcher = prefetch.Prefetcher(lambda user_id, day, size: _items(7, 8), workers=1)
+    prefetcher.schedule(1, DAY, 2)
+    _wait_for(lambda: prefetcher.reserved_ids(1, DAY) == {7, 8})
+    prefetcher.discard(1, DAY)
+    assert prefetcher.reserved_ids(1, DAY) == set()
+    assert prefetcher.take(1, DAY, 2) is None
+    assert prefetcher.stats()["reserved"] == 0
+
+
+def test_take_builds_a_fresh_batch_on_a_miss(db_path, monkeypatch):
+    logic.add_word_rows([[f"word{i}", f"meaning {i}", "noun", "en"] for i in range(30)])
+    monkeypatch.setattr(logic, "prefetcher", prefetch.Prefetcher(logic.build_quiz_batch, workers=1))
+    batch = logic.take_prefetched_batch(1, DAY, size=10)
+    assert len({it["word_id"] for it in batch}) == 10
+    assert logic.prefetcher.stats()["misses"] == 1
@@ -0,0 +1,71 @@
+import sqlite3
+
+import pytest
+
+from backend import db, logic, profiling
+
+
+@pytest.fixture
+def profiled(db_path):
+    profiling.reset()
+    profiling.enable()
+    yield
+    profiling.enable(False)
+    profiling.reset()
+
+
+def _answer_one(user_id=1):
+    logic.add_word_rows([[f"word{i}", f"meaning {i}", "noun", "en"] for i in range(10)])
+    session_id = logic.start_or_resume_session(user_id)
+    items = logic.build_quiz_batch(user_id, size=5)
+    logic.create_session_items(session_id, items)
+    logic.save_attempt(user_id, session_id, items[0]["word_id"], items[0]["answer"], True, 900)
+    return session_id
+
+
+def test_records_functions_and_statements(profiled):
+    session_id = _answer_one()
+    logic.session_summary(session_id)
+    snap = profiling.snapshot()
+    assert snap["functions"]["logic.save_attempt"]["count"] == 1
+    assert snap["functions"]["logic.build_quiz_batch"]["count"] == 1
+    summary = next(s for sql, s in snap["statements"].items() if "FROM session_items si JOIN words" in sql)
+    assert summary["count"] == 1 and summary["rows"] == 5
+    assert snap["statements"]["COMMIT"]["count"] >= 3
+
+
+def test_prometheus_histograms_are_cumulative(profiled):
+    _answer_one()
+    text = profiling.to_prometheus()
+    buckets = [int(line.rsplit(" ", 1)[1]) for line in text.splitlines()
+               if line.startswith('wordapp_function_duration_seconds_bucket{function="logic.save_attempt"')]
+    assert buckets == sorted(buckets) and buckets[-1] == 1
+    assert 'wordapp_function_duration_seconds_count{function="logic.save_attempt"} 1' in text
+
+
+def test_nothing_recorded_when_off(db_path):
+    profiling.reset()
+    _answer_one()
+    snap = profiling.snapshot()
+    assert not snap["functions"] and not snap["statements"]
+
+
+def test_write_lock_waits_are_timed_apart(profiled):
+    _answer_one()
+    waits = profiling.snapshot()["lock_wait"]["count"]
+    assert waits >= 1  # add_word_rows and the attempt flush begin immediately
+    with db.get_conn() as holder, db.get_conn() as waiter:
+        holder.execute("BEGIN IMMEDIATE")
+        waiter.execute("PRAGMA busy_timeout=50")
+        with pytest.raises(sqlite3.OperationalError, match="locked"):
+            waiter.execute("BEGIN IMMEDIATE")
+        holder.rollback()
+        waiter.execute("PRAGMA busy_timeout=5000")
+        first = profiling.snapshot()["first_write"]["count"]
+        waiter.execute("INSERT INTO app_meta(key, value) VALUES('a', 1)")  # takes the lock itself
+        waiter.execute("INSERT INTO app_meta(key, value) VALUES('b', 2)")  # already holds it
+        waiter.commit()
+    snap = profiling.snapshot()
+    assert snap["lock_wait"]["count"] == waits + 2 and snap["lock_wait"]["max_ms"] >= 40
+    assert snap["first_write"]["count"] == first + 1
+    assert "wordapp_sql_lock_wait_seconds_count" in profiling.to_prometheus()
@@ -0,0 +1,125 @@
+import os
+import sqlite3
+
+import pytest
+
+from backend import analytics, auth, db, logic, maintenance, migrations, shards
+
+WORDS = ([[f"word{i}", f"meaning {i}", "noun", "en"] for i in range(40)]
+         + [[f"mot{i}", f"sens {i}", "nom", "fr"] for i in range(40)])
+
+
+@pytest.fixture
+def sharded(db_path):
+    assert db.init_db(shards=3) == 3
+    return db_path
+
+
+def _play(user_id, words=4):
+    """One answered session; returns its id."""
+    session_id = logic.start_or_resume_session(user_id)
+    items = logic.build_quiz_batch(user_id, size=words)
+    logic.record_served_words(user_id, [it["word_id"] for it in items])
+    logic.create_session_items(session_id, items)
+    for i, it in enumerate(items):
+        logic.save_attempt(user_id, session_id, it["word_id"], it["answer"], i % 2 == 0, 1000)
+    return session_id
+
+
+def _rows(path, sql):
+    con = sqlite3.connect(path)
+    try:
+        return con.execute(sql).fetchall()
+    finally:
+        con.close()
+
+
+def test_user_rows_are_routed_to_their_shard(sharded):
+    logic.add_word_rows(WORDS)
+    users = [auth.create_user(f"user{i}", "pw") for i in range(8)]
+    logic.set_user_language(users[0], "fr")
+    sessions = {uid: _play(uid) for uid in users}
+    logic.submit_attempt(users[1], sessions[users[1]], 1, "x", False)
+    logic.flush_attempts()
+
+    for uid, session_id in sessions.items():
+        assert session_id >> db.SESSION_ID_BITS == db.shard_of(uid)
+        assert logic.session_summary(session_id)["total"] == 4
+        items, position = logic.resume_session_items(session_id)
+        assert len(items) == 4 and position == 4
+        logic.mark_session_completed(session_id)
+        assert logic.get_user_stats(uid)["attempts"] == (5 if uid == users[1] else 4)
+    assert len({db.shard_of(uid) for uid in users}) > 1
+    for shard in range(3):
+        owners = {uid for (uid,) in _rows(db.shard_path(shard), "SELECT DISTINCT user_id FROM user_attempts")}
+        assert all(db.shard_of(uid) == shard for uid in owners)
+    for table in shards.SHARD_TABLES:
+        assert _rows(sharded, f"SELECT COUNT(*) FROM {table}") == [(0,)]
+    # the language trigger reads words from the attached catalog
+    languages = _rows(db.shard_path(db.shard_of(users[0])),
+                      f"SELECT DISTINCT language FROM user_word_state WHERE user_id={users[0]}")
+    assert languages == [("fr",)]
+
+    top, rank = logic.get_leaderboard(limit=20, user_id=users[3])
+    assert len(top) == 8 and [r["rank"] for r in top] == list(range(1, 9))
+    assert [r["user_id"] for r in top] == [r["user_id"] for r in sorted(
+        top, key=lambda r: (-r["mastered"], -r["correct"], r["user_id"]))]
+    assert rank == next(r["rank"] for r in top if r["user_id"] == users[3])
+    assert maintenance.run(retain_days=30, pause=0, shard=db.shard_of(users[0]))["rows_after"]["sessions"]
+
+
+def test_reshard_moves_every_row_and_back(db_path):
+    logic.add_word_rows(WORDS)
+    users = [auth.create_user(f"user{i}", "pw") for i in range(6)]
+    for uid in users:
+        for _ in range(2):
+            logic.mark_session_completed(_play(uid))
+    open_session = _play(users[2])
+    summary = logic.session_summary(open_session)
+    stats = {uid: logic.get_user_stats(uid) for uid in users}
+    attempts = _rows(db_path, "SELECT COUNT(*) FROM user_attempts")[0][0]
+
+    for layout in (3, 3, 2, 0):
+        report = shards.reshard(layout, batch=4)
+        assert report["moved"]["user_attempts"] == attempts and sum(report["attempts_per_shard"]) == attempts
+        analytics.invalidate()
+        assert db.shard_count() == layout
+        assert {uid: logic.get_user_stats(uid) for uid in users} == stats
+        # the open session keeps its items and answers under its new id
+        session_id = logic.start_or_resume_session(users[2])
+        assert logic.session_summary(session_id) == summary
+        assert layout == 0 or session_id >> db.SESSION_ID_BITS == db.shard_of(users[2])
+        assert logic.get_leaderboard(user_id=users[2])[1] is not None
+    assert not any(os.path.exists(db.shard_path(shard, n)) for n in (2, 3) for shard in range(n))
+
+
+def test_init_db_upgrades_shards_behind_the_catalog(sharded, monkeypatch):
+    logic.add_word_rows(WORDS)
+    user = auth.create_user("user0", "pw")
+    _play(user)
+    path = db.shard_path(db.shard_of(user))
+    con = sqlite3.connect(path)
+    con.execute("DROP INDEX idx_user_attempts_date")  # as a shard created at v12 has it
+    con.execute("DELETE FROM schema_version WHERE version>=13")
+    con.commit()
+    con.close()
+    db.close_pools()
+
+    assert db.init_db() == 3
+    assert _rows(path, "SELECT MAX(version) FROM schema_version") == [(migrations.LATEST_VERSION,)]
+    assert _rows(path, "SELECT name FROM sqlite_master WHERE name='idx_user_attempts_date'")
+    # catalog-only steps are recorded but not run
+    assert not _rows(path, "SELECT name FROM sqlite_master WHERE name IN ('word_vectors', 'users')")
+    assert logic.get_user_stats(user)["attempts"] == 4
+
+    # a step the shard cannot take is rolled back there and stops the start
+    version = migrations.LATEST_VERSION + 1
+    steps = ["CREATE INDEX IF NOT EXISTS idx_user_stats_attempts ON user_stats(attempts)",
+             lambda cur: cur.execute("UPDATE app_meta SET value=value WHERE key='shards'")]
+    monkeypatch.setattr(migrations, "MIGRATIONS", migrations.MIGRATIONS + [(version, "test", steps)])
+    monkeypatch.setattr(migrations, "LATEST_VERSION", version)
+    with pytest.raises(RuntimeError, match=f"upgrade .* to schema v{version}"):
+        db.init_db()
+    assert _rows(sharded, "SELECT MAX(version) FROM schema_version") == [(version,)]
+    assert _rows(path, "SELECT MAX(version) FROM schema_version") == [(version - 1,)]
+    assert not _rows(path, "SELECT name FROM sqlite_master WHERE name='idx_user_stats_attempts'")
@@ -0,0 +1,78 @@
+import random
+
+from backend import db, logic, srs
+
+
+def _session(user_id=1, words=6):
+    logic.add_word_rows([[f"word{i}", f"meaning {i}", "noun", "en"] for i in range(words)])
+    session_id = logic.start_or_resume_session(user_id)
+    logic.create_session_items(session_id, logic.build_quiz_batch(user_id, size=words))
+    return session_id
+
+
+def _state(word_id, user_id=1):
+    with db.get_conn() as con:
+        return con.execute("""
+            SELECT box, streak, max_box, round((julianday(due_at) - julianday(last_seen)) * 24)
+            FROM user_word_state WHERE user_id=? AND word_id=?
+        """, (user_id, word_id)).fetchone()
+
+
+def _stats(user_id=1):
+    with db.get_conn() as con:
+        return con.execute("SELECT attempts, correct, mastered FROM user_stats WHERE user_id=?",
+                           (user_id,)).fetchone()
+
+
+def _answer(session_id, word_id, correct, user_id=1):
+    logic.save_attempt(user_id, session_id, word_id, "x", correct, 1000)
+
+
+def test_correct_answers_climb_the_boxes_and_count_mastery_once(db_path):
+    session_id = _session()
+    for box in (2, 3, 4):
+        _answer(session_id, 1, True)
+        # (box, streak, max_box, hours until due)
+        assert _state(1) == (box, box - 1, box, srs.BOX_INTERVAL_DAYS[box] * 24)
+    assert _stats() == (3, 3, 1)
+
+    _answer(session_id, 1, False)
+    assert _state(1) == (1, 0, 4, 24)
+    assert _stats() == (4, 3, 1)
+
+    for _ in range(4):
+        _answer(session_id, 1, True)
+    assert _state(1) == (srs.MAX_BOX, 4, srs.MAX_BOX, srs.BOX_INTERVAL_DAYS[srs.MAX_BOX] * 24)
+    assert _stats() == (8, 7, 1)  # mastered again, but counted once
+
+
+def test_a_wrong_first_answer_starts_in_box_one(db_path):
+    session_id = _session()
+    _answer(session_id, 2, False)
+    assert _state(2) == (1, 0, 1, 24)
+    assert _stats() == (1, 0, 0)
+
+
+def test_rebuild_reproduces_the_incremental_state_and_stats(db_path):
+    rnd = random.Random(7)
+    sessions = {user_id: _session(user_id, words=6) if user_id == 1 else logic.start_or_resume_session(user_id)
+                for user_id in (1, 2)}
+    for _ in range(60):
+        user_id = rnd.choice((1, 2))
+        _answer(sessions[user_id], rnd.randint(1, 6), rnd.random() < 0.7, user_id)
+
+    def snapshot():
+        with db.get_conn() as con:
+            return (con.execute("SELECT * FROM user_word_state ORDER BY user_id, word_id").fetchall(),
+                    con.execute("SELECT * FROM user_stats ORDER BY user_id").fetchall())
+
+    incremental = snapshot()
+    assert len(incremental[0]) > 6 and sum(row[2] for row in incremental[1]) > 0
+    with db.get_conn() as con:
+        assert srs.rebuild_state(con.cursor()) == 2
+        con.commit()
+    assert snapshot() == incremental
+    with db.get_conn() as con:
+        srs.rebuild_state(con.cursor(), user_id=2)
+        con.commit()
+    assert snapshot() == incremental
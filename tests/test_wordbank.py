@@ -0,0 +1,107 @@
+import glob
+import io
+
+from backend import db, importer, logic, wordbank
+
+WORDS = [[f"word{i}", f"meaning {i}", "noun" if i % 2 else "verb", "en"] for i in range(20)] + [
+    ["mot", "un sens", "nom", "fr"]]
+
+
+def _row_of_text(index, text):
+    """Linear scan; the index itself only looks rows up by id."""
+    for row, value in enumerate(index.texts):
+        if value == text:
+            return row
+    raise ValueError(f"{text!r} is not in the word bank")
+
+
+def _contents(index):
+    return (list(index.ids), list(index.texts), [index.language_of(w) for w in index.ids],
+            {key: list(rows) for key, rows in index.buckets.items()})
+
+
+def test_fresh_process_maps_the_snapshot_without_reading_words(db_path, monkeypatch):
+    logic.add_word_rows(WORDS)
+    written = wordbank.get_index()
+    assert isinstance(written, wordbank.SnapshotIndex)
+    wordbank.invalidate()  # as in another worker process
+
+    def no_table_reads(index, con):
+        raise AssertionError("words were read from SQLite")
+
+    monkeypatch.setattr(wordbank, "_load_new_rows", no_table_reads)
+    mapped = wordbank.get_index()
+    assert mapped is not written and isinstance(mapped.ids, memoryview)
+    assert _contents(mapped) == _contents(written)
+    assert mapped.text_of(mapped.ids[-1]) == "mot" and mapped.language_sizes() == {"en": 20, "fr": 1}
+
+
+def test_appends_and_rewrites_produce_the_same_index_as_a_full_load(db_path, monkeypatch):
+    logic.add_word_rows(WORDS[:10])
+    logic.add_word_rows(WORDS[10:] + [["élan", "énergie", "nom", "fr"]])  # appended to the previous snapshot
+    logic.add_word_rows([["word1", "meaning 1", "adjective", "en"]])  # rewrites a row's bucket
+    snapshot = wordbank.get_index()
+    assert glob.glob(db.DB_PATH + ".wordbank-*") == [snapshot.path]
+
+    monkeypatch.setattr(wordbank, "SNAPSHOTS", False)
+    wordbank.invalidate()
+    private = wordbank.get_index()
+    assert isinstance(private, wordbank.WordBankIndex)
+    assert _contents(snapshot) == _contents(private)
+    assert snapshot.bucket("en", "adjective") and "élan" in snapshot.texts
+
+
+def test_unreadable_snapshot_falls_back_to_a_private_index(db_path):
+    logic.add_word_rows(WORDS)
+    path = wordbank.get_index().path
+    wordbank.invalidate()
+    with open(path, "r+b") as fh:
+        fh.write(b"garbage!")
+    index = wordbank.get_index()
+    assert isinstance(index, wordbank.WordBankIndex) and len(index) == len(WORDS)
+
+
+def test_rows_appended_between_import_chunks_come_from_a_delta(db_path):
+    logic.add_word_rows(WORDS)
+    published = wordbank.get_index().path
+    seen = []
+
+    def between_chunks(report):
+        index = wordbank.get_index()  # a page view while the import runs
+        assert glob.glob(db.DB_PATH + ".wordbank-*") == [published]
+        seen.append((type(index).__name__, len(index), index.text_of(index.ids[-1])))
+
+    rows = "".join(f"new{i},meaning {i},noun,en\n" for i in range(6))
+    importer.import_csv(io.StringIO("text,definition,part_of_speech,language\n" + rows),
+                        chunk_rows=2, progress=between_chunks)
+    assert seen == [("PatchedIndex", len(WORDS) + n, f"new{n - 1}") for n in (2, 4, 6)]
+
+    snapshot = wordbank.get_index()  # the import published the next version
+    assert isinstance(snapshot, wordbank.SnapshotIndex)
+    assert glob.glob(db.DB_PATH + ".wordbank-*") == [snapshot.path] != [published]
+    assert snapshot.ids[_row_of_text(snapshot, "new5")] == snapshot.high_water
+
+
+def test_unpublished_version_is_patched_in_until_its_snapshot_exists(db_path, monkeypatch):
+    logic.add_word_rows(WORDS)
+    wordbank.get_index()
+    with db.get_conn() as con:  # another process commits new words but has not published yet
+        con.execute("BEGIN IMMEDIATE")
+        importer.upsert_rows(con.cursor(), [importer.word_row("élan", "énergie", "nom", "fr")])
+        wordbank.bump_version(con.cursor())
+        con.commit()
+    patched = wordbank.get_index()
+    assert isinstance(patched, wordbank.PatchedIndex) and len(glob.glob(db.DB_PATH + ".wordbank-*")) == 1
+    assert patched.language_sizes() == {"en": 20, "fr": 2}
+    assert patched.language_of(patched.high_water) == "fr" and "élan" in patched.texts
+    assert sorted(patched.sample_ids(5, language="fr")) == [patched.ids[_row_of_text(patched, t)]
+                                                             for t in ("mot", "élan")]
+
+    monkeypatch.setattr(wordbank, "SNAPSHOTS", False)
+    wordbank.invalidate()
+    private = wordbank.get_index()
+    monkeypatch.setattr(wordbank, "SNAPSHOTS", True)
+    wordbank.invalidate()
+    with db.get_conn() as con:
+        wordbank.publish(con)
+    assert _contents(patched) == _contents(private) == _contents(wordbank.get_index())
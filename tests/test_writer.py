@@ -0,0 +1,130 @@
+import threading
+import time
+
+import pytest
+
+from backend import logic, writer
+
+
+def _queue(write_batch, **kwargs):
+    return writer.WriteBehindQueue(write_batch, maxsize=100, batch_size=8, name="test-writer", **kwargs)
+
+
+def test_flush_returns_while_other_producers_keep_submitting():
+    written = []
+
+    def write(items, durable):
+        time.sleep(0.002)
+        written.extend(items)
+
+    q = _queue(write)
+    stop = threading.Event()
+
+    def produce(n):
+        i = 0
+        while not stop.is_set():
+            q.submit((n, i))
+            i += 1
+
+    producers = [threading.Thread(target=produce, args=(n,)) for n in range(4)]
+    for t in producers:
+        t.start()
+    try:
+        time.sleep(0.05)
+        q.submit(("mine", 0))
+        q.flush(timeout=5)  # only waits for what was queued before the call
+        assert ("mine", 0) in written
+    finally:
+        stop.set()
+        for t in producers:
+            t.join()
+    q.flush(timeout=5)
+    assert q.stats()["pending"] == 0 and q.stats()["written"] == q.stats()["submitted"]
+
+
+def test_durable_submit_waits_for_the_write():
+    seen = []
+    q = _queue(lambda items, durable: seen.append((list(items), durable)))
+    q.submit("a", durable=True)
+    assert seen == [(["a"], True)]
+
+
+def test_failed_batch_is_retried_per_item_and_raised_to_durable_submitters(monkeypatch):
+    monkeypatch.setattr(writer, "WRITE_RETRIES", 2)
+    written = []
+    gate = threading.Event()
+
+    def write(items, durable):
+        gate.wait()
+        if "bad" in items:
+            raise OSError("disk full")
+        written.extend(items)
+
+    q = _queue(write)
+    q.submit("first")  # holds the writer until the rest is queued, so they share one batch
+    q.submit("good")
+    errors = []
+
+    def durable_bad():
+        try:
+            q.submit("bad", durable=True)
+        except OSError as e:
+            errors.append(e)
+
+    t = threading.Thread(target=durable_bad)
+    t.start()
+    time.sleep(0.05)
+    gate.set()
+    t.join(5)
+    q.flush(timeout=5)
+    assert [str(e) for e in errors] == ["disk full"]
+    assert sorted(written) == ["first", "good"]
+    assert q.stats()["failed"] == 1 and "disk full" in q.stats()["last_error"]
+
+
+def test_groups_are_written_separately():
+    calls = []
+    gate = threading.Event()
+
+    def write(items, durable):
+        gate.wait()
+        calls.append(sorted(items))
+
+    q = _queue(write, group_by=lambda item: item % 2)
+    for i in range(8):
+        q.submit(i)
+    gate.set()
+    q.flush(timeout=5)
+    assert sorted(i for call in calls for i in call) == list(range(8))
+    assert all(len({i % 2 for i in call}) == 1 for call in calls)
+
+
+def test_item_that_cannot_be_grouped_is_dropped_alone():
+    written = []
+    q = _queue(lambda items, durable: written.extend(items), group_by=lambda item: item.to_bytes(1, "little"))
+    q.submit(1)
+    with pytest.raises(AttributeError):
+        q.submit("not an id", durable=True)
+    q.submit(2)
+    q.flush(timeout=5)
+    assert written == [1, 2] and q.stats()["failed"] == 1 and q.stats()["pending"] == 0
+
+
+def test_flush_returns_even_if_the_write_path_breaks(monkeypatch):
+    q = _queue(lambda items, durable: None)
+    monkeypatch.setattr(q, "_write", lambda batch: 1 / 0)
+    with pytest.raises(ZeroDivisionError):
+        q.submit("a", durable=True)
+    q.submit("b")
+    q.flush(timeout=5)
+    assert q.stats()["pending"] == 0 and q.stats()["failed"] == 2
+
+
+def test_submit_attempt_durable_writes_through(db_path):
+    logic.add_word_rows([[f"word{i}", f"meaning {i}", "noun", "en"] for i in range(10)])
+    session_id = logic.start_or_resume_session(1)
+    logic.create_session_items(session_id, logic.build_quiz_batch(1, size=3))
+    logic.submit_attempt(1, session_id, 1, "x", True, 900, durable=True)
+    assert logic.get_user_stats(1)["attempts"] == 1
+    with pytest.raises(Exception):
+        logic.submit_attempt("not-a-user", session_id, 1, "x", True, 900, durable=True)